@@ -1,23 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
 from sqlalchemy.orm import Session
 from typing import List
 import tarfile
-import os
 import shutil
-import json
+import asyncio
 import subprocess
 from pathlib import Path
 from datetime import datetime
-import fnmatch
 
 from ....database import crud
 from ....database.database import get_db
-from ....core.config import BACKUP_DIR
-from ....schemas.backup import Backup, BackupCreateRequest, RestoreRequest
+from ....schemas.backup import Backup, BackupCreateRequest, BackupJob, BackupStoreStats, RestoreRequest
 from ....schemas.project import ProjectUpdate
+from ....services.backup_catalog import backup_catalog, sidecar_name
+from ....services.backup_jobs import backup_jobs, project_backup_dir, BackupInProgress
+from ....services.backup_store import backup_store, SNAPSHOT_SUFFIX
 
 router = APIRouter()
 
+# 进度推送的检查间隔 (秒)
+PROGRESS_PUSH_INTERVAL = 0.5
+BACKUP_PATTERNS = ["*.tar.gz", "*.7z", f"*{SNAPSHOT_SUFFIX}"]
+
 def get_project_or_404(db: Session, project_id: str):
     project = crud.get_project(db, project_id=project_id)
     if not project:
@@ -25,12 +29,68 @@ def get_project_or_404(db: Session, project_id: str):
     return project
 
 def get_project_backup_dir(project_name: str) -> Path:
-    project_backup_dir = BACKUP_DIR / project_name
-    project_backup_dir.mkdir(parents=True, exist_ok=True)
-    return project_backup_dir
+    return project_backup_dir(project_name)
+
+@router.get("/store", response_model=BackupStoreStats)
+def get_backup_store_stats():
+    """去重存储的数据块数量与实际占用空间"""
+    return backup_store.stats()
+
+@router.post("/store/gc")
+def collect_backup_store():
+    """按现存快照重建引用计数并删除孤立的数据块 (修复异常中断造成的泄漏)"""
+    return backup_store.gc()
+
+@router.get("/jobs", response_model=List[BackupJob])
+def list_backup_jobs(project_id: str | None = None):
+    """进行中以及最近结束的后台备份任务"""
+    return [job.snapshot() for job in backup_jobs.list_jobs(project_id)]
+
+@router.get("/jobs/{job_id}", response_model=BackupJob)
+def get_backup_job(job_id: str):
+    job = backup_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Backup job not found")
+    return job.snapshot()
+
+@router.post("/jobs/{job_id}/cancel", response_model=BackupJob)
+def cancel_backup_job(job_id: str):
+    job = backup_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Backup job not found")
+    job.cancel()
+    return job.snapshot()
+
+@router.websocket("/jobs/{job_id}/progress")
+async def backup_progress_stream(websocket: WebSocket, job_id: str):
+    """推送备份进度 (JSON，与 GET /jobs/{job_id} 相同)，任务结束后发送最终状态并关闭连接"""
+    await websocket.accept()
+    job = backup_jobs.get(job_id)
+    if not job:
+        await websocket.send_json({"error": "Backup job not found"})
+        await websocket.close()
+        return
+    sent_version = -1
+    try:
+        while True:
+            if job.version != sent_version:
+                sent_version = job.version
+                snapshot = job.snapshot()
+                await websocket.send_json(snapshot)
+                if snapshot["status"] != "RUNNING":
+                    break
+            await asyncio.sleep(PROGRESS_PUSH_INTERVAL)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        try:
+            await websocket.close()
+        except:
+            pass
 
-@router.post("/{project_id}", response_model=Backup)
+@router.post("/{project_id}", response_model=BackupJob, status_code=status.HTTP_202_ACCEPTED)
 def create_backup(project_id: str, request: BackupCreateRequest, db: Session = Depends(get_db)):
+    """在后台创建备份并立即返回任务；进度通过 /backups/jobs/{job_id}/progress 推送"""
     project = get_project_or_404(db, project_id)
     
     # 1. Update project's backup_ignore_patterns in DB
@@ -53,150 +113,37 @@ def create_backup(project_id: str, request: BackupCreateRequest, db: Session = D
     if not build_path.exists() or not build_path.is_dir():
          raise HTTPException(status_code=400, detail=f"Build path {build_path} does not exist or is not a directory")
 
-    project_backup_dir = get_project_backup_dir(project.name)
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = f"{project.name}-{timestamp}.7z"
-    filepath = project_backup_dir / filename
-    
-    # Sidecar metadata file
-    meta_filename = f"{project.name}-{timestamp}.json"
-    meta_filepath = project_backup_dir / meta_filename
-
-    # Create a temporary file list for 7z
-    list_file_path = project_backup_dir / f"list_{timestamp}.txt"
-
+    # 2. Scan and compress in the background
     try:
-        # 1. Manually collect files to include based on ignore patterns
-        include_files = []
-        for root, dirs, files in os.walk(build_path):
-            # Calculate relative path from build_path
-            rel_root = os.path.relpath(root, build_path)
-            if rel_root == ".":
-                rel_root = ""
-            
-            # Filter directories in-place to prevent os.walk from entering them
-            dirs_to_keep = []
-            for d in dirs:
-                rel_dir = os.path.join(rel_root, d).replace(os.sep, '/')
-                is_ignored = False
-                for pattern in request.ignore_patterns:
-                    p = pattern.strip()
-                    if not p: continue
-                    clean_pattern = p.lstrip('/')
-                    if '/' in clean_pattern:
-                        if fnmatch.fnmatch(rel_dir, clean_pattern):
-                            is_ignored = True
-                            break
-                    else:
-                        if fnmatch.fnmatch(d, clean_pattern):
-                            is_ignored = True
-                            break
-                if not is_ignored:
-                    dirs_to_keep.append(d)
-            dirs[:] = dirs_to_keep # This controls the recursion
-
-            # Collect files
-            for f in files:
-                rel_file = os.path.join(rel_root, f).replace(os.sep, '/')
-                is_ignored = False
-                for pattern in request.ignore_patterns:
-                    p = pattern.strip()
-                    if not p: continue
-                    clean_pattern = p.lstrip('/')
-                    if '/' in clean_pattern:
-                        if fnmatch.fnmatch(rel_file, clean_pattern):
-                            is_ignored = True
-                            break
-                    else:
-                        if fnmatch.fnmatch(f, clean_pattern):
-                            is_ignored = True
-                            break
-                if not is_ignored:
-                    # 7z @listfile needs paths relative to the working directory or absolute
-                    # We will run 7z in build_path, so we use relative paths
-                    include_files.append(os.path.join(rel_root, f))
-
-        # 2. Write the list to a temporary file
-        with open(list_file_path, 'w', encoding='utf-8') as f:
-            for item in include_files:
-                f.write(f"{item}\n")
-
-        # 3. Call 7z using the list file
-        # -mx=1: Fast compression
-        # -m0=lzma2: Force LZMA2
-        # -mf=off: Explicitly disable all filters (BCJ/BCJ2) to avoid "Unknown Method" errors
-        # -mmt=on: Multi-threading
-        cmd = [
-            "7z", "a", 
-            "-t7z", 
-            "-mx=1", 
-            "-m0=lzma2",
-            "-mf=off",
-            "-mmt=on",
-            str(filepath), 
-            f"@{str(list_file_path)}"
-        ]
-        
-        result = subprocess.run(cmd, cwd=build_path, capture_output=True, text=True)
-        if result.returncode != 0:
-             raise Exception(f"7z failed (code {result.returncode}): {result.stderr}")
-        
-        # Write metadata
-        if request.remark:
-             with open(meta_filepath, 'w', encoding='utf-8') as f:
-                 json.dump({"remark": request.remark}, f)
-                 
-    finally:
-        # Cleanup the temporary list file
-        if list_file_path.exists():
-            list_file_path.unlink()
-
-    stat = filepath.stat()
-    return Backup(
-        filename=filename,
-        size=stat.st_size,
-        created_at=datetime.fromtimestamp(stat.st_ctime).isoformat(),
-        remark=request.remark
-    )
+        job = backup_jobs.submit(project.id, project.name, str(build_path), request.ignore_patterns, request.remark, request.format)
+    except BackupInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.snapshot()
 
 @router.get("/{project_id}", response_model=List[Backup])
-def list_backups(project_id: str, db: Session = Depends(get_db)):
+def list_backups(
+    project_id: str,
+    response: Response,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    refresh: bool = Query(False, description="先与备份目录对账，发现手工增删的备份文件"),
+    db: Session = Depends(get_db),
+):
+    """按创建时间倒序分页返回备份，总数在 X-Total-Count 响应头中"""
     project = get_project_or_404(db, project_id)
-    project_backup_dir = get_project_backup_dir(project.name)
-    
-    backups = []
-    if project_backup_dir.exists():
-        # Support both .tar.gz and .7z
-        files = list(project_backup_dir.glob("*.tar.gz")) + list(project_backup_dir.glob("*.7z"))
-        for file in files:
-            stat = file.stat()
-            remark = None
-            
-            # Check for sidecar metadata
-            # Replace extension with .json
-            if file.name.endswith('.tar.gz'):
-                meta_file = project_backup_dir / file.name.replace('.tar.gz', '.json')
-            else:
-                meta_file = project_backup_dir / file.name.replace('.7z', '.json')
-            
-            if meta_file.exists():
-                try:
-                    with open(meta_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        remark = data.get("remark")
-                except:
-                    pass
-
-            backups.append(Backup(
-                filename=file.name,
-                size=stat.st_size,
-                created_at=datetime.fromtimestamp(stat.st_ctime).isoformat(),
-                remark=remark
-            ))
-    
-    # Sort by creation time descending
-    backups.sort(key=lambda x: x.created_at, reverse=True)
-    return backups
+    records, total = backup_catalog.list_backups(db, project.name, offset, limit, refresh=refresh)
+    response.headers["X-Total-Count"] = str(total)
+    return [Backup(
+        filename=r.filename,
+        size=r.size,
+        created_at=datetime.fromtimestamp(r.created_at).isoformat(),
+        remark=r.remark,
+        format=r.format,
+        stored_size=r.stored_size,
+        file_count=r.file_count,
+        ignore_patterns=r.ignore_patterns.split("\n") if r.ignore_patterns is not None else None,
+        checksum=r.checksum,
+    ) for r in records]
 
 @router.delete("/{project_id}/clear_all")
 def clear_all_backups(project_id: str, db: Session = Depends(get_db)):
@@ -204,15 +151,21 @@ def clear_all_backups(project_id: str, db: Session = Depends(get_db)):
     project_backup_dir = get_project_backup_dir(project.name)
     
     if not project_backup_dir.exists():
+        backup_catalog.remove(db, project.name)
         return {"status": "success", "message": "No backups to delete"}
 
     try:
-        # Delete all .7z, .tar.gz and .json files in the project backup directory
+        # Delete all backups and .json sidecars in the project backup directory;
+        # snapshots release their chunks from the shared store
         count = 0
-        for ext in ["*.7z", "*.tar.gz", "*.json"]:
+        for ext in [*BACKUP_PATTERNS, "*.json"]:
             for file in project_backup_dir.glob(ext):
-                file.unlink()
+                if file.name.endswith(SNAPSHOT_SUFFIX):
+                    backup_store.release(file)
+                else:
+                    file.unlink()
                 count += 1
+        backup_catalog.remove(db, project.name)
         return {"status": "success", "message": f"Cleared {count} backup related files"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to clear backups: {str(e)}")
@@ -233,13 +186,17 @@ def delete_backup(project_id: str, filename: str, db: Session = Depends(get_db))
         raise HTTPException(status_code=403, detail="Invalid backup file path")
 
     try:
-        filepath.unlink()
+        if filename.endswith(SNAPSHOT_SUFFIX):
+            # 引用计数减一，回收不再被任何快照引用的数据块
+            backup_store.release(filepath)
+        else:
+            filepath.unlink()
         
         # Try delete metadata sidecar
-        meta_filename = filename.replace('.tar.gz', '.json').replace('.7z', '.json')
-        meta_file = project_backup_dir / meta_filename
+        meta_file = project_backup_dir / sidecar_name(filename)
         if meta_file.exists():
             meta_file.unlink()
+        backup_catalog.remove(db, project.name, [filename])
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete backup: {str(e)}")
@@ -277,7 +234,9 @@ def restore_backup(project_id: str, request: RestoreRequest, db: Session = Depen
                     item.unlink()
         
         # Restore
-        if filepath.suffix == ".7z":
+        if filepath.name.endswith(SNAPSHOT_SUFFIX):
+            backup_store.restore(filepath, build_path)
+        elif filepath.suffix == ".7z":
             # 7z x [archive] -o[output_dir] -y
             cmd = ["7z", "x", str(filepath), f"-o{str(build_path)}", "-y"]
             result = subprocess.run(cmd, capture_output=True, text=True)
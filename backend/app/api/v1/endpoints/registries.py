@@ -1,78 +1,90 @@
-import docker
+import asyncio
+import time
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from ....database import crud
 from ....database.database import get_db
 from ....schemas import registry as registry_schema
+from ....services import registry_probe
+from ....services.builder_pool import builder_pool
+from ....services.registry_monitor import registry_monitor, summarize_samples
 
 router = APIRouter()
 
-@router.post("/test", status_code=200)
-def test_registry_connection(registry: registry_schema.RegistryCreate, db: Session = Depends(get_db)):
-    """测试仓库连接和凭据是否有效"""
-    import requests
-    from urllib.parse import urlparse
-    
-    # 1. 构造强制协议的 URL
-    raw_url = registry.url.replace("https://", "").replace("http://", "")
-    protocol = "https" if registry.is_https else "http"
-    url = f"{protocol}://{raw_url}"
-    
-    parsed = urlparse(url)
-    reg_host = parsed.netloc if parsed.netloc else parsed.path.split('/')[0]
-    api_url = f"{url.rstrip('/')}/v2/"
+def _load_credential(db: Session, credential_id: str) -> tuple[str, str] | None:
+    cred = crud.get_credential(db, credential_id)
+    return (cred.username, cred.encrypted_password) if cred else None
 
-    # 2. 强一致性协议检测：先用 Requests 探测用户选的协议是否真的支持
-    try:
-        # 尝试连接用户选择的协议
-        resp = requests.get(api_url, timeout=5, verify=False)
-        # 如果通了（200 或 401 都算协议通了），则继续执行后续逻辑
-    except Exception as e:
-        # 如果用户选了 HTTPS 但失败了，探测一下是不是其实只支持 HTTP
-        if registry.is_https:
-            try:
-                http_test_url = f"http://{reg_host}/v2/"
-                h_resp = requests.get(http_test_url, timeout=3)
-                if h_resp.status_code in [200, 401]:
-                    return {"status": "warning", "message": f"❌ 协议不匹配: 该仓库似乎只支持 HTTP，请切换设置"}
-            except: pass
-        raise HTTPException(status_code=400, detail=f"连接失败: 无法通过 {protocol.upper()} 访问该地址")
+def _load_registries(db: Session) -> list[dict]:
+    """读取所有仓库及其凭据 (在线程中执行，返回普通字典，不把 ORM 对象带回事件循环)"""
+    registries = []
+    for r in crud.get_registries(db):
+        cred = _load_credential(db, r.credential_id) if r.credential_id else None
+        registries.append({"id": r.id, "name": r.name, "url": r.url, "is_https": r.is_https,
+                           "credential_id": r.credential_id, "credential": cred})
+    return registries
 
-    # 3. 登录验证逻辑
+@router.post("/test", status_code=200)
+async def test_registry_connection(registry: registry_schema.RegistryCreate, db: Session = Depends(get_db)):
+    """测试仓库连接和凭据是否有效 (HTTPS/HTTP 并发探测，凭据通过令牌服务验证)"""
+    username, password = None, None
     if registry.credential_id:
+        # 同步的数据库访问放到线程中，不阻塞事件循环
+        cred = await asyncio.to_thread(_load_credential, db, registry.credential_id)
+        if not cred:
+            raise HTTPException(status_code=400, detail="关联的凭据不存在")
+        username, password = cred
+
+    result = await registry_probe.test_registry(registry.url, registry.is_https, username, password)
+    if result["status"] == "error":
+        raise HTTPException(status_code=400, detail=result["message"])
+    return result
+
+@router.post("/test_all", response_model=List[registry_schema.RegistryTestResult])
+async def test_all_registries(db: Session = Depends(get_db)):
+    """并发测试所有已配置仓库的连通性与凭据，返回每个仓库的结果和延迟"""
+    async def test_one(registry: dict):
+        username, password = registry["credential"] or (None, None)
         try:
-            client = docker.from_env()
-            cred = crud.get_credential(db, registry.credential_id)
-            if not cred:
-                raise Exception("关联的凭据不存在")
-            
-            # 执行登录测试
-            client.login(username=cred.username, password=cred.encrypted_password, registry=url)
-            return {"status": "success", "message": f"✅ 登录成功: 协议和凭据均已验证"}
+            result = await registry_probe.test_registry(registry["url"], registry["is_https"], username, password)
         except Exception as e:
-            error_msg = str(e)
-            if "401" in error_msg:
-                error_msg = "认证失败: 用户名或密码错误"
-            raise HTTPException(status_code=400, detail=error_msg)
-    
-    # 4. 匿名访问逻辑
-    else:
-        if reg_host in ["docker.io", "index.docker.io", "registry-1.docker.io"]:
-            return {"status": "warning", "message": "⚠️ Docker Hub 必须绑定凭据才能执行推送"}
-        
-        # 根据刚才探测的响应判断
-        # 这里 resp 变量在步骤 2 中已经获取到了
-        try:
-            resp = requests.get(api_url, timeout=5, verify=False)
-            if resp.status_code == 200:
-                return {"status": "success", "message": "✅ 连接成功: 该仓库允许匿名访问"}
-            elif resp.status_code == 401:
-                return {"status": "info", "message": "💡 地址有效: 但该仓库需要登录凭据"}
-            else:
-                return {"status": "error", "message": f"❌ 服务器返回异常状态码: {resp.status_code}"}
-        except:
-            raise HTTPException(status_code=400, detail="探测失败")
+            result = {"status": "error", "message": str(e), "latency_ms": None, "protocol": None}
+        if registry["credential_id"] and not registry["credential"]:
+            result = {**result, "status": "error", "message": "关联的凭据不存在"}
+        return {"registry_id": registry["id"], "name": registry["name"], **result}
+
+    registries = await asyncio.to_thread(_load_registries, db)
+    return await asyncio.gather(*(test_one(r) for r in registries))
+
+def _health(db: Session, registry, since: float, with_history: bool = False) -> dict:
+    samples = crud.get_registry_health_samples(db, since, registry_id=registry.id)
+    state = registry_monitor.get_state(registry.id) or {}
+    return {
+        "registry_id": registry.id,
+        "name": registry.name,
+        "available": state.get("available"),
+        "failing": state.get("failing", False),
+        "consecutive_failures": state.get("consecutive_failures", 0),
+        "last_checked": state.get("checked_at"),
+        "last_error": state.get("error"),
+        **summarize_samples(samples),
+        "history": samples if with_history else None,
+    }
+
+@router.get("/health", response_model=List[registry_schema.RegistryHealth])
+def read_registries_health(hours: float = Query(24, gt=0, le=24 * 30), db: Session = Depends(get_db)):
+    """所有仓库的当前健康状态，以及最近 hours 小时内的可用率和延迟 p50/p95 (来自后台定期探测)"""
+    since = time.time() - hours * 3600
+    return [_health(db, registry, since) for registry in crud.get_registries(db)]
+
+@router.get("/{registry_id}/health", response_model=registry_schema.RegistryHealth)
+def read_registry_health(registry_id: str, hours: float = Query(24, gt=0, le=24 * 30), db: Session = Depends(get_db)):
+    """单个仓库的健康汇总，附带窗口内的每次探测记录"""
+    db_registry = crud.get_registry(db, registry_id)
+    if not db_registry:
+        raise HTTPException(status_code=404, detail="Registry not found")
+    return _health(db, db_registry, time.time() - hours * 3600, with_history=True)
 
 @router.get("/", response_model=List[registry_schema.Registry])
 def read_registries(db: Session = Depends(get_db)):
@@ -83,14 +95,20 @@ def create_registry(registry: registry_schema.RegistryCreate, db: Session = Depe
     db_registry = crud.get_registry_by_name(db, name=registry.name)
     if db_registry:
         raise HTTPException(status_code=400, detail="Registry with this name already exists")
-    return crud.create_registry(db, registry=registry)
+    db_registry = crud.create_registry(db, registry=registry)
+    builder_pool.request_sync()
+    registry_monitor.request_probe()
+    return db_registry
 
 @router.put("/{registry_id}", response_model=registry_schema.Registry)
 def update_registry(registry_id: str, registry: registry_schema.RegistryCreate, db: Session = Depends(get_db)):
     db_registry = crud.get_registry(db, registry_id)
     if not db_registry:
         raise HTTPException(status_code=404, detail="Registry not found")
-    return crud.update_registry(db, db_registry=db_registry, registry_in=registry)
+    db_registry = crud.update_registry(db, db_registry=db_registry, registry_in=registry)
+    builder_pool.request_sync()
+    registry_monitor.request_probe()
+    return db_registry
 
 @router.delete("/{registry_id}")
 def delete_registry(registry_id: str, db: Session = Depends(get_db)):
@@ -98,4 +116,6 @@ def delete_registry(registry_id: str, db: Session = Depends(get_db)):
     if not db_registry:
         raise HTTPException(status_code=404, detail="Registry not found")
     crud.delete_registry(db, db_registry=db_registry)
+    builder_pool.request_sync()
+    registry_monitor.request_probe()
     return {"message": "Registry deleted successfully"}
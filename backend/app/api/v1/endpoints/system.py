@@ -1,24 +1,19 @@
-import subprocess
-import json
-import os
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, Depends
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Dict
-import asyncio
 import re
 
 from ....database.database import get_db
 from ....database import crud
+from ....core.config import BUILDER_DIR
+from ....services.builder_pool import builder_pool, parse_builder_status, DEFAULT_BUILDER
+from ....services.async_command import run_command, StreamingCommand, CommandError
+from ....services.system_status import system_status
 
 router = APIRouter()
 
-def run_command(cmd: List[str]) -> str:
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"命令执行失败: {e.stderr}")
+# /system/initialize 中每个步骤 (安装模拟器、创建和启动 Builder) 的最长等待时间 (秒)
+INIT_STEP_TIMEOUT = 600
 
 def clean_registry_url(url: str) -> str:
     if not url: return ""
@@ -27,33 +22,14 @@ def clean_registry_url(url: str) -> str:
     return s.strip()
 
 @router.get("/status")
-def get_system_status():
-    try:
-        buildx_version = run_command(["docker", "buildx", "version"])
-        builders_raw = run_command(["docker", "buildx", "ls", "--format", "json"])
-        builders = []
-        for line in builders_raw.splitlines():
-            if line.strip():
-                try: builders.append(json.loads(line))
-                except: pass
-        has_multiarch_builder = any(b.get("Name") == "web-pusher-builder" for b in builders)
-        platforms = []
-        for b in builders:
-            for node in b.get("Nodes", []):
-                platforms.extend(node.get("Platforms", []))
-        platforms = sorted(list(set(platforms)))
-        return {
-            "buildx_available": True,
-            "buildx_version": buildx_version,
-            "has_multiarch_builder": has_multiarch_builder,
-            "supported_platforms": platforms,
-            "is_ready": has_multiarch_builder and "linux/arm64" in platforms
-        }
-    except Exception as e:
-        return {"buildx_available": False, "error": str(e), "is_ready": False}
+async def get_system_status(refresh: bool = False):
+    """返回后台定期刷新的缓存状态；refresh=true 时立即重新检测"""
+    status = await system_status.get(refresh=refresh)
+    return {**status, "builder_pool": builder_pool.snapshot()}
 
 @router.post("/initialize")
-async def initialize_env(db: Session = Depends(get_db)):
+async def initialize_env(rebuild: bool = False, db: Session = Depends(get_db)):
+    """rebuild=true 时无论配置是否变化都重建默认 Builder"""
     async def event_generator():
         yield "--- 🚀 开始初始化多架构构建环境 (终极协议修复方案) ---\n"
         
@@ -70,47 +46,81 @@ async def initialize_env(db: Session = Depends(get_db)):
             
         yield f"需要特殊配置的仓库: {list(insecure_registries)}\n"
 
-        config_path = "/tmp/buildkitd.toml"
+        config_path = BUILDER_DIR / f"{DEFAULT_BUILDER}.toml"
         # 使用最显式的 TOML 格式
         config_content = "[worker.oci]\n  max-parallelism = 4\n\n"
-        for host in insecure_registries:
+        for host in sorted(insecure_registries):
             config_content += f'[registry."{host}"]\n'
             config_content += '  http = true\n'
             config_content += '  insecure = true\n\n'
 
-        with open(config_path, "w") as f:
-            f.write(config_content)
+        # 配置未变化且 Builder 正常运行时无需重建
+        previous_config = config_path.read_text(encoding="utf-8") if config_path.exists() else None
+        inspect = await run_command(["docker", "buildx", "inspect", DEFAULT_BUILDER], timeout=30, check=False)
+        builder_running = inspect.returncode == 0 and parse_builder_status(inspect.stdout) == "running"
+        needs_rebuild = rebuild or previous_config != config_content or not builder_running
+        config_path.write_text(config_content, encoding="utf-8")
         
         yield "--- 注入 BuildKit 配置 ---\n"
         yield config_content
         yield "--------------------------\n"
 
+        # 任一步骤失败时不再输出成功提示，最后给出失败汇总
+        failed_steps = []
+
         yield "\n> [1/3] 检查模拟器状态...\n"
-        subprocess.run(["docker", "run", "--privileged", "--rm", "tonistiigi/binfmt", "--install", "all"])
-        yield "模拟器已就绪。\n"
+        cmd = StreamingCommand(["docker", "run", "--privileged", "--rm", "tonistiigi/binfmt", "--install", "all"], timeout=INIT_STEP_TIMEOUT)
+        try:
+            async for line in cmd:
+                yield line
+        except CommandError as e:
+            yield f"⚠️ {e}\n"
+        if cmd.returncode != 0:
+            failed_steps.append("安装模拟器")
+            yield f"⚠️ 安装模拟器失败 (退出码 {cmd.returncode})\n"
+        else:
+            yield "模拟器已就绪。\n"
 
-        yield "\n> [2/3] 彻底重建 Builder 并绑定配置...\n"
-        subprocess.run(["docker", "buildx", "rm", "-f", "web-pusher-builder"], capture_output=True)
-        
-        # 增加 --driver-opt network=host 提升兼容性
-        create_cmd = [
-            "docker", "buildx", "create", 
-            "--name", "web-pusher-builder", 
-            "--driver", "docker-container", 
-            "--driver-opt", "network=host",
-            "--config", config_path,
-            "--use"
-        ]
-        subprocess.run(create_cmd, capture_output=True)
-        yield "Builder 重建完成。\n"
+        if needs_rebuild:
+            yield "\n> [2/3] 彻底重建 Builder 并绑定配置...\n"
+            await run_command(["docker", "buildx", "rm", "-f", DEFAULT_BUILDER], timeout=INIT_STEP_TIMEOUT, check=False)
+
+            # 增加 --driver-opt network=host 提升兼容性
+            create_cmd = [
+                "docker", "buildx", "create",
+                "--name", DEFAULT_BUILDER,
+                "--driver", "docker-container",
+                "--driver-opt", "network=host",
+                "--config", str(config_path),
+                "--use"
+            ]
+            created = await run_command(create_cmd, timeout=INIT_STEP_TIMEOUT, check=False)
+            if created.returncode != 0:
+                failed_steps.append("创建 Builder")
+                yield f"⚠️ 创建 Builder 失败: {created.stderr}\n"
+            else:
+                yield "Builder 重建完成。\n"
+        else:
+            yield "\n> [2/3] Builder 配置未变化且运行正常，跳过重建 (如需强制重建请使用 rebuild=true)\n"
+            await run_command(["docker", "buildx", "use", DEFAULT_BUILDER], timeout=INIT_STEP_TIMEOUT, check=False)
 
         yield "\n> [3/3] 强制启动引擎 (Bootstrap)...\n"
-        process = subprocess.Popen(["docker", "buildx", "inspect", "--bootstrap"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
-        for line in process.stdout: 
-            yield line
-            await asyncio.sleep(0.01)
-        process.wait()
+        cmd = StreamingCommand(["docker", "buildx", "inspect", "--bootstrap", DEFAULT_BUILDER], timeout=INIT_STEP_TIMEOUT)
+        try:
+            async for line in cmd:
+                yield line
+        except CommandError as e:
+            yield f"⚠️ {e}\n"
+        if cmd.returncode != 0:
+            failed_steps.append("启动 Builder")
+            yield f"⚠️ 启动 Builder 失败 (退出码 {cmd.returncode})\n"
+        # 同时检查各私有仓库的专用 builder，并刷新缓存的系统状态
+        builder_pool.request_sync()
+        system_status.invalidate()
         
-        yield "\n--- ✅ 初始化完毕。请再次尝试 ARM64 推送 ---\n"
+        if failed_steps:
+            yield f"\n--- ⚠️ 初始化未完成，失败的步骤: {'、'.join(failed_steps)}。请检查上方输出后重试 ---\n"
+        else:
+            yield "\n--- ✅ 初始化完毕。请再次尝试 ARM64 推送 ---\n"
 
     return StreamingResponse(event_generator(), media_type="text/plain")
@@ -1,96 +1,102 @@
 import uuid
 import asyncio
-import multiprocessing
+from contextlib import aclosing
+from datetime import datetime
 from typing import List
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, status
-from fastapi.responses import PlainTextResponse
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, Query, Request, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
 
-from ....core.config import TASK_MANAGER, LOG_DIR, TASK_LOG_SENTINEL
 from ....database import crud
 from ....database.database import get_db
-from ....services.docker_runner import run_docker_task
+from ....services.task_scheduler import task_scheduler
+from ....services.log_broadcaster import log_hub
+from ....services import log_reader, log_search, build_steps, build_batch
 from ....schemas import task as task_schema
 
 router = APIRouter()
 
 @router.post("/execute/{project_id}")
-def execute_task_endpoint(project_id: str, tag: str, db: Session = Depends(get_db)):
+def execute_task_endpoint(project_id: str, tag: str, priority: int = 0, force: bool = False, db: Session = Depends(get_db)):
+    """force=true 时忽略项目的“跳过未变化构建”设置，始终执行构建"""
     project = crud.get_project(db, project_id)
     if not project:
         raise HTTPException(status_code=404, detail="项目未找到")
 
-    registry, cred, proxy = None, None, None
-    if project.registry_id:
-        registry = crud.get_registry(db, project.registry_id)
-        if registry and registry.credential_id:
-            cred = crud.get_credential(db, registry.credential_id)
-    
-    if project.proxy_id:
-        proxy = crud.get_proxy(db, project.proxy_id)
-
     task_id = str(uuid.uuid4())
-    TASK_MANAGER[task_id] = {"status": "PENDING"}
-
-    crud.create_task_log(db=db, project_id=project_id, task_id=task_id, tag=tag)
-    
-    project_dict = {c.name: getattr(project, c.name) for c in project.__table__.columns}
-    # 构造带协议头的完整 URL
-    if registry:
-        protocol = "https" if registry.is_https else "http"
-        # 清洗可能存在的重复协议头
-        clean_url = registry.url.replace("https://", "").replace("http://", "")
-        full_reg_url = f"{protocol}://{clean_url}"
-    else:
-        full_reg_url = "https://docker.io"
-
-    project_dict['registry_url'] = full_reg_url
-    
-    cred_dict = {c.name: getattr(cred, c.name) for c in cred.__table__.columns} if cred else None
-    if cred_dict:
-        cred_dict['registry_url'] = full_reg_url
+    # 任务先进入持久化队列，由调度器在有空闲槽位时启动
+    task_scheduler.enqueue(db, project_id=project_id, task_id=task_id, tag=tag, priority=priority, force=force)
 
-    proxy_dict = {c.name: getattr(proxy, c.name) for c in proxy.__table__.columns} if proxy else None
-    
-    process = multiprocessing.Process(
-        target=run_docker_task, 
-        args=(task_id, project_dict, tag, cred_dict, proxy_dict)
-    )
-    process.daemon = True
-    process.start()
+    return {"task_id": task_id, "status": "QUEUED"}
 
-    return {"task_id": task_id}
+@router.post("/batch", response_model=task_schema.BatchBuildStatus)
+def execute_batch_endpoint(request: task_schema.BatchBuildRequest, db: Session = Depends(get_db)):
+    """
+    批量构建：按显式依赖和 Dockerfile 的 FROM 引用建立依赖图。
+    没有依赖关系的任务并行排队，下游任务在上游全部成功后自动入队，上游失败时只取消受影响的下游任务。
+    """
+    try:
+        nodes = build_batch.plan_batch(db, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    batch_id = task_scheduler.enqueue_batch(db, nodes, priority=request.priority, force=request.force)
+    return get_batch_status(batch_id, db)
+
+@router.get("/batch/{batch_id}", response_model=task_schema.BatchBuildStatus)
+def get_batch_status(batch_id: str, db: Session = Depends(get_db)):
+    """查看批量构建中每个任务的状态及其依赖"""
+    tasks = crud.get_batch_task_logs(db, batch_id)
+    if not tasks:
+        raise HTTPException(status_code=404, detail="批量构建未找到")
+    dependencies = crud.get_task_dependencies(db, [t.id for t in tasks])
+    return {
+        "batch_id": batch_id,
+        "tasks": [
+            {"task_id": t.id, "project_id": t.project_id, "tag": t.tag, "status": t.status, "depends_on": dependencies[t.id]}
+            for t in tasks
+        ],
+    }
+
+@router.get("/queue")
+def get_task_queue(db: Session = Depends(get_db)):
+    """查看调度器当前的运行槽位与排队中的任务"""
+    queued = crud.get_queued_task_logs(db)
+    return {
+        **task_scheduler.snapshot(),
+        "queued": [task_schema.TaskLog.model_validate(t) for t in queued],
+    }
+
+@router.get("/search", response_model=List[task_schema.LogSearchResult])
+def search_logs(
+    q: str = Query(..., min_length=1, description="要检索的文本 (按短语匹配)"),
+    project_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = Query(20, ge=1, le=200),
+    db: Session = Depends(get_db),
+):
+    """在所有任务日志中全文检索，按相关度返回任务及命中行片段 (line_no 可配合 content 接口的 offset 使用)"""
+    return log_search.search_task_logs(db, q, project_id=project_id, since=since, until=until, limit=limit)
 
 @router.websocket("/logs/{task_id}")
 async def websocket_log_stream(websocket: WebSocket, task_id: str):
     await websocket.accept()
-    log_file = LOG_DIR / f"{task_id}.log"
-    
+
     retries = 10
-    while not log_file.exists() and retries > 0:
+    while not log_reader.task_log_exists(task_id) and retries > 0:
         await asyncio.sleep(0.5)
         retries -= 1
 
-    if not log_file.exists():
+    if not log_reader.task_log_exists(task_id):
         await websocket.send_text(f"❌ 错误: 任务 {task_id} 的日志文件未能创建。")
         await websocket.close()
         return
 
     try:
-        with open(log_file, "r", encoding="utf-8") as f:
-            for line in f:
-                if TASK_LOG_SENTINEL in line:
-                    break
+        # 同一任务的所有客户端共享一个广播器，新日志行由广播器主动推送
+        async with aclosing(log_hub.stream(task_id)) as lines:
+            async for line in lines:
                 await websocket.send_text(line.strip())
-
-            while TASK_LOG_SENTINEL not in line:
-                line = f.readline()
-                if line:
-                    if TASK_LOG_SENTINEL in line:
-                        break
-                    await websocket.send_text(line.strip())
-                else:
-                    await asyncio.sleep(0.2)
     except WebSocketDisconnect:
         print(f"Client for task {task_id} disconnected.")
     except Exception as e:
@@ -100,20 +106,88 @@ async def websocket_log_stream(websocket: WebSocket, task_id: str):
         except:
             pass
     finally:
-        await websocket.close()
+        try:
+            await websocket.close()
+        except:
+            pass
 
 @router.get("/projects/{project_id}/logs", response_model=List[task_schema.TaskLog])
 def get_project_logs(project_id: str, db: Session = Depends(get_db)):
     """获取指定项目的所有历史任务记录"""
     return crud.get_task_logs_for_project(db, project_id=project_id)
 
+@router.get("/steps/compare", response_model=task_schema.BuildStepComparison)
+def compare_build_steps(target: str, base: str | None = None, db: Session = Depends(get_db)):
+    """对比两次构建的步骤耗时；不指定 base 时与同项目上一次成功的任务对比"""
+    target_task = crud.get_task_log(db, target)
+    if not target_task:
+        raise HTTPException(status_code=404, detail="任务未找到")
+    base_task = crud.get_task_log(db, base) if base else crud.get_previous_successful_task(db, target_task)
+    if not base_task:
+        raise HTTPException(status_code=404, detail="没有可对比的基准任务")
+    return {
+        "base_task_id": base_task.id,
+        "target_task_id": target_task.id,
+        "steps": build_steps.compare_steps(crud.get_build_steps(db, base_task.id), crud.get_build_steps(db, target_task.id)),
+    }
+
+@router.get("/steps/{task_id}", response_model=List[task_schema.BuildStep])
+def get_build_steps(task_id: str, db: Session = Depends(get_db)):
+    """获取任务解析出的结构化步骤耗时 (构建步骤、是否命中缓存、推送的层大小)"""
+    if not crud.get_task_log(db, task_id):
+        raise HTTPException(status_code=404, detail="任务未找到")
+    return crud.get_build_steps(db, task_id)
+
 @router.get("/logs/{task_id}/content", response_class=PlainTextResponse)
-def get_log_content(task_id: str):
-    """获取单个任务日志文件的纯文本内容"""
-    log_file = LOG_DIR / f"{task_id}.log"
-    if not log_file.exists():
+def get_log_content(
+    task_id: str,
+    request: Request,
+    offset: int = Query(0, ge=0, description="跳过的行数"),
+    limit: int | None = Query(None, ge=1, description="最多返回的行数"),
+    tail: int | None = Query(None, ge=1, description="只返回最后 N 行"),
+):
+    """
+    获取单个任务日志文件的纯文本内容 (流式返回)。
+    - 支持 offset/limit 行区间、tail=N 末尾 N 行；
+    - 支持单段 HTTP Range 字节区间；
+    - 客户端接受 gzip 且非 Range 请求时压缩传输。
+    """
+    log = log_reader.open_task_log(task_id)
+    if log is None:
         raise HTTPException(status_code=404, detail="日志文件未找到")
-    return PlainTextResponse(log_file.read_text(encoding='utf-8'))
+
+    # 已归档的日志按块索引随机访问，只解压覆盖所需区间的块
+    size = log.size
+    headers = {"Accept-Ranges": "bytes"}
+    media_type = "text/plain; charset=utf-8"
+
+    range_header = request.headers.get("range")
+    if range_header and tail is None and offset == 0 and limit is None:
+        try:
+            byte_range = log_reader.parse_range_header(range_header, size)
+        except ValueError:
+            raise HTTPException(status_code=416, detail="请求的日志区间无效", headers={"Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+            headers["Content-Length"] = str(end - start)
+            return StreamingResponse(log.iter_bytes(start, end),
+                                     status_code=206, media_type=media_type, headers=headers)
+
+    if tail is not None:
+        # 从文件末尾向前查找，不读取整个文件
+        body = log.iter_tail(tail)
+    elif offset or limit is not None:
+        body = log.iter_lines(offset, limit)
+    else:
+        body = log.iter_bytes()
+
+    headers["Vary"] = "Accept-Encoding"
+    if "gzip" in request.headers.get("accept-encoding", "").lower():
+        headers["Content-Encoding"] = "gzip"
+        body = log_reader.gzip_stream(body)
+
+    return StreamingResponse(body, media_type=media_type, headers=headers)
 
 # ✨ --- 核心修正：调整了下面两个DELETE路由的顺序 --- ✨
 
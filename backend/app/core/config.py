@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # --- 路径配置 ---
@@ -19,6 +20,11 @@ DATA_DIR = APP_ROOT_DIR / "data"
 
 LOG_DIR = DATA_DIR / "logs"
 BACKUP_DIR = DATA_DIR / "backups"
+BACKUP_STORE_DIR = DATA_DIR / "backup_store"
+CONTEXT_CACHE_DIR = DATA_DIR / "context_cache"
+LOGIN_CACHE_PATH = DATA_DIR / "login_cache.json"
+BUILDX_CACHE_DIR = DATA_DIR / "buildx_cache"
+BUILDER_DIR = DATA_DIR / "builders"
 DATABASE_PATH = DATA_DIR / "projects.db"
 
 # --- 数据库URL ---
@@ -28,6 +34,10 @@ DATABASE_URL = f"sqlite:///{DATABASE_PATH.as_posix()}"
 DATA_DIR.mkdir(exist_ok=True)
 LOG_DIR.mkdir(exist_ok=True)
 BACKUP_DIR.mkdir(exist_ok=True)
+BACKUP_STORE_DIR.mkdir(exist_ok=True)
+CONTEXT_CACHE_DIR.mkdir(exist_ok=True)
+BUILDX_CACHE_DIR.mkdir(exist_ok=True)
+BUILDER_DIR.mkdir(exist_ok=True)
 
 # --- 备份配置 ---
 BACKUP_IGNORE_PATTERNS = [
@@ -43,6 +53,54 @@ BACKUP_IGNORE_PATTERNS = [
     "*.log"
 ]
 
+# 后台备份任务结束后在内存中保留的时间 (秒)，供客户端查询最终结果
+BACKUP_JOB_RETENTION = int(os.getenv("BACKUP_JOB_RETENTION", "3600"))
+# 去重快照：文件内容按 BACKUP_CHUNK_SIZE 字节切块，以 sha256 寻址保存在 BACKUP_STORE_DIR 中，所有项目共享；
+# 读取和压缩文件的线程数
+BACKUP_CHUNK_SIZE = int(os.getenv("BACKUP_CHUNK_SIZE", str(4 * 1024 * 1024)))
+BACKUP_SNAPSHOT_WORKERS = int(os.getenv("BACKUP_SNAPSHOT_WORKERS", "4"))
+# 备份目录 (backups 表) 与磁盘的对账：列表接口距上次对账超过 TTL 秒时先快速对账 (只 stat，不读文件)，
+# 后台线程每隔 SCAN_INTERVAL 秒全量对账一次并补算缺失的校验和
+BACKUP_CATALOG_RECONCILE_TTL = int(os.getenv("BACKUP_CATALOG_RECONCILE_TTL", "60"))
+BACKUP_CATALOG_SCAN_INTERVAL = int(os.getenv("BACKUP_CATALOG_SCAN_INTERVAL", "600"))
+
 # --- 任务管理 ---
-TASK_MANAGER = {}
-TASK_LOG_SENTINEL = "---TASK-COMPLETE---"
\ No newline at end of file
+TASK_LOG_SENTINEL = "---TASK-COMPLETE---"
+# 任务日志写入缓冲：最多缓冲这么久 (秒) 或这么多字节后落盘，保证实时查看的延迟有上限
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.2"))
+LOG_FLUSH_BYTES = int(os.getenv("LOG_FLUSH_BYTES", str(64 * 1024)))
+# 实时日志推送：每个 WebSocket 订阅者最多积压的日志批次数，超出后改为从文件追读
+LOG_STREAM_QUEUE_SIZE = int(os.getenv("LOG_STREAM_QUEUE_SIZE", "256"))
+# 已完成任务日志的压缩归档：结束超过 LOG_ARCHIVE_DELAY 秒的日志按块压缩，每 LOG_ARCHIVE_INTERVAL 秒扫描一次
+LOG_ARCHIVE_DELAY = int(os.getenv("LOG_ARCHIVE_DELAY", "300"))
+LOG_ARCHIVE_INTERVAL = int(os.getenv("LOG_ARCHIVE_INTERVAL", "60"))
+LOG_ARCHIVE_BLOCK_SIZE = int(os.getenv("LOG_ARCHIVE_BLOCK_SIZE", str(256 * 1024)))
+
+# --- 任务调度 ---
+# 全局同时运行的构建任务上限，以及同一仓库同时推送的任务上限
+MAX_CONCURRENT_TASKS = int(os.getenv("MAX_CONCURRENT_TASKS", "2"))
+MAX_TASKS_PER_REGISTRY = int(os.getenv("MAX_TASKS_PER_REGISTRY", "2"))
+
+# --- 构建上下文 ---
+# 标准模式打包构建上下文时并行读取文件的线程数
+CONTEXT_PACK_WORKERS = int(os.getenv("CONTEXT_PACK_WORKERS", "8"))
+
+# --- 仓库登录缓存 ---
+# 同一 (仓库, 用户名) 登录成功后在这段时间内 (秒) 的任务直接复用，不再重复登录
+LOGIN_CACHE_TTL = int(os.getenv("LOGIN_CACHE_TTL", "3600"))
+
+# --- Buildx builder 池 ---
+# 每隔这么久 (秒) 检查一次各仓库专用 builder 的健康状态，并回收仓库已删除的 builder
+BUILDER_HEALTH_INTERVAL = int(os.getenv("BUILDER_HEALTH_INTERVAL", "300"))
+
+# --- 系统状态 ---
+# /system/status 返回的 buildx 状态在内存中缓存，后台每隔这么久 (秒) 刷新一次
+SYSTEM_STATUS_TTL = int(os.getenv("SYSTEM_STATUS_TTL", "60"))
+
+# --- 仓库健康监控 ---
+# 每隔这么久 (秒) 探测一次所有仓库；连续失败 REGISTRY_FAILURE_THRESHOLD 次视为不可用，
+# 调度器会推迟推送到该仓库的任务 (REGISTRY_POSTPONE_ON_FAILURE=false 可关闭)。探测记录保留 REGISTRY_HEALTH_RETENTION 秒
+REGISTRY_MONITOR_INTERVAL = int(os.getenv("REGISTRY_MONITOR_INTERVAL", "60"))
+REGISTRY_FAILURE_THRESHOLD = int(os.getenv("REGISTRY_FAILURE_THRESHOLD", "2"))
+REGISTRY_POSTPONE_ON_FAILURE = os.getenv("REGISTRY_POSTPONE_ON_FAILURE", "true").lower() in ("1", "true", "yes")
+REGISTRY_HEALTH_RETENTION = int(os.getenv("REGISTRY_HEALTH_RETENTION", str(7 * 24 * 3600)))
@@ -0,0 +1,186 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+# 轻量的 Prometheus 文本格式指标实现 (不引入 prometheus_client 依赖)。
+# 构建任务运行在独立进程中，任务相关指标由主进程的调度器在回收任务进程时记录，因此无需跨进程共享。
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}", *self._samples()]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in self._values.items()]
+
+class Gauge(_Metric):
+    """可直接 set，也可以通过 set_function 在采集时回调取值"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            try:
+                return [f"{self.name} {_format_value(self._function())}"]
+            except Exception:
+                return []
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in self._values.items()]
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [每个桶的计数..., sum, count]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            for key, state in self._values.items():
+                for bound, count in zip(self.buckets, state):
+                    le = 'le="' + _format_value(bound) + '"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# --- 构建任务 ---
+TASK_DURATION_SECONDS = REGISTRY.register(Histogram(
+    "dwp_task_duration_seconds", "Wall time of build tasks from start to finish.",
+    ("project", "registry", "mode"),
+    buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+))
+TASKS_TOTAL = REGISTRY.register(Counter(
+    "dwp_tasks_total", "Finished build tasks by final status.",
+    ("project", "registry", "mode", "status"),
+))
+TASKS_RUNNING = REGISTRY.register(Gauge("dwp_tasks_running", "Build tasks currently running."))
+TASKS_QUEUED = REGISTRY.register(Gauge("dwp_tasks_queued", "Build tasks waiting in the queue."))
+
+# --- 日志推送 ---
+LOG_WEBSOCKETS_OPEN = REGISTRY.register(Gauge("dwp_log_websockets_open", "Open task log websocket streams."))
+
+# --- 备份 ---
+BACKUP_DURATION_SECONDS = REGISTRY.register(Histogram(
+    "dwp_backup_duration_seconds", "Time spent creating a project backup.",
+    ("project",), buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800),
+))
+BACKUP_ARCHIVE_BYTES = REGISTRY.register(Histogram(
+    "dwp_backup_archive_bytes", "Size of created backup archives.",
+    ("project",), buckets=tuple(2 ** n * 1024 * 1024 for n in range(0, 14, 2)),
+))
+BACKUPS_TOTAL = REGISTRY.register(Counter("dwp_backups_total", "Backup attempts by result.", ("project", "status")))
+
+# --- 系统命令 ---
+SYSTEM_COMMAND_SECONDS = REGISTRY.register(Histogram(
+    "dwp_system_command_duration_seconds", "Latency of docker CLI calls made by system endpoints.",
+    ("command",), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+))
+
+# --- 仓库健康监控 ---
+REGISTRY_PROBE_SECONDS = REGISTRY.register(Histogram(
+    "dwp_registry_probe_duration_seconds", "Round-trip latency of background registry probes.",
+    ("registry",), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+))
+REGISTRY_UP = REGISTRY.register(Gauge("dwp_registry_up", "Whether the registry passed its last health probe.", ("registry",)))
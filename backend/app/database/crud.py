@@ -1,10 +1,15 @@
 import uuid
 import os # ✨ 新增：导入os模块以操作文件
 from pathlib import Path # ✨ 新增：导入Path模块
+from sqlalchemy import literal_column
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
 from . import models
 from ..schemas import project as project_schema, credential as cred_schema, proxy as proxy_schema, registry as registry_schema
 from ..core.config import LOG_DIR
+from ..services.log_archive import delete_archived_log
+from ..services.log_search import delete_task_index, delete_all_task_indexes
+from ..services.docker_session import invalidate_logins
  # ✨ 新增：从config导入LOG_DIR
 
 def encrypt(data: str) -> str: return data
@@ -69,6 +74,62 @@ def delete_registry(db: Session, db_registry: models.Registry):
     db.commit()
     return db_registry
 
+# --- Registry health samples ---
+def add_registry_health_samples(db: Session, samples: list[dict]):
+    db.add_all([models.RegistryHealthSample(**sample) for sample in samples])
+    db.commit()
+
+def get_registry_health_samples(db: Session, since: float, registry_id: str | None = None):
+    query = db.query(models.RegistryHealthSample).filter(models.RegistryHealthSample.checked_at >= since)
+    if registry_id:
+        query = query.filter(models.RegistryHealthSample.registry_id == registry_id)
+    return query.order_by(models.RegistryHealthSample.checked_at).all()
+
+def prune_registry_health_samples(db: Session, before: float, registry_ids: list[str]) -> int:
+    """删除过期的探测记录，以及仓库已被删除的记录"""
+    deleted = db.query(models.RegistryHealthSample).filter(
+        (models.RegistryHealthSample.checked_at < before) | models.RegistryHealthSample.registry_id.notin_(registry_ids)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+# --- Backup catalog ---
+def get_backup_records(db: Session, project_name: str, offset: int = 0, limit: int | None = None):
+    """按创建时间倒序分页，返回 (记录, 总数)"""
+    query = db.query(models.BackupRecord).filter(models.BackupRecord.project_name == project_name)
+    total = query.count()
+    query = query.order_by(models.BackupRecord.created_at.desc()).offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all(), total
+
+def get_backup_project_names(db: Session) -> list[str]:
+    return [row[0] for row in db.query(models.BackupRecord.project_name).distinct()]
+
+def upsert_backup_records(db: Session, records: list[dict]):
+    for record in records:
+        db.merge(models.BackupRecord(**record))
+    db.commit()
+
+def set_backup_checksum(db: Session, project_name: str, filename: str, file_mtime_ns: int, checksum: str) -> int:
+    """只在文件未被替换 (mtime 与计算校验和时一致) 时写入"""
+    updated = db.query(models.BackupRecord).filter(
+        models.BackupRecord.project_name == project_name,
+        models.BackupRecord.filename == filename,
+        models.BackupRecord.file_mtime_ns == file_mtime_ns,
+    ).update({models.BackupRecord.checksum: checksum}, synchronize_session=False)
+    db.commit()
+    return updated
+
+def delete_backup_records(db: Session, project_name: str, filenames: list[str] | None = None) -> int:
+    """删除项目的备份记录；filenames 为 None 时删除该项目的全部记录"""
+    query = db.query(models.BackupRecord).filter(models.BackupRecord.project_name == project_name)
+    if filenames is not None:
+        query = query.filter(models.BackupRecord.filename.in_(filenames))
+    deleted = query.delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
 # --- Credential CRUD ---
 def get_credential(db: Session, cred_id: str):
     return db.query(models.Credential).filter(models.Credential.id == cred_id).first()
@@ -99,11 +160,13 @@ def update_credential(db: Session, db_cred: models.Credential, cred_in: cred_sch
     db.add(db_cred)
     db.commit()
     db.refresh(db_cred)
+    invalidate_logins(db_cred.id)
     return db_cred
 
 def delete_credential(db: Session, db_cred: models.Credential):
     db.delete(db_cred)
     db.commit()
+    invalidate_logins(db_cred.id)
     return db_cred
 
 # --- Proxy CRUD ---
@@ -138,8 +201,8 @@ def delete_proxy(db: Session, db_proxy: models.Proxy):
     return db_proxy
 
 # --- TaskLog CRUD ---
-def create_task_log(db: Session, project_id: str, task_id: str, tag: str):
-    db_task = models.TaskLog(id=task_id, project_id=project_id, tag=tag)
+def create_task_log(db: Session, project_id: str, task_id: str, tag: str, status: str = "PENDING", priority: int = 0, force: bool = False, batch_id: str | None = None):
+    db_task = models.TaskLog(id=task_id, project_id=project_id, tag=tag, status=status, priority=priority, force=force, batch_id=batch_id)
     db.add(db_task)
     db.commit()
     db.refresh(db_task)
@@ -148,14 +211,94 @@ def create_task_log(db: Session, project_id: str, task_id: str, tag: str):
 def get_task_logs_for_project(db: Session, project_id: str):
     return db.query(models.TaskLog).filter(models.TaskLog.project_id == project_id).order_by(models.TaskLog.created_at.desc()).all()
 
+def get_task_log(db: Session, task_id: str):
+    return db.query(models.TaskLog).filter(models.TaskLog.id == task_id).first()
+
+def get_task_logs_by_status(db: Session, statuses: list[str]):
+    return db.query(models.TaskLog).filter(models.TaskLog.status.in_(statuses)).all()
+
+def get_queued_task_logs(db: Session):
+    # 优先级高的先出队；同优先级按入队顺序 (SQLite 隐式 rowid 保证同一秒内入队的任务仍是 FIFO)
+    return db.query(models.TaskLog).filter(models.TaskLog.status == "QUEUED").order_by(
+        models.TaskLog.priority.desc(), models.TaskLog.created_at, literal_column("task_logs.rowid")
+    ).all()
+
+def get_waiting_task_logs(db: Session):
+    return db.query(models.TaskLog).filter(models.TaskLog.status == "WAITING").order_by(
+        models.TaskLog.created_at, literal_column("task_logs.rowid")
+    ).all()
+
+def get_batch_task_logs(db: Session, batch_id: str):
+    return db.query(models.TaskLog).filter(models.TaskLog.batch_id == batch_id).order_by(
+        models.TaskLog.created_at, literal_column("task_logs.rowid")
+    ).all()
+
+# --- Task dependencies ---
+def add_task_dependencies(db: Session, task_id: str, parent_ids: list[str]):
+    db.add_all([models.TaskDependency(task_id=task_id, depends_on=parent_id) for parent_id in parent_ids])
+    db.commit()
+
+def get_task_dependencies(db: Session, task_ids: list[str]) -> dict[str, list[str]]:
+    """task_id -> 它所依赖的任务 id 列表"""
+    result: dict[str, list[str]] = {task_id: [] for task_id in task_ids}
+    rows = db.query(models.TaskDependency).filter(models.TaskDependency.task_id.in_(task_ids)).order_by(models.TaskDependency.id).all()
+    for row in rows:
+        result[row.task_id].append(row.depends_on)
+    return result
+
+def mark_task_started(db: Session, task_id: str):
+    db_task = get_task_log(db, task_id)
+    if db_task:
+        db_task.status = "PENDING"
+        db_task.started_at = func.now()
+        db.commit()
+        db.refresh(db_task)
+    return db_task
+
 def update_task_status(db: Session, task_id: str, new_status: str):
     db_task = db.query(models.TaskLog).filter(models.TaskLog.id == task_id).first()
     if db_task:
         db_task.status = new_status
+        if new_status not in ("WAITING", "QUEUED", "PENDING"):
+            db_task.finished_at = func.now()
         db.commit()
         db.refresh(db_task)
     return db_task
 
+def set_task_build_result(db: Session, task_id: str, fingerprint: str | None, digest: str | None):
+    db_task = get_task_log(db, task_id)
+    if db_task:
+        db_task.build_fingerprint = fingerprint
+        db_task.image_digest = digest
+        db.commit()
+    return db_task
+
+def get_last_build_with_fingerprint(db: Session, project_id: str, fingerprint: str, exclude_task_id: str):
+    """同一项目最近一次构建输入完全相同、且记录了镜像 digest 的成功任务"""
+    return db.query(models.TaskLog).filter(
+        models.TaskLog.project_id == project_id,
+        models.TaskLog.id != exclude_task_id,
+        models.TaskLog.status.in_(["SUCCESS", "SKIPPED"]),
+        models.TaskLog.build_fingerprint == fingerprint,
+        models.TaskLog.image_digest.isnot(None),
+    ).order_by(models.TaskLog.created_at.desc(), literal_column("task_logs.rowid").desc()).first()
+
+# --- Build step timing ---
+def create_build_steps(db: Session, task_id: str, steps: list[dict]):
+    db.add_all([models.TaskBuildStep(task_id=task_id, **step) for step in steps])
+    db.commit()
+
+def get_build_steps(db: Session, task_id: str):
+    return db.query(models.TaskBuildStep).filter(models.TaskBuildStep.task_id == task_id).order_by(models.TaskBuildStep.seq).all()
+
+def get_previous_successful_task(db: Session, task: models.TaskLog):
+    return db.query(models.TaskLog).filter(
+        models.TaskLog.project_id == task.project_id,
+        models.TaskLog.id != task.id,
+        models.TaskLog.status == "SUCCESS",
+        models.TaskLog.created_at <= task.created_at,
+    ).order_by(models.TaskLog.created_at.desc()).first()
+
 # ✨ --- 新增：删除单条任务日志的函数 --- ✨
 def delete_task_log(db: Session, task_id: str):
     # 先从数据库查找记录
@@ -163,25 +306,32 @@ def delete_task_log(db: Session, task_id: str):
     if not db_task:
         return None # 如果找不到记录，直接返回
 
-    # 删除数据库记录
+    # 删除数据库记录 (SQLite 未开启外键约束，需手动删除关联的步骤记录)
+    db.query(models.TaskBuildStep).filter(models.TaskBuildStep.task_id == task_id).delete()
+    db.query(models.TaskDependency).filter(models.TaskDependency.task_id == task_id).delete()
     db.delete(db_task)
     db.commit()
+    delete_task_index(db, task_id)
 
     # 删除对应的物理日志文件
     log_file_path = LOG_DIR / f"{task_id}.log"
     if log_file_path.exists():
         log_file_path.unlink() # 使用pathlib的unlink方法删除文件
+    delete_archived_log(task_id)
 
     return db_task
 
 # ✨ --- 新增：删除所有任务日志的函数 --- ✨
 def delete_all_task_logs(db: Session):
     # 删除数据库中所有 TaskLog 记录
+    db.query(models.TaskBuildStep).delete()
+    db.query(models.TaskDependency).delete()
     num_rows_deleted = db.query(models.TaskLog).delete()
     db.commit()
+    delete_all_task_indexes(db)
 
     # 删除物理日志文件夹下的所有 .log 文件
-    for log_file in LOG_DIR.glob("*.log"):
+    for log_file in [*LOG_DIR.glob("*.log"), *LOG_DIR.glob("*.log.gz"), *LOG_DIR.glob("*.log.idx")]:
         try:
             log_file.unlink()
         except OSError as e:
@@ -38,8 +38,82 @@ def check_and_migrate_db():
                 conn.execute(text("ALTER TABLE projects ADD COLUMN auto_cleanup BOOLEAN DEFAULT 1 NOT NULL"))
                 conn.commit()
 
+        if "skip_unchanged" not in columns:
+            print("Migrating database: Adding 'skip_unchanged' column to 'projects' table.")
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE projects ADD COLUMN skip_unchanged BOOLEAN DEFAULT 0 NOT NULL"))
+                conn.commit()
+
+        if "cache_mode" not in columns:
+            print("Migrating database: Adding 'cache_mode' column to 'projects' table.")
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE projects ADD COLUMN cache_mode VARCHAR DEFAULT 'inline' NOT NULL"))
+                conn.commit()
+
+        for col_name in ["cache_ref", "cache_from_refs"]:
+            if col_name not in columns:
+                print(f"Migrating database: Adding '{col_name}' column to 'projects' table.")
+                with engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE projects ADD COLUMN {col_name} VARCHAR DEFAULT ''"))
+                    conn.commit()
+
+        if "split_platforms" not in columns:
+            print("Migrating database: Adding 'split_platforms' column to 'projects' table.")
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE projects ADD COLUMN split_platforms BOOLEAN DEFAULT 0 NOT NULL"))
+                conn.commit()
+
+        if "platform_builders" not in columns:
+            print("Migrating database: Adding 'platform_builders' column to 'projects' table.")
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE projects ADD COLUMN platform_builders VARCHAR DEFAULT ''"))
+                conn.commit()
+
         if "platforms" not in columns:
             print("Migrating database: Adding 'platforms' column to 'projects' table.")
             with engine.connect() as conn:
                 conn.execute(text("ALTER TABLE projects ADD COLUMN platforms VARCHAR DEFAULT 'linux/amd64' NOT NULL"))
-                conn.commit()
\ No newline at end of file
+                conn.commit()
+
+    # 2. Check task_logs table for scheduler columns
+    if inspector.has_table("task_logs"):
+        columns = [col['name'] for col in inspector.get_columns("task_logs")]
+        if "priority" not in columns:
+            print("Migrating database: Adding 'priority' column to 'task_logs' table.")
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE task_logs ADD COLUMN priority INTEGER DEFAULT 0 NOT NULL"))
+                conn.commit()
+
+        for col_name in ["started_at", "finished_at"]:
+            if col_name not in columns:
+                print(f"Migrating database: Adding '{col_name}' column to 'task_logs' table.")
+                with engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE task_logs ADD COLUMN {col_name} DATETIME"))
+                    conn.commit()
+
+        if "force" not in columns:
+            print("Migrating database: Adding 'force' column to 'task_logs' table.")
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE task_logs ADD COLUMN force BOOLEAN DEFAULT 0 NOT NULL"))
+                conn.commit()
+
+        for col_name in ["build_fingerprint", "image_digest"]:
+            if col_name not in columns:
+                print(f"Migrating database: Adding '{col_name}' column to 'task_logs' table.")
+                with engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE task_logs ADD COLUMN {col_name} VARCHAR"))
+                    conn.commit()
+
+        if "batch_id" not in columns:
+            print("Migrating database: Adding 'batch_id' column to 'task_logs' table.")
+            with engine.connect() as conn:
+                conn.execute(text("ALTER TABLE task_logs ADD COLUMN batch_id VARCHAR"))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_task_logs_batch_id ON task_logs (batch_id)"))
+                conn.commit()
+
+    # 3. Full-text search index for task logs (FTS5 virtual table, not managed by SQLAlchemy models)
+    if not inspector.has_table("task_log_fts"):
+        print("Migrating database: Creating 'task_log_fts' full-text index.")
+        with engine.connect() as conn:
+            conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS task_log_fts USING fts5(line, tokenize='unicode61')"))
+            conn.commit()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, String, ForeignKey, DateTime
+from sqlalchemy import Boolean, Column, String, ForeignKey, DateTime, Integer, Float, Index
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -16,6 +16,14 @@ class Project(Base):
     registry_id = Column(String, ForeignKey("registries.id"), nullable=True)
     proxy_id = Column(String, ForeignKey("proxies.id"), nullable=True)
     backup_ignore_patterns = Column(String, nullable=True, default="")
+    skip_unchanged = Column(Boolean, default=False, nullable=False)
+    # Buildx 缓存后端: inline / registry / local / none
+    cache_mode = Column(String, default="inline", nullable=False)
+    cache_ref = Column(String, nullable=True)
+    cache_from_refs = Column(String, nullable=True, default="")
+    # 多平台时每个平台单独并发构建，可为平台指定 builder: "linux/arm64=arm-builder,..."
+    split_platforms = Column(Boolean, default=False, nullable=False)
+    platform_builders = Column(String, nullable=True, default="")
 
 class Registry(Base):
     __tablename__ = "registries"
@@ -25,6 +33,43 @@ class Registry(Base):
     is_https = Column(Boolean, default=True, nullable=False)
     credential_id = Column(String, ForeignKey("credentials.id"), nullable=True)
 
+class RegistryHealthSample(Base):
+    """后台监控对仓库的一次探测结果 (时间为 Unix 秒，延迟为毫秒)"""
+    __tablename__ = "registry_health_samples"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    registry_id = Column(String, index=True, nullable=False)
+    checked_at = Column(Float, index=True, nullable=False)
+    available = Column(Boolean, nullable=False)
+    latency_ms = Column(Float, nullable=True)
+    auth_latency_ms = Column(Float, nullable=True)
+    error = Column(String, nullable=True)
+
+class BackupChunk(Base):
+    """去重备份存储中的一个数据块：被多少个快照引用 (同一快照内重复引用只计一次)"""
+    __tablename__ = "backup_chunks"
+    hash = Column(String, primary_key=True)
+    stored_size = Column(Integer, nullable=False)
+    refcount = Column(Integer, default=0, nullable=False, index=True)
+
+class BackupRecord(Base):
+    """
+    备份目录：data/backups/<项目名>/ 下每个备份文件一行 (时间为 Unix 秒)。
+    size 为备份内容的大小 (快照为其中文件的总大小)，file_mtime_ns 用于对账时发现被替换的文件。
+    """
+    __tablename__ = "backups"
+    project_name = Column(String, primary_key=True)
+    filename = Column(String, primary_key=True)
+    format = Column(String, nullable=False)  # snapshot / 7z / tar.gz
+    size = Column(Integer, nullable=False)
+    stored_size = Column(Integer, nullable=True)
+    file_count = Column(Integer, nullable=True)
+    created_at = Column(Float, nullable=False)
+    remark = Column(String, nullable=True)
+    ignore_patterns = Column(String, nullable=True)
+    checksum = Column(String, nullable=True)  # 备份文件的 sha256
+    file_mtime_ns = Column(Integer, nullable=False)
+    __table_args__ = (Index("ix_backups_project_created", "project_name", "created_at"),)
+
 class Credential(Base):
     __tablename__ = "credentials"
     id = Column(String, primary_key=True, index=True)
@@ -44,4 +89,40 @@ class TaskLog(Base):
     project_id = Column(String, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
     tag = Column(String, nullable=False)
     status = Column(String, default="PENDING", nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    priority = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    force = Column(Boolean, default=False, nullable=False)
+    build_fingerprint = Column(String, nullable=True)
+    image_digest = Column(String, nullable=True)
+    batch_id = Column(String, index=True, nullable=True)
+
+class TaskDependency(Base):
+    """批量构建中的依赖边：task_id 需等待 depends_on 成功后才能进入队列"""
+    __tablename__ = "task_dependencies"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String, ForeignKey("task_logs.id", ondelete="CASCADE"), index=True, nullable=False)
+    depends_on = Column(String, ForeignKey("task_logs.id", ondelete="CASCADE"), index=True, nullable=False)
+
+class TaskLogSearchDoc(Base):
+    """task_log_fts 全文索引中每个任务日志对应一行；FTS 行的 rowid = (seq << 24) | 行号"""
+    __tablename__ = "task_log_search_docs"
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String, unique=True, index=True, nullable=False)
+    indexed_lines = Column(Integer, default=0, nullable=False)
+
+class TaskBuildStep(Base):
+    """从构建/推送输出流中解析出的结构化步骤耗时"""
+    __tablename__ = "task_build_steps"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(String, ForeignKey("task_logs.id", ondelete="CASCADE"), index=True, nullable=False)
+    seq = Column(Integer, nullable=False)
+    phase = Column(String, nullable=False)  # build / export / push
+    platform = Column(String, nullable=True)
+    step_no = Column(Integer, nullable=True)
+    instruction = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # DONE / CACHED / ERROR / CANCELED / PUSHED / EXISTS / MOUNTED
+    cached = Column(Boolean, default=False, nullable=False)
+    duration = Column(Float, nullable=True)
+    bytes = Column(Integer, nullable=True)
@@ -1,9 +1,23 @@
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from .database.database import engine, check_and_migrate_db
 from .database import models
+from .core.metrics import REGISTRY
 from .api.v1.router import api_router
+from .services.task_scheduler import task_scheduler
+from .services.log_archive import log_archiver
+from .services.log_broadcaster import log_hub
+from .services.log_search import backfill_search_index
+from .services.builder_pool import builder_pool
+from .services.system_status import system_status
+from .services.registry_probe import close_http_client
+from .services.registry_monitor import registry_monitor
+from .services.backup_jobs import backup_jobs
+from .services.backup_catalog import backup_catalog
 
 # 创建数据库表
 models.Base.metadata.create_all(bind=engine)
@@ -11,11 +25,42 @@ models.Base.metadata.create_all(bind=engine)
 # 自动检查并迁移数据库（修复缺少的列）
 check_and_migrate_db()
 
-app = FastAPI(title="Docker Web Pusher")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动构建调度器 (会继续调度重启前遗留在队列中的任务)
+    task_scheduler.start()
+    # 后台压缩归档已完成的任务日志 (跳过仍有客户端在实时查看的任务)
+    log_archiver.start(in_use=log_hub.is_streaming)
+    # 为历史任务补建全文索引
+    threading.Thread(target=backfill_search_index, name="log-search-backfill", daemon=True).start()
+    # 预先创建并启动各私有仓库的专用 builder，之后定期健康检查
+    builder_pool.start(in_use=task_scheduler.builders_in_use)
+    # 后台定期刷新系统状态，/system/status 直接返回缓存
+    system_status.start()
+    # 定期探测各仓库的可用性和延迟，不可用的仓库暂缓调度
+    registry_monitor.start()
+    # 备份目录与磁盘定期对账，并为补录的备份计算校验和
+    backup_catalog.start()
+    yield
+    await registry_monitor.stop()
+    await system_status.stop()
+    await close_http_client()
+    backup_jobs.shutdown()
+    backup_catalog.stop()
+    builder_pool.stop()
+    log_archiver.stop()
+    task_scheduler.stop()
+
+app = FastAPI(title="Docker Web Pusher", lifespan=lifespan)
 
 # 包含所有 v1 版本的 API 路由
 app.include_router(api_router, prefix="/api/v1")
 
+# Prometheus 采集端点 (必须在静态文件挂载之前注册)
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # --- 静态文件托管与SPA支持 (标准方案) ---
 
 # 定义静态文件目录的正确路径
@@ -6,11 +6,47 @@ class Backup(BaseModel):
     size: int
     created_at: str
     remark: str | None = None
+    format: str = "7z"  # snapshot / 7z / tar.gz
+    # 快照：创建时新写入去重存储的字节数，以及包含的文件数
+    stored_size: int | None = None
+    file_count: int | None = None
+    ignore_patterns: List[str] | None = None
+    checksum: str | None = None  # 备份文件的 sha256，后台对账补录的备份在校验和算出之前为空
 
 class BackupCreateRequest(BaseModel):
     ignore_patterns: List[str]
     remark: str | None = None
+    # snapshot: 去重增量快照 (默认)；7z: 完整压缩包，便于导出
+    format: Literal["snapshot", "7z"] = "snapshot"
 
 class RestoreRequest(BaseModel):
     backup_filename: str
-    strategy: Literal["overwrite", "clear_and_overwrite"]
\ No newline at end of file
+    strategy: Literal["overwrite", "clear_and_overwrite"]
+
+class BackupJob(BaseModel):
+    id: str
+    project_id: str
+    project_name: str
+    format: str
+    status: str  # RUNNING / SUCCESS / FAILED / CANCELED
+    phase: str  # scanning / compressing / done
+    files_scanned: int = 0
+    files_total: int | None = None
+    files_done: int = 0
+    bytes_total: int | None = None
+    bytes_done: int = 0
+    percent: float = 0.0
+    throughput: float | None = None  # bytes/s
+    eta: float | None = None  # seconds
+    current_file: str | None = None
+    changes: dict[str, int] | None = None  # 快照: added / changed / deleted / unchanged
+    error: str | None = None
+    backup: Backup | None = None
+    started_at: float
+    finished_at: float | None = None
+
+
+class BackupStoreStats(BaseModel):
+    chunks: int
+    stored_bytes: int
+    chunk_size: int
@@ -13,6 +13,18 @@ class ProjectBase(BaseModel):
     registry_id: str | None = None
     proxy_id: str | None = None
     backup_ignore_patterns: str | None = ""
+    skip_unchanged: bool = False
+    cache_mode: str = "inline"
+    cache_ref: str | None = ""
+    cache_from_refs: str | None = ""
+    split_platforms: bool = False
+    platform_builders: str | None = ""
+
+    @validator('cache_mode')
+    def validate_cache_mode(cls, v):
+        if v not in ("inline", "registry", "local", "none"):
+            raise ValueError('缓存模式只能是 inline / registry / local / none。')
+        return v
 
     @validator('local_image_name')
     def validate_local_image_name(cls, v):
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class RegistryBase(BaseModel):
     name: str
@@ -15,3 +15,42 @@ class Registry(RegistryBase):
 
     class Config:
         from_attributes = True
+
+
+class RegistryTestResult(BaseModel):
+    registry_id: str
+    name: str
+    status: str
+    message: str
+    protocol: Optional[str] = None
+    latency_ms: Optional[float] = None
+
+
+class RegistryHealthSample(BaseModel):
+    checked_at: float
+    available: bool
+    latency_ms: Optional[float] = None
+    auth_latency_ms: Optional[float] = None
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class RegistryHealth(BaseModel):
+    registry_id: str
+    name: str
+    # 最近一次探测
+    available: Optional[bool] = None
+    failing: bool = False
+    consecutive_failures: int = 0
+    last_checked: Optional[float] = None
+    last_error: Optional[str] = None
+    # 统计窗口内的汇总
+    samples: int = 0
+    availability: Optional[float] = None
+    latency_p50_ms: Optional[float] = None
+    latency_p95_ms: Optional[float] = None
+    auth_latency_p50_ms: Optional[float] = None
+    auth_latency_p95_ms: Optional[float] = None
+    history: Optional[List[RegistryHealthSample]] = None
@@ -1,13 +1,95 @@
 from pydantic import BaseModel
 from datetime import datetime
+from typing import List
 
 class TaskLogBase(BaseModel):
     id: str
     project_id: str
     tag: str
     status: str
+    priority: int = 0
     created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    force: bool = False
+    image_digest: str | None = None
+    batch_id: str | None = None
 
 class TaskLog(TaskLogBase):
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class LogSearchMatch(BaseModel):
+    line_no: int
+    snippet: str
+
+class LogSearchResult(BaseModel):
+    task_id: str
+    project_id: str
+    project_name: str
+    tag: str
+    status: str
+    created_at: datetime
+    score: float
+    hits: int
+    matches: List[LogSearchMatch]
+
+class BuildStep(BaseModel):
+    seq: int
+    phase: str
+    platform: str | None = None
+    step_no: int | None = None
+    instruction: str
+    status: str
+    cached: bool
+    duration: float | None = None
+    bytes: int | None = None
+
+    class Config:
+        from_attributes = True
+
+class BuildStepDiff(BaseModel):
+    phase: str
+    platform: str | None = None
+    instruction: str
+    base_duration: float | None = None
+    target_duration: float | None = None
+    delta: float | None = None
+    base_cached: bool | None = None
+    target_cached: bool | None = None
+
+class BuildStepComparison(BaseModel):
+    base_task_id: str
+    target_task_id: str
+    steps: List[BuildStepDiff]
+
+
+class BatchBuildItem(BaseModel):
+    project_id: str
+    tag: str = "latest"
+    # 显式声明的上游项目 id (必须也在本次批量构建中)
+    depends_on: List[str] = []
+
+class BatchBuildMatrix(BaseModel):
+    """project_ids × tags 的全部组合"""
+    project_ids: List[str]
+    tags: List[str]
+
+class BatchBuildRequest(BaseModel):
+    items: List[BatchBuildItem] = []
+    matrix: BatchBuildMatrix | None = None
+    # 是否根据 Dockerfile 的 FROM 自动识别批次内项目之间的依赖
+    detect_from: bool = True
+    priority: int = 0
+    force: bool = False
+
+class BatchTask(BaseModel):
+    task_id: str
+    project_id: str
+    tag: str
+    status: str
+    depends_on: List[str]
+
+class BatchBuildStatus(BaseModel):
+    batch_id: str
+    tasks: List[BatchTask]
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import AsyncIterator
+
+from ..core import metrics
+
+# 在事件循环中执行外部命令 (docker CLI 等)，不占用事件循环也不占用线程池。
+# 超时或调用方取消 (例如客户端断开了流式响应) 时会终止子进程，不留下孤儿进程。
+
+class CommandError(Exception):
+    def __init__(self, cmd: list[str], returncode: int | None, output: str, timed_out: bool = False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.output = output
+        self.timed_out = timed_out
+        reason = "超时" if timed_out else f"退出码 {returncode}"
+        detail = f": {output.strip()[-2000:]}" if output.strip() else ""
+        super().__init__(f"命令执行失败 ({reason}): {' '.join(cmd)}{detail}")
+
+class CommandResult:
+    def __init__(self, returncode: int, stdout: str, stderr: str):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+def _metric_label(cmd: list[str]) -> str:
+    return " ".join(cmd[:3])
+
+async def _terminate(process: asyncio.subprocess.Process, grace: float = 5.0):
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        await asyncio.wait_for(process.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+    except ProcessLookupError:
+        pass
+
+async def run_command(cmd: list[str], timeout: float | None = None, input: str | None = None, check: bool = True) -> CommandResult:
+    """执行命令并收集输出；check=True 时非零退出码抛出 CommandError"""
+    with metrics.SYSTEM_COMMAND_SECONDS.time(command=_metric_label(cmd)):
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(input.encode() if input is not None else None), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            await _terminate(process)
+            raise CommandError(cmd, None, "", timed_out=True)
+        except BaseException:
+            # 调用方被取消
+            await _terminate(process)
+            raise
+    result = CommandResult(process.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace"))
+    if check and result.returncode != 0:
+        raise CommandError(cmd, result.returncode, result.stderr or result.stdout)
+    return result
+
+class StreamingCommand:
+    """
+    逐行产出命令的输出 (stderr 合并到 stdout)：
+        command = StreamingCommand([...], timeout=600)
+        async for line in command: ...
+        command.returncode
+    timeout 为整个命令的时限；超时后终止进程并抛出 CommandError。
+    """
+
+    def __init__(self, cmd: list[str], timeout: float | None = None):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.returncode: int | None = None
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *self.cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+        )
+        try:
+            while True:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    raise asyncio.TimeoutError
+                line = await asyncio.wait_for(process.stdout.readline(), timeout=remaining)
+                if not line:
+                    break
+                yield line.decode(errors="replace")
+            self.returncode = await process.wait()
+        except asyncio.TimeoutError:
+            await _terminate(process)
+            self.returncode = process.returncode
+            raise CommandError(self.cmd, None, "", timed_out=True)
+        finally:
+            # 正常结束时进程已退出；迭代被提前中止或取消时在这里终止进程
+            await _terminate(process)
+            metrics.SYSTEM_COMMAND_SECONDS.observe(time.monotonic() - started, command=_metric_label(self.cmd))
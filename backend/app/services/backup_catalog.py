@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from ..core.config import BACKUP_DIR, BACKUP_CATALOG_RECONCILE_TTL, BACKUP_CATALOG_SCAN_INTERVAL
+from ..database.database import SessionLocal
+from ..database import crud
+from .backup_store import SNAPSHOT_SUFFIX
+
+# 备份目录：每个备份文件在 backups 表中有一行，列表接口只做一次带索引的分页查询，
+# 不再在每次请求时 glob 备份目录、逐个 stat 并打开 .json 附属文件。
+# - 备份成功后由备份任务写入记录 (包括备份文件的 sha256 校验和)；
+# - 磁盘上的文件可能被手工增删，列表接口距上次对账超过 TTL 时先快速对账：只列目录和 stat，
+#   新出现的文件从 .json 附属文件读取元数据 (校验和留空)，消失的文件删除记录；
+# - 后台线程定期对所有项目全量对账，并补算缺失的校验和。
+# .json 附属文件仍然随备份写入，数据库丢失时可以据此重建目录。
+
+BACKUP_SUFFIXES = (".tar.gz", ".7z", SNAPSHOT_SUFFIX)
+
+def backup_format(filename: str) -> str:
+    if filename.endswith(SNAPSHOT_SUFFIX):
+        return "snapshot"
+    return "tar.gz" if filename.endswith(".tar.gz") else "7z"
+
+def sidecar_name(filename: str) -> str:
+    for ext in BACKUP_SUFFIXES:
+        if filename.endswith(ext):
+            return filename[:-len(ext)] + ".json"
+    return filename + ".json"
+
+def file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _read_sidecar(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _make_record(project_name: str, filename: str, st: os.stat_result, meta: dict, checksum: str | None) -> dict:
+    ignore_patterns = meta.get("ignore_patterns")
+    return {
+        "project_name": project_name,
+        "filename": filename,
+        "format": backup_format(filename),
+        # 快照清单本身很小，大小取其中文件的总大小
+        "size": meta.get("size", st.st_size),
+        "stored_size": meta.get("stored_size"),
+        "file_count": meta.get("file_count"),
+        "created_at": st.st_ctime,
+        "remark": meta.get("remark"),
+        "ignore_patterns": "\n".join(ignore_patterns) if ignore_patterns is not None else None,
+        "checksum": checksum,
+        "file_mtime_ns": st.st_mtime_ns,
+    }
+
+class BackupCatalog:
+    def __init__(self, reconcile_ttl: int = BACKUP_CATALOG_RECONCILE_TTL, scan_interval: int = BACKUP_CATALOG_SCAN_INTERVAL):
+        self.reconcile_ttl = reconcile_ttl
+        self.scan_interval = scan_interval
+        # 项目名 -> 上次对账时间 (monotonic)
+        self._reconciled: dict[str, float] = {}
+        # 备份任务写入记录与对账互斥，避免对账用过期的目录状态覆盖刚写入的记录
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="backup-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def record(self, project_name: str, filepath: Path, meta: dict):
+        """备份成功后写入记录；meta 与 .json 附属文件内容相同"""
+        checksum = file_checksum(filepath)
+        with self._lock:
+            db = SessionLocal()
+            try:
+                crud.upsert_backup_records(db, [_make_record(project_name, filepath.name, filepath.stat(), meta, checksum)])
+            finally:
+                db.close()
+
+    def remove(self, db: Session, project_name: str, filenames: list[str] | None = None):
+        with self._lock:
+            crud.delete_backup_records(db, project_name, filenames)
+
+    def list_backups(self, db: Session, project_name: str, offset: int = 0, limit: int | None = None, refresh: bool = False):
+        """分页列出备份，返回 (记录, 总数)；refresh 为 True 时强制先与磁盘对账"""
+        last = self._reconciled.get(project_name)
+        if refresh or last is None or time.monotonic() - last > self.reconcile_ttl:
+            self.reconcile(db, project_name)
+        return crud.get_backup_records(db, project_name, offset, limit)
+
+    def reconcile(self, db: Session, project_name: str) -> dict:
+        """让项目的备份记录与备份目录一致：补录新出现或被替换的文件，删除文件已不存在的记录"""
+        directory = BACKUP_DIR / project_name
+        on_disk: dict[str, os.stat_result] = {}
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.endswith(BACKUP_SUFFIXES) and entry.is_file():
+                        on_disk[entry.name] = entry.stat()
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            rows, _ = crud.get_backup_records(db, project_name)
+            known = {row.filename: row.file_mtime_ns for row in rows}
+            upserts = [
+                _make_record(project_name, filename, st, _read_sidecar(directory / sidecar_name(filename)), None)
+                for filename, st in on_disk.items() if known.get(filename) != st.st_mtime_ns
+            ]
+            removed = [filename for filename in known if filename not in on_disk]
+            if upserts:
+                crud.upsert_backup_records(db, upserts)
+            if removed:
+                crud.delete_backup_records(db, project_name, removed)
+            self._reconciled[project_name] = time.monotonic()
+        if upserts or removed:
+            print(f"备份目录对账 ({project_name}): 补录 {len(upserts)} 条，删除 {len(removed)} 条")
+        return {"updated": len(upserts), "removed": len(removed)}
+
+    def fill_checksums(self, db: Session, project_name: str) -> int:
+        """为对账补录的记录计算校验和；需要读取整个备份文件，在锁外计算，写回前确认文件未被替换"""
+        directory = BACKUP_DIR / project_name
+        rows, _ = crud.get_backup_records(db, project_name)
+        pending = [(r.filename, r.file_mtime_ns) for r in rows if r.checksum is None]
+        filled = 0
+        for filename, mtime_ns in pending:
+            if self._stop.is_set():
+                break
+            try:
+                checksum = file_checksum(directory / filename)
+            except OSError:
+                continue
+            with self._lock:
+                filled += crud.set_backup_checksum(db, project_name, filename, mtime_ns, checksum)
+        return filled
+
+    def run_once(self):
+        db = SessionLocal()
+        try:
+            names = {p.name for p in BACKUP_DIR.iterdir() if p.is_dir()} | set(crud.get_backup_project_names(db))
+            for name in sorted(names):
+                if self._stop.is_set():
+                    break
+                try:
+                    self.reconcile(db, name)
+                    self.fill_checksums(db, name)
+                except Exception as e:
+                    db.rollback()
+                    print(f"备份目录对账失败 ({name}): {e}")
+        finally:
+            db.close()
+
+    def _loop(self):
+        # 启动后先全量对账一次，之后定期执行
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"备份目录对账失败: {e}")
+            if self._stop.wait(self.scan_interval):
+                return
+
+backup_catalog = BackupCatalog()
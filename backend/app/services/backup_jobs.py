@@ -0,0 +1,374 @@
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from ..core import metrics
+from ..core.config import BACKUP_DIR, BACKUP_JOB_RETENTION, BACKUP_SNAPSHOT_WORKERS
+from .backup_catalog import backup_catalog
+from .backup_store import backup_store, MANIFEST_VERSION, SNAPSHOT_SUFFIX
+from .ignore_patterns import IgnoreMatcher, walk_entries
+
+# 7z -bsp1 的进度输出用退格/回车覆盖同一行，例如 "  42% 118 + src/app/main.py"
+# (百分比按输入字节数计算，其后是已处理的文件数和当前文件)
+_PROGRESS_RE = re.compile(r"(\d+)%(?:\s+(\d+))?(?:\s+[+U=R]\s+(.+))?")
+_PROGRESS_SEP = re.compile(rb"[\b\r\n]+")
+# 扫描阶段每处理这么多文件更新一次进度并检查是否已取消
+SCAN_REPORT_EVERY = 500
+# 快照阶段每写入这么多文件更新一次进度
+SNAPSHOT_REPORT_EVERY = 50
+
+def project_backup_dir(project_name: str) -> Path:
+    path = BACKUP_DIR / project_name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def parse_7z_progress(text: str) -> tuple[int, int | None, str | None] | None:
+    """解析一条 7z 进度，返回 (百分比, 已处理文件数, 当前文件)"""
+    match = _PROGRESS_RE.search(text)
+    if not match:
+        return None
+    files_done = int(match.group(2)) if match.group(2) else None
+    return int(match.group(1)), files_done, match.group(3)
+
+class BackupCanceled(Exception):
+    pass
+
+class BackupInProgress(Exception):
+    pass
+
+class BackupJob:
+    """
+    一次后台备份。format: snapshot (去重快照) / 7z (完整压缩包)；
+    status: RUNNING / SUCCESS / FAILED / CANCELED；
+    phase: scanning (遍历构建上下文) / compressing (写入快照或 7z 压缩) / done。
+    进度字段由工作线程更新，每次更新 version 加一，推送端据此判断是否有新进度。
+    """
+
+    def __init__(self, project_id: str, project_name: str, build_context: str, ignore_patterns: list[str], remark: str | None,
+                 format: str = "snapshot"):
+        self.id = str(uuid.uuid4())
+        self.format = format
+        self.project_id = project_id
+        self.project_name = project_name
+        self.build_context = build_context
+        self.ignore_patterns = ignore_patterns
+        self.remark = remark
+        self.version = 0
+        self._state = {
+            "status": "RUNNING", "phase": "scanning",
+            "files_scanned": 0, "files_total": None, "files_done": 0,
+            "bytes_total": None, "bytes_done": 0, "percent": 0.0,
+            "throughput": None, "eta": None, "current_file": None,
+            # 快照相对上一个快照的文件变化数: added / changed / deleted / unchanged
+            "changes": None,
+            "error": None, "backup": None,
+            "started_at": time.time(), "finished_at": None,
+        }
+        self._lock = threading.Lock()
+        self._canceled = threading.Event()
+        self._process: subprocess.Popen | None = None
+
+    @property
+    def status(self) -> str:
+        return self._state["status"]
+
+    @property
+    def finished(self) -> bool:
+        return self._state["status"] != "RUNNING"
+
+    def update(self, **fields):
+        with self._lock:
+            self._state.update(fields)
+            self.version += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"id": self.id, "project_id": self.project_id, "project_name": self.project_name, "format": self.format, **self._state}
+
+    def cancel(self):
+        self._canceled.set()
+        process = self._process
+        if process and process.poll() is None:
+            process.terminate()
+
+    def check_canceled(self):
+        if self._canceled.is_set():
+            raise BackupCanceled()
+
+class BackupJobManager:
+    """
+    备份在后台线程中执行，接口立即返回任务 id。同一项目同时只允许一个备份；
+    结束的任务在内存中保留 retention 秒，供客户端查询最终结果。
+    """
+
+    def __init__(self, retention: int = BACKUP_JOB_RETENTION):
+        self.retention = retention
+        self._jobs: dict[str, BackupJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, project_id: str, project_name: str, build_context: str, ignore_patterns: list[str], remark: str | None,
+               format: str = "snapshot") -> BackupJob:
+        with self._lock:
+            self._prune()
+            if any(j.project_id == project_id and not j.finished for j in self._jobs.values()):
+                raise BackupInProgress(f"项目 {project_name} 已有正在进行的备份")
+            job = BackupJob(project_id, project_name, build_context, ignore_patterns, remark, format)
+            self._jobs[job.id] = job
+        threading.Thread(target=self._run, args=(job,), name=f"backup-{job.id[:8]}", daemon=True).start()
+        return job
+
+    def get(self, job_id: str) -> BackupJob | None:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, project_id: str | None = None) -> list[BackupJob]:
+        with self._lock:
+            self._prune()
+            jobs = [j for j in self._jobs.values() if project_id is None or j.project_id == project_id]
+        return sorted(jobs, key=lambda j: j.snapshot()["started_at"], reverse=True)
+
+    def shutdown(self):
+        """服务退出时取消所有进行中的备份，不留下 7z 进程和未完成的归档"""
+        for job in list(self._jobs.values()):
+            if not job.finished:
+                job.cancel()
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [jid for jid, j in self._jobs.items()
+                       if j.finished and now - (j.snapshot()["finished_at"] or now) > self.retention]:
+            del self._jobs[job_id]
+
+    def _run(self, job: BackupJob):
+        backup_dir = project_backup_dir(job.project_name)
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        stem = f"{job.project_name}-{timestamp}"
+        filename = stem + (SNAPSHOT_SUFFIX if job.format == "snapshot" else ".7z")
+        filepath = backup_dir / filename
+        # 压缩过程中写入 .part，成功后再改名，列表中不会出现未完成的归档
+        part_path = backup_dir / f"{filename}.part"
+        started = time.monotonic()
+        try:
+            files, stats, bytes_total = self._scan(job)
+            job.update(phase="compressing", files_total=len(files), bytes_total=bytes_total, current_file=None)
+            meta = {"remark": job.remark, "format": job.format, "ignore_patterns": job.ignore_patterns}
+            if job.format == "snapshot":
+                file_count, stored_size = self._snapshot(job, files, stats, bytes_total, filepath, self._previous_snapshot(backup_dir))
+                # 快照清单本身很小，列表中显示的大小取快照内文件的总大小
+                meta.update(size=bytes_total, stored_size=stored_size, file_count=file_count, changes=job.snapshot()["changes"])
+            else:
+                self._compress(job, files, bytes_total, part_path)
+                os.replace(part_path, filepath)
+                meta.update(size=filepath.stat().st_size, file_count=len(files))
+            # 附属文件供数据库丢失时重建备份目录
+            with open(backup_dir / f"{stem}.json", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        except BaseException as e:
+            part_path.unlink(missing_ok=True)
+            canceled = isinstance(e, BackupCanceled)
+            metrics.BACKUPS_TOTAL.inc(project=job.project_name, status="canceled" if canceled else "failed")
+            job.update(status="CANCELED" if canceled else "FAILED", phase="done",
+                       error=None if canceled else str(e), finished_at=time.time())
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        try:
+            backup_catalog.record(job.project_name, filepath, meta)
+        except Exception as e:
+            # 备份本身已完成，记录缺失时由对账补录
+            print(f"写入备份目录失败 ({filename}): {e}")
+        stat = filepath.stat()
+        metrics.BACKUP_DURATION_SECONDS.observe(time.monotonic() - started, project=job.project_name)
+        metrics.BACKUP_ARCHIVE_BYTES.observe(meta.get("stored_size", stat.st_size), project=job.project_name)
+        metrics.BACKUPS_TOTAL.inc(project=job.project_name, status="success")
+        job.update(status="SUCCESS", phase="done", percent=100.0, eta=0, finished_at=time.time(), backup={
+            "filename": filename,
+            "size": meta["size"],
+            "created_at": datetime.fromtimestamp(stat.st_ctime).isoformat(),
+            "remark": job.remark,
+            "format": job.format,
+            "stored_size": meta.get("stored_size"),
+            "file_count": meta["file_count"],
+        })
+
+    def _scan(self, job: BackupJob) -> tuple[list[str], dict[str, tuple], int]:
+        """遍历构建上下文，返回 (文件列表, 相对路径 -> (大小, mtime_ns, inode, 权限), 总字节数)"""
+        files, stats, bytes_total = [], {}, 0
+        for rel_path, entry in walk_entries(job.build_context, IgnoreMatcher(job.ignore_patterns)):
+            files.append(rel_path)
+            try:
+                st = entry.stat()
+            except OSError:
+                pass
+            else:
+                stats[rel_path] = (st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode & 0o7777)
+                bytes_total += st.st_size
+            if len(files) % SCAN_REPORT_EVERY == 0:
+                job.check_canceled()
+                job.update(files_scanned=len(files), current_file=rel_path)
+        job.check_canceled()
+        job.update(files_scanned=len(files))
+        return files, stats, bytes_total
+
+    def _compress(self, job: BackupJob, files: list[str], bytes_total: int, archive_path: Path):
+        # -mx=1: Fast compression
+        # -m0=lzma2: Force LZMA2
+        # -mf=off: Explicitly disable all filters (BCJ/BCJ2) to avoid "Unknown Method" errors
+        # -mmt=on: Multi-threading
+        # -bsp1 -bso0: progress to stdout, suppress the normal listing
+        # 文件列表经 stdin 传给 7z (@/dev/stdin)。7z 读取列表文件时需要知道文件长度，不能直接用管道，
+        # 因此 stdin 是一个匿名临时文件 (创建后即删除，不会在备份目录留下列表文件)。
+        cmd = [
+            "7z", "a",
+            "-t7z",
+            "-mx=1",
+            "-m0=lzma2",
+            "-mf=off",
+            "-mmt=on",
+            "-bsp1", "-bso0",
+            "-scsUTF-8",
+            str(archive_path),
+            "@/dev/stdin",
+        ]
+        with tempfile.TemporaryFile() as list_file:
+            list_file.write("".join(f"{item}\n" for item in files).encode("utf-8"))
+            list_file.seek(0)
+            job.check_canceled()
+            process = subprocess.Popen(cmd, cwd=job.build_context, stdin=list_file, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        job._process = process
+        if job._canceled.is_set():
+            process.terminate()
+        stderr_chunks: list[bytes] = []
+        stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+
+        compress_started = time.monotonic()
+        pending = b""
+        try:
+            while True:
+                chunk = os.read(process.stdout.fileno(), 4096)
+                if not chunk:
+                    break
+                *parts, pending = _PROGRESS_SEP.split(pending + chunk)
+                progress = next((p for p in map(parse_7z_progress, (x.decode(errors="replace") for x in reversed(parts))) if p), None)
+                if progress:
+                    percent, files_done, current = progress
+                    self._report(job, int(bytes_total * percent / 100), bytes_total, time.monotonic() - compress_started,
+                                 files_done=files_done, current_file=current, percent=percent)
+            returncode = process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            stderr_reader.join(timeout=5)
+            job._process = None
+        job.check_canceled()
+        if returncode != 0:
+            stderr = b"".join(stderr_chunks).decode(errors="replace")
+            raise Exception(f"7z failed (code {returncode}): {stderr}")
+
+    def _previous_snapshot(self, backup_dir: Path) -> Path | None:
+        # 文件名中的时间戳保证按名称排序即按创建时间排序
+        snapshots = sorted(backup_dir.glob(f"*{SNAPSHOT_SUFFIX}"))
+        return snapshots[-1] if snapshots else None
+
+    def _snapshot(self, job: BackupJob, files: list[str], stats: dict[str, tuple], bytes_total: int,
+                  manifest_path: Path, previous: Path | None) -> tuple[int, int]:
+        """
+        把文件写入去重存储并提交快照清单，返回 (文件数, 新写入存储的字节数)。
+        与上一个快照比较 (大小, mtime_ns, inode)：三者都没变的文件直接沿用上次的数据块，只读取新增和变化的文件。
+        """
+        pins: dict[str, int] = {}
+        index = backup_store.load_index(previous, job.build_context) if previous else {}
+
+        entries, to_read, changes = [], [], {"added": 0, "changed": 0, "deleted": 0, "unchanged": 0}
+        bytes_done = 0
+        for rel_path in files:
+            old, st = index.get(rel_path), stats.get(rel_path)
+            if old is None:
+                changes["added"] += 1
+            elif st is None or (old[2], old[3], old[5]) != st[:3]:
+                changes["changed"] += 1
+            elif backup_store.reuse(old[4], pins):
+                changes["unchanged"] += 1
+                entries.append([rel_path, st[3], st[0], st[1], old[4], st[2]])
+                bytes_done += st[0]
+                continue
+            else:
+                # 数据块已随上一个快照被删除，按变化的文件处理
+                changes["changed"] += 1
+            to_read.append(rel_path)
+        current = set(files)
+        changes["deleted"] = sum(1 for rel_path in index if rel_path not in current)
+        job.update(changes=changes)
+
+        def store(rel_path: str):
+            job.check_canceled()
+            abs_path = os.path.join(job.build_context, rel_path)
+            try:
+                st = os.stat(abs_path)
+                chunks, new_bytes = backup_store.store_file(abs_path, pins)
+            except FileNotFoundError:
+                # 扫描之后被删除的文件不计入快照
+                return None, 0
+            return [rel_path, st.st_mode & 0o7777, st.st_size, st.st_mtime_ns, chunks, st.st_ino], new_bytes
+
+        stored_size = 0
+        files_done, skipped_bytes = len(entries), bytes_done
+        started = time.monotonic()
+        self._report(job, bytes_done, bytes_total, 0, files_done=files_done)
+        pool = ThreadPoolExecutor(max_workers=max(1, BACKUP_SNAPSHOT_WORKERS), thread_name_prefix=f"snapshot-{job.id[:8]}")
+        try:
+            for i, (entry, new_bytes) in enumerate(pool.map(store, to_read), 1):
+                files_done += 1
+                if entry:
+                    entries.append(entry)
+                    stored_size += new_bytes
+                    bytes_done += entry[2]
+                if i % SNAPSHOT_REPORT_EVERY == 0 or i == len(to_read):
+                    self._report(job, bytes_done, bytes_total, time.monotonic() - started,
+                                 files_done=files_done, current_file=entry[0] if entry else None, skipped_bytes=skipped_bytes)
+            job.check_canceled()
+            entries.sort(key=lambda e: e[0])
+            backup_store.commit(manifest_path, {
+                "version": MANIFEST_VERSION,
+                "project": job.project_name,
+                "build_context": job.build_context,
+                "ignore_patterns": job.ignore_patterns,
+                "created_at": datetime.now().isoformat(),
+                "previous": previous.name if previous else None,
+                "files": entries,
+            }, pins)
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            backup_store.abort(pins)
+            raise
+        finally:
+            pool.shutdown(wait=True)
+        return len(entries), stored_size
+
+    def _report(self, job: BackupJob, bytes_done: int, bytes_total: int, elapsed: float,
+                files_done: int | None = None, current_file: str | None = None, percent: float | None = None,
+                skipped_bytes: int = 0):
+        """skipped_bytes: 已计入 bytes_done 但没有实际读取的字节数 (沿用上次快照的文件)，不参与速度计算"""
+        if percent is None:
+            percent = bytes_done * 100 / bytes_total if bytes_total else 100.0
+        throughput = (bytes_done - skipped_bytes) / elapsed if elapsed > 0 else None
+        eta = (bytes_total - bytes_done) / throughput if throughput else None
+        fields = {"percent": float(percent), "bytes_done": bytes_done, "throughput": throughput, "eta": eta}
+        if files_done is not None:
+            fields["files_done"] = files_done
+        if current_file:
+            fields["current_file"] = current_file.strip()
+        job.update(**fields)
+
+backup_jobs = BackupJobManager()
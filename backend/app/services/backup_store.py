@@ -0,0 +1,267 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+
+from sqlalchemy import text
+
+from ..core.config import BACKUP_DIR, BACKUP_STORE_DIR, BACKUP_CHUNK_SIZE
+from ..database.database import SessionLocal
+
+# 去重快照备份：
+# - 文件内容按固定大小切块，每块以 sha256 寻址、zlib 压缩后保存在 chunks/<前两位>/<hash>，整个实例共享，
+#   同一项目的多次快照以及指向同一构建目录的不同项目只保存一份相同的内容；
+# - 每个快照只是一个 gzip 压缩的 JSON 清单 (<项目>-<时间>.snap)，记录路径、权限、大小、mtime、数据块列表和 inode；
+#   下一次快照中 (大小, mtime, inode) 都没有变化的文件直接沿用上次的数据块，不再读取；
+# - backup_chunks 表记录每个数据块被多少个快照引用，删除快照时引用计数减一，归零的数据块随即删除。
+# 正在写入的快照引用的数据块在内存中"钉住"，垃圾回收不会删除它们，避免与并发的删除操作竞争。
+
+# 2: 文件条目末尾增加 inode，用于判断文件是否变化
+MANIFEST_VERSION = 2
+SNAPSHOT_SUFFIX = ".snap"
+# 一次 SQL 语句中最多绑定的 hash 数
+_SQL_BATCH = 500
+
+def _batches(items: list, size: int = _SQL_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class BackupStore:
+    def __init__(self, root: Path = BACKUP_STORE_DIR, chunk_size: int = BACKUP_CHUNK_SIZE):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        # 正在写入的快照引用的数据块 (hash -> 引用它的快照数)
+        self._pins: Counter = Counter()
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.root / "chunks" / digest[:2] / digest
+
+    # --- 写入 ---
+
+    def _pin(self, digest: str, pins: dict[str, int]) -> int | None:
+        """钉住数据块并返回它已保存的大小，尚未保存时返回 None"""
+        with self._lock:
+            if digest not in pins:
+                self._pins[digest] += 1
+                pins[digest] = 0
+            try:
+                size = self.chunk_path(digest).stat().st_size
+            except FileNotFoundError:
+                return None
+            pins[digest] = size
+            return size
+
+    def _write_chunk(self, digest: str, data: bytes) -> int:
+        compressed = zlib.compress(data, 1)
+        path = self.chunk_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        # 并发写入同一数据块时内容相同，后写入的直接覆盖
+        os.replace(tmp_path, path)
+        return len(compressed)
+
+    def store_file(self, abs_path: str, pins: dict[str, int]) -> tuple[list[str], int]:
+        """
+        把文件切块写入存储，返回 (数据块 hash 列表, 本次新写入的字节数)。
+        pins 由同一快照的所有文件共享，记录该快照引用的数据块及其保存大小 (多线程调用时由锁保护)。
+        """
+        chunks, new_bytes = [], 0
+        with open(abs_path, "rb") as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                chunks.append(digest)
+                if self._pin(digest, pins) is None:
+                    size = self._write_chunk(digest, data)
+                    pins[digest] = size
+                    new_bytes += size
+        return chunks, new_bytes
+
+    def reuse(self, chunks: list[str], pins: dict[str, int]) -> bool:
+        """
+        沿用上一个快照中未变化文件的数据块：全部仍在存储中时钉住并返回 True；
+        有数据块已被回收 (上一个快照在此期间被删除) 时返回 False，调用方改为重新读取文件。
+        """
+        with self._lock:
+            sizes = {}
+            for digest in chunks:
+                if digest in pins or digest in sizes:
+                    continue
+                try:
+                    sizes[digest] = self.chunk_path(digest).stat().st_size
+                except FileNotFoundError:
+                    return False
+            for digest, size in sizes.items():
+                self._pins[digest] += 1
+                pins[digest] = size
+            return True
+
+    def commit(self, manifest_path: Path, manifest: dict, pins: dict[str, int]):
+        """写入清单并为其引用的数据块增加引用计数，然后解除钉住"""
+        part_path = manifest_path.with_name(manifest_path.name + ".part")
+        try:
+            with gzip.open(part_path, "wt", encoding="utf-8", compresslevel=6) as f:
+                json.dump(manifest, f, separators=(",", ":"))
+            with self._lock:
+                if pins:
+                    db = SessionLocal()
+                    try:
+                        db.execute(text(
+                            "INSERT INTO backup_chunks (hash, stored_size, refcount) VALUES (:hash, :size, 1) "
+                            "ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1"
+                        ), [{"hash": h, "size": size} for h, size in pins.items()])
+                        db.commit()
+                    finally:
+                        db.close()
+                os.replace(part_path, manifest_path)
+                self._unpin(pins)
+        except BaseException:
+            part_path.unlink(missing_ok=True)
+            raise
+
+    def abort(self, pins: dict[str, int]):
+        """快照失败或被取消：解除钉住，删除没有任何快照引用的数据块"""
+        with self._lock:
+            self._unpin(pins)
+            self._collect(list(pins))
+
+    def _unpin(self, pins: dict[str, int]):
+        for digest in pins:
+            self._pins[digest] -= 1
+            if self._pins[digest] <= 0:
+                del self._pins[digest]
+
+    def _collect(self, candidates: list[str]) -> int:
+        """删除候选中引用计数为零 (或没有记录) 且未被钉住的数据块，返回释放的字节数。调用方持有锁"""
+        db = SessionLocal()
+        try:
+            referenced = set()
+            for batch in _batches(candidates):
+                rows = db.execute(text(
+                    f"SELECT hash FROM backup_chunks WHERE refcount > 0 AND hash IN ({','.join(f':h{i}' for i in range(len(batch)))})"
+                ), {f"h{i}": h for i, h in enumerate(batch)}).all()
+                referenced.update(row[0] for row in rows)
+            garbage = [h for h in candidates if h not in referenced and h not in self._pins]
+            freed = 0
+            for digest in garbage:
+                path = self.chunk_path(digest)
+                try:
+                    freed += path.stat().st_size
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            if garbage:
+                db.execute(text("DELETE FROM backup_chunks WHERE hash = :hash"), [{"hash": h} for h in garbage])
+                db.commit()
+            return freed
+        finally:
+            db.close()
+
+    # --- 读取与删除 ---
+
+    def read_manifest(self, manifest_path: Path) -> dict:
+        with gzip.open(manifest_path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_index(self, manifest_path: Path, build_context: str) -> dict[str, list]:
+        """
+        读取快照的文件索引 (相对路径 -> 清单条目)，用于下一次快照的变化检测。
+        旧版本清单没有 inode，或快照对应的构建目录已变化时返回空索引 (全部文件重新读取)。
+        """
+        try:
+            manifest = self.read_manifest(manifest_path)
+        except (OSError, ValueError) as e:
+            print(f"读取快照清单失败 ({manifest_path}): {e}")
+            return {}
+        if manifest.get("version", 1) < 2 or manifest.get("build_context") != build_context:
+            return {}
+        return {entry[0]: entry for entry in manifest["files"]}
+
+    def release(self, manifest_path: Path) -> int:
+        """删除快照：引用计数减一，回收归零的数据块，返回释放的字节数"""
+        try:
+            digests = sorted({h for entry in self.read_manifest(manifest_path)["files"] for h in entry[4]})
+        except (OSError, ValueError, KeyError) as e:
+            # 清单已损坏，无法得知引用了哪些数据块，留给 gc() 做全量回收
+            print(f"读取快照清单失败 ({manifest_path}): {e}")
+            manifest_path.unlink(missing_ok=True)
+            return 0
+        with self._lock:
+            if digests:
+                db = SessionLocal()
+                try:
+                    db.execute(text("UPDATE backup_chunks SET refcount = refcount - 1 WHERE hash = :hash"),
+                               [{"hash": h} for h in digests])
+                    db.commit()
+                finally:
+                    db.close()
+            manifest_path.unlink(missing_ok=True)
+            return self._collect(digests)
+
+    def restore(self, manifest_path: Path, target_dir: Path):
+        target_root = target_dir.resolve()
+        for rel_path, mode, size, mtime_ns, chunks, *_ in self.read_manifest(manifest_path)["files"]:
+            # 清单中的路径不允许跳出目标目录
+            if Path(rel_path).is_absolute() or ".." in Path(rel_path).parts:
+                raise Exception(f"快照清单中的路径无效: {rel_path}")
+            dest = target_root / rel_path
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if dest.is_symlink():
+                dest.unlink()
+            with open(dest, "wb") as out:
+                for digest in chunks:
+                    try:
+                        out.write(zlib.decompress(self.chunk_path(digest).read_bytes()))
+                    except FileNotFoundError:
+                        raise Exception(f"备份数据块缺失: {digest} ({rel_path})")
+            os.chmod(dest, mode)
+            os.utime(dest, ns=(mtime_ns, mtime_ns))
+
+    def gc(self) -> dict:
+        """
+        全量回收：按现存的所有快照清单重建引用计数，删除不再被引用的数据块。
+        用于修复异常中断留下的计数偏差或孤立数据块。
+        """
+        with self._lock:
+            refs: Counter = Counter()
+            for manifest_path in BACKUP_DIR.glob(f"*/*{SNAPSHOT_SUFFIX}"):
+                try:
+                    refs.update({h for entry in self.read_manifest(manifest_path)["files"] for h in entry[4]})
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"读取快照清单失败 ({manifest_path}): {e}")
+            on_disk = {p.name: p for p in (self.root / "chunks").glob("*/*") if not p.name.endswith(".tmp")}
+            db = SessionLocal()
+            try:
+                db.execute(text("DELETE FROM backup_chunks"))
+                rows = [{"hash": h, "size": on_disk[h].stat().st_size, "refcount": n} for h, n in refs.items() if h in on_disk]
+                if rows:
+                    db.execute(text("INSERT INTO backup_chunks (hash, stored_size, refcount) VALUES (:hash, :size, :refcount)"), rows)
+                db.commit()
+            finally:
+                db.close()
+            freed, removed = 0, 0
+            for digest, path in on_disk.items():
+                if digest not in refs and digest not in self._pins:
+                    freed += path.stat().st_size
+                    path.unlink()
+                    removed += 1
+            return {"chunks_removed": removed, "bytes_freed": freed, "missing_chunks": sum(1 for h in refs if h not in on_disk)}
+
+    def stats(self) -> dict:
+        db = SessionLocal()
+        try:
+            count, stored = db.execute(text("SELECT COUNT(*), COALESCE(SUM(stored_size), 0) FROM backup_chunks")).one()
+        finally:
+            db.close()
+        return {"chunks": count, "stored_bytes": stored, "chunk_size": self.chunk_size}
+
+backup_store = BackupStore()
@@ -0,0 +1,146 @@
+import os
+import re
+from sqlalchemy.orm import Session
+
+from ..database import crud, models
+from ..schemas import task as task_schema
+
+DOCKER_HUB_HOSTS = ("docker.io", "index.docker.io", "registry-1.docker.io")
+
+# FROM [--platform=...] <image> [AS <name>]
+_FROM = re.compile(r"^\s*FROM\s+(?P<args>.+)$", re.IGNORECASE)
+
+def parse_base_images(dockerfile_text: str) -> list[str]:
+    """提取 Dockerfile 中引用的外部基础镜像 (排除 scratch 和引用前面构建阶段的 FROM)"""
+    images, stages = [], set()
+    for line in dockerfile_text.splitlines():
+        match = _FROM.match(line)
+        if not match:
+            continue
+        tokens = [t for t in match.group("args").split() if not t.startswith("--")]
+        if not tokens:
+            continue
+        image = tokens[0]
+        if len(tokens) >= 3 and tokens[1].upper() == "AS":
+            stages.add(tokens[2].lower())
+        if image.lower() in stages or image.lower() == "scratch":
+            continue
+        images.append(image)
+    return images
+
+def image_repository(ref: str) -> str:
+    """去掉镜像引用中的 digest 和标签，Docker Hub 的地址前缀与 library/ 一并去掉"""
+    ref = ref.split("@", 1)[0]
+    name, _, tag = ref.rpartition(":")
+    if name and "/" not in tag:
+        ref = name
+    for host in DOCKER_HUB_HOSTS:
+        if ref.startswith(host + "/"):
+            ref = ref[len(host) + 1:]
+            break
+    if ref.startswith("library/"):
+        ref = ref[len("library/"):]
+    return ref
+
+def project_repositories(db: Session, project: models.Project) -> set[str]:
+    """项目推送的镜像可能被其他 Dockerfile 引用的名字 (带或不带仓库地址)"""
+    names = {project.repo_image_name}
+    if project.registry_id:
+        registry = crud.get_registry(db, project.registry_id)
+        if registry:
+            host = registry.url.replace("https://", "").replace("http://", "").rstrip("/")
+            if host not in DOCKER_HUB_HOSTS:
+                names = {f"{host}/{project.repo_image_name}"}
+    return {image_repository(name) for name in names}
+
+def detect_dependencies(db: Session, projects: list[models.Project]) -> dict[str, set[str]]:
+    """根据 Dockerfile 的 FROM 引用找出批次内项目之间的依赖: 子项目 id -> 父项目 id 集合"""
+    owners: dict[str, str] = {}
+    for project in projects:
+        for name in project_repositories(db, project):
+            owners[name] = project.id
+
+    result: dict[str, set[str]] = {}
+    for project in projects:
+        try:
+            path = os.path.join(project.build_context, project.dockerfile_path)
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                images = parse_base_images(f.read())
+        except OSError:
+            continue
+        parents = {owners[image_repository(image)] for image in images if image_repository(image) in owners}
+        parents.discard(project.id)
+        if parents:
+            result[project.id] = parents
+    return result
+
+def plan_batch(db: Session, request: task_schema.BatchBuildRequest) -> list[dict]:
+    """
+    把批量请求展开为构建节点并按依赖排好序。
+    每个节点为 {"task_id": None, "project": Project, "tag": str, "parents": [节点下标]}。
+    子项目的节点依赖父项目中标签相同的节点；父项目没有相同标签时依赖父项目的全部节点。
+    项目不存在或依赖成环时抛出 ValueError。
+    """
+    entries: list[tuple[str, str, list[str]]] = [(item.project_id, item.tag, list(item.depends_on)) for item in request.items]
+    if request.matrix:
+        entries.extend((project_id, tag, []) for project_id in request.matrix.project_ids for tag in request.matrix.tags)
+    if not entries:
+        raise ValueError("批量构建至少需要一个项目")
+
+    projects: dict[str, models.Project] = {}
+    nodes: dict[tuple[str, str], dict] = {}
+    explicit: dict[str, set[str]] = {}
+    for project_id, tag, depends_on in entries:
+        if project_id not in projects:
+            project = crud.get_project(db, project_id)
+            if not project:
+                raise ValueError(f"项目未找到: {project_id}")
+            projects[project_id] = project
+        tag = tag.strip() or "latest"
+        nodes.setdefault((project_id, tag), {"task_id": None, "project": projects[project_id], "tag": tag, "parents": []})
+        explicit.setdefault(project_id, set()).update(depends_on)
+
+    for parent_ids in explicit.values():
+        unknown = [p for p in parent_ids if p not in projects]
+        if unknown:
+            raise ValueError(f"依赖的项目不在本次批量构建中: {', '.join(unknown)}")
+
+    project_parents = {project_id: set(parent_ids) for project_id, parent_ids in explicit.items()}
+    if request.detect_from:
+        for child, parents in detect_dependencies(db, list(projects.values())).items():
+            project_parents.setdefault(child, set()).update(parents)
+
+    keys = list(nodes.keys())
+    for (project_id, tag) in keys:
+        for parent_id in sorted(project_parents.get(project_id, ())):
+            same_tag = (parent_id, tag)
+            if same_tag in nodes:
+                nodes[(project_id, tag)]["parents"].append(same_tag)
+            else:
+                nodes[(project_id, tag)]["parents"].extend(k for k in keys if k[0] == parent_id)
+
+    # Kahn 拓扑排序，保持请求中的原始顺序
+    remaining = {key: len(node["parents"]) for key, node in nodes.items()}
+    children: dict[tuple, list[tuple]] = {key: [] for key in keys}
+    for key, node in nodes.items():
+        for parent in node["parents"]:
+            children[parent].append(key)
+    ordered = []
+    ready = [key for key in keys if remaining[key] == 0]
+    while ready:
+        key = ready.pop(0)
+        ordered.append(key)
+        for child in children[key]:
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                ready.append(child)
+    if len(ordered) != len(keys):
+        cycle = sorted({projects[k[0]].name for k in keys if remaining[k] > 0})
+        raise ValueError(f"项目之间的依赖存在循环: {', '.join(cycle)}")
+
+    index = {key: i for i, key in enumerate(ordered)}
+    result = []
+    for key in ordered:
+        node = nodes[key]
+        result.append({**node, "parents": [index[parent] for parent in node["parents"]]})
+    return result
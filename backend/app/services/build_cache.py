@@ -0,0 +1,136 @@
+import fcntl
+import os
+import re
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+from ..core.config import BUILDX_CACHE_DIR
+
+# inline: 缓存元数据写进镜像本身 (只含最终阶段的层)
+# registry: 推送到专用的缓存镜像，mode=max 记录所有阶段
+# local: 导出到 data/ 下的本地目录，mode=max
+# none: 不导出缓存
+CACHE_MODES = ("inline", "registry", "local", "none")
+DEFAULT_CACHE_TAG = "buildcache"
+
+def detect_git_branch(context_dir: str) -> str | None:
+    """读取构建上下文中 .git/HEAD 得到当前分支 (分离头指针时返回 None)"""
+    head = Path(context_dir) / ".git" / "HEAD"
+    try:
+        content = head.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    if content.startswith("ref: refs/heads/"):
+        return content[len("ref: refs/heads/"):]
+    return None
+
+def sanitize_tag(value: str) -> str:
+    """分支名转换为合法的镜像标签"""
+    tag = re.sub(r"[^A-Za-z0-9_.-]", "-", value).lstrip(".-")
+    return tag[:128] or "branch"
+
+def _to_ref(repo_base: str, entry: str) -> str:
+    """不含 / 的条目视为当前仓库的标签，否则当作完整的镜像引用"""
+    return entry if "/" in entry else f"{repo_base}:{entry}"
+
+@contextmanager
+def _cache_dir_lock(cache_dir: Path):
+    """同一项目的多个任务 (各自独立的进程) 可能同时完成，替换缓存目录时用文件锁串行化"""
+    cache_dir.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_dir.with_name(cache_dir.name + ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class BuildCachePlan:
+    """
+    根据项目的缓存设置生成 buildx 的 --cache-from / --cache-to 参数。
+    local 模式按 BuildKit 推荐的方式先导出到新目录、构建成功后再替换旧目录，避免缓存目录无限增长。
+    同一项目可能有多个任务同时构建，每个任务导出到自己的目录 (<缓存目录>-new-<task_id>)。
+    """
+
+    def __init__(self, project_data: dict, repo_base: str, tags: list[str], previous_tag: str | None = None,
+                 platform: str | None = None, *, task_id: str):
+        self.mode = project_data.get("cache_mode") or "inline"
+        if self.mode not in CACHE_MODES:
+            self.mode = "inline"
+        self.no_cache = bool(project_data.get("no_cache"))
+        self.repo_base = repo_base
+        self.cache_ref = _to_ref(repo_base, project_data.get("cache_ref") or DEFAULT_CACHE_TAG)
+        self.local_dir = BUILDX_CACHE_DIR / project_data["id"]
+        if platform:
+            # 按平台分别构建时各平台导出独立的缓存，避免互相覆盖
+            suffix = sanitize_tag(platform.replace("/", "-"))
+            ref, _, tag = self.cache_ref.rpartition(":")
+            self.cache_ref = f"{ref}:{tag}-{suffix}" if ref and "/" not in tag else f"{self.cache_ref}:{suffix}"
+            self.local_dir = self.local_dir / suffix
+        self.task_id = task_id
+        self.local_dir_new = self.local_dir.with_name(f"{self.local_dir.name}-new-{task_id}")
+        self.sources = self._sources(project_data, tags, previous_tag)
+
+    def _sources(self, project_data: dict, tags: list[str], previous_tag: str | None) -> list[str]:
+        sources = []
+        if self.mode == "registry":
+            sources.append(f"type=registry,ref={self.cache_ref}")
+        elif self.mode == "local" and self.local_dir.is_dir():
+            sources.append(f"type=local,src={self.local_dir}")
+
+        # 再依次尝试：本次主标签、上次成功构建的标签、latest、当前分支、项目额外配置的来源
+        refs = [tags[0]]
+        if previous_tag:
+            refs.append(previous_tag)
+        refs.append("latest")
+        branch = detect_git_branch(project_data["build_context"])
+        if branch:
+            refs.append(sanitize_tag(branch))
+        extra = project_data.get("cache_from_refs") or ""
+        refs.extend(entry.strip() for entry in re.split(r"[,，\n]", extra) if entry.strip())
+
+        for ref in dict.fromkeys(_to_ref(self.repo_base, r) for r in refs):
+            sources.append(f"type=registry,ref={ref}")
+        return list(dict.fromkeys(sources))
+
+    def args(self) -> list[str]:
+        result = []
+        if self.mode == "inline":
+            result.append("--cache-to=type=inline")
+        elif self.mode == "registry":
+            result.append(f"--cache-to=type=registry,ref={self.cache_ref},mode=max")
+        elif self.mode == "local":
+            if self.local_dir_new.exists():
+                shutil.rmtree(self.local_dir_new, ignore_errors=True)
+            result.append(f"--cache-to=type=local,dest={self.local_dir_new},mode=max")
+
+        if not self.no_cache:
+            result.extend(f"--cache-from={source}" for source in self.sources)
+        return result
+
+    def describe(self) -> list[str]:
+        lines = [f"缓存模式: {self.mode}"]
+        if self.mode == "registry":
+            lines.append(f"缓存镜像: {self.cache_ref} (mode=max)")
+        elif self.mode == "local":
+            lines.append(f"本地缓存目录: {self.local_dir} (mode=max)")
+        if self.no_cache:
+            lines.append("已禁用读取旧缓存")
+        else:
+            lines.append("缓存来源: " + ", ".join(s.rsplit("=", 1)[1] for s in self.sources))
+        return lines
+
+    def finish(self, success: bool):
+        """local 模式：构建成功后用新导出的缓存替换旧缓存，失败则丢弃"""
+        if self.mode != "local" or not self.local_dir_new.exists():
+            return
+        if not success:
+            shutil.rmtree(self.local_dir_new, ignore_errors=True)
+            return
+        # 先把旧目录改名移开再换入新目录，两次改名都在锁内完成；后完成的任务的导出覆盖先完成的
+        old_dir = self.local_dir.with_name(f"{self.local_dir.name}-old-{self.task_id}")
+        with _cache_dir_lock(self.local_dir):
+            if self.local_dir.exists():
+                os.replace(self.local_dir, old_dir)
+            os.replace(self.local_dir_new, self.local_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
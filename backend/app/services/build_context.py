@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import re
+import stat
+import time
+from pathlib import Path
+
+def translate_glob(pattern: str) -> str:
+    """把 .dockerignore / .gitignore 通配符转换为正则片段 (不含锚点)：** 跨目录，* 和 ? 不跨越 /"""
+    i, out = 0, []
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "*":
+            if pattern[i:i + 2] == "**":
+                # "**/" 也要匹配零层目录
+                if pattern[i:i + 3] == "**/":
+                    out.append("(?:.*/)?")
+                    i += 3
+                    continue
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("^") or body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end + 1
+                continue
+        elif c == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+class DockerIgnore:
+    """
+    按 Docker 的 .dockerignore 语义判断路径是否被排除：
+    规则按顺序匹配、最后一条命中的规则生效，以 ! 开头的规则表示重新包含。
+    """
+
+    def __init__(self, lines: list[str]):
+        self.rules: list[tuple[re.Pattern, bool]] = []
+        for raw in lines:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:].strip()
+            line = os.path.normpath(line).replace(os.sep, "/").lstrip("/")
+            if line in ("", "."):
+                continue
+            # 匹配某个目录即排除其下所有内容
+            self.rules.append((re.compile("^" + translate_glob(line) + "(?:/.*)?$"), negate))
+        self.has_exceptions = any(negate for _, negate in self.rules)
+
+    @classmethod
+    def from_context(cls, context_dir: str) -> "DockerIgnore":
+        path = os.path.join(context_dir, ".dockerignore")
+        if not os.path.isfile(path):
+            return cls([])
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return cls(f.read().splitlines())
+
+    def is_excluded(self, rel_path: str) -> bool:
+        excluded = False
+        for regex, negate in self.rules:
+            if regex.match(rel_path):
+                excluded = not negate
+        return excluded
+
+def iter_context_entries(context_dir: str, ignore: DockerIgnore, always_include: tuple[str, ...] = ()):
+    """
+    按稳定顺序遍历构建上下文中会发送给 Docker 的目录和文件，产出 (相对路径, 绝对路径, 是否目录)。
+    always_include 中的文件 (Dockerfile、.dockerignore) 即使被规则排除也会保留，与 docker CLI 一致。
+    """
+    forced = set(always_include)
+    for root, dirs, files in os.walk(context_dir):
+        rel_root = os.path.relpath(root, context_dir).replace(os.sep, "/")
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        dirs.sort()
+        kept = []
+        for d in dirs:
+            rel_dir = rel_root + d
+            excluded = ignore.is_excluded(rel_dir)
+            if not excluded:
+                yield rel_dir, os.path.join(root, d), True
+            # 没有 ! 例外规则时，被排除的目录可以整体跳过
+            if not excluded or ignore.has_exceptions or any(f.startswith(rel_dir + "/") for f in forced):
+                kept.append(d)
+        dirs[:] = kept
+        for name in sorted(files):
+            rel_path = rel_root + name
+            if rel_path in forced or not ignore.is_excluded(rel_path):
+                yield rel_path, os.path.join(root, name), False
+
+def iter_context_files(context_dir: str, ignore: DockerIgnore, always_include: tuple[str, ...] = ()):
+    """只遍历文件，产出 (相对路径, 绝对路径)"""
+    for rel_path, abs_path, is_dir in iter_context_entries(context_dir, ignore, always_include):
+        if not is_dir:
+            yield rel_path, abs_path
+
+class ContextStatCache:
+    """
+    构建上下文文件的 stat -> sha256 缓存 (类似 git index)。
+    (size, mtime_ns, inode, mode) 均未变化的文件直接复用上次的哈希，无需重新读取。
+    """
+
+    # mtime 距今太近的文件可能在同一时间粒度内再次被修改，不写入缓存
+    RACY_WINDOW_NS = 2 * 10 ** 9
+
+    def __init__(self, path: Path | None = None):
+        self.path = path
+        self.entries: dict[str, list] = {}
+        self.hits = 0
+        self._seen: set[str] = set()
+        if path and path.exists():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f).get("files", {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    @staticmethod
+    def _key(st: os.stat_result) -> list:
+        return [st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode]
+
+    def get(self, rel_path: str, st: os.stat_result) -> str | None:
+        self._seen.add(rel_path)
+        entry = self.entries.get(rel_path)
+        if entry and entry[:4] == self._key(st):
+            self.hits += 1
+            return entry[4]
+        return None
+
+    def put(self, rel_path: str, st: os.stat_result, sha256: str):
+        self._seen.add(rel_path)
+        if st.st_mtime_ns > time.time_ns() - self.RACY_WINDOW_NS:
+            self.entries.pop(rel_path, None)
+            return
+        self.entries[rel_path] = self._key(st) + [sha256]
+
+    def save(self):
+        """只保留本次遍历中出现过的文件，已删除文件的记录随之清理"""
+        if not self.path:
+            return
+        files = {k: v for k, v in self.entries.items() if k in self._seen}
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": files}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _hash_entry(rel_path: str, path: str, digest, stat_cache: ContextStatCache | None) -> None:
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode):
+        digest.update(b"L" + os.readlink(path).encode())
+        return
+    sha = stat_cache.get(rel_path, st) if stat_cache else None
+    if sha is None:
+        sha = file_sha256(path)
+        if stat_cache:
+            stat_cache.put(rel_path, st, sha)
+    # 可执行位会影响镜像内容，其余元数据 (mtime 等) 不参与指纹
+    digest.update((b"X" if st.st_mode & stat.S_IXUSR else b"F") + sha.encode())
+
+def compute_build_fingerprint(project_data: dict, platforms: list[str], proxy_data: dict | None,
+                              stat_cache: ContextStatCache | None = None) -> str:
+    """
+    构建输入的指纹：构建上下文 (遵循 .dockerignore) + Dockerfile + 平台 + 构建参数/代理。
+    任意一项变化都会得到不同的指纹。
+    """
+    context_dir = project_data["build_context"]
+    dockerfile_rel = os.path.normpath(project_data["dockerfile_path"]).replace(os.sep, "/")
+    digest = hashlib.sha256()
+    meta = {
+        "dockerfile_path": project_data["dockerfile_path"],
+        "platforms": sorted(platforms),
+        "proxy": proxy_data["url"] if proxy_data else None,
+    }
+    digest.update(json.dumps(meta, sort_keys=True).encode())
+
+    # Dockerfile 即使被 .dockerignore 排除也会参与构建
+    digest.update(b"\0dockerfile\0")
+    _hash_entry(dockerfile_rel, os.path.join(context_dir, dockerfile_rel), digest, stat_cache)
+
+    for rel_path, abs_path in iter_context_files(context_dir, DockerIgnore.from_context(context_dir)):
+        digest.update(b"\0" + rel_path.encode() + b"\0")
+        _hash_entry(rel_path, abs_path, digest, stat_cache)
+    return "sha256:" + digest.hexdigest()
@@ -0,0 +1,244 @@
+import re
+import threading
+import time
+
+# --- buildx --progress=plain 输出格式 ---
+# #5 [linux/arm64 builder 2/4] RUN apt-get update
+# #5 DONE 12.3s | #5 CACHED | #5 ERROR: ... | #5 CANCELED
+# #9 pushing layer sha256:1cb5... 8.43MB / 8.43MB 1.2s done
+_BX_HEADER = re.compile(r"^#(\d+) (?:\[(?P<label>[^\]]+)\] )?(?P<name>.+)$")
+_BX_DONE = re.compile(r"^#(\d+) DONE (?P<secs>[\d.]+)s$")
+_BX_STATE = re.compile(r"^#(\d+) (?P<state>CACHED|CANCELED|ERROR\b.*)$")
+_BX_PUSH_LAYER = re.compile(
+    r"^#(\d+) pushing layer (?P<layer>sha256:[0-9a-f]+)"
+    r"(?: (?P<current>[\d.]+\s*[kKMGT]?i?B) / (?P<total>[\d.]+\s*[kKMGT]?i?B))?"
+    r"(?: (?P<secs>[\d.]+)s)?(?P<done> done)?$"
+)
+# 进度行形如 "#5 0.123 Get:1 ..."，不是步骤标题
+_BX_PROGRESS = re.compile(r"^#\d+ \d+\.\d+ ")
+_PLATFORM = re.compile(r"^[a-z0-9]+/[a-z0-9]+(?:/v\d+)?$")
+_STEP = re.compile(r"^(\d+)/(\d+)$")
+
+# --- 经典构建器 (client.api.build) 输出格式 ---
+_CLASSIC_STEP = re.compile(r"^Step (\d+)/(\d+) : (.+)$")
+
+_SIZE_UNITS = {"B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+               "KIB": 1024, "MIB": 1024 ** 2, "GIB": 1024 ** 3, "TIB": 1024 ** 4}
+
+def parse_size(text: str) -> int | None:
+    match = re.match(r"^([\d.]+)\s*([kKMGT]?i?B)$", text.strip())
+    if not match:
+        return None
+    return int(float(match.group(1)) * _SIZE_UNITS.get(match.group(2).upper(), 1))
+
+class BuildStepRecorder:
+    """
+    把 buildx / 经典构建器 / SDK 推送的输出流解析为结构化步骤事件。
+    只做轻量的逐行匹配，解析失败的行直接忽略，不影响原始日志。
+    按平台并行构建时多个 buildx 进程的输出会交错送入，用 scope 区分各自的步骤编号。
+    """
+
+    def __init__(self):
+        self.steps: list[dict] = []
+        self._vertices: dict[str, dict] = {}
+        self._layers: dict[tuple[str, str], dict] = {}
+        self._classic_current: dict | None = None
+        self._lock = threading.Lock()
+
+    def _new_step(self, phase: str, instruction: str, platform: str | None = None, step_no: int | None = None) -> dict:
+        step = {
+            "seq": len(self.steps),
+            "phase": phase,
+            "platform": platform,
+            "step_no": step_no,
+            "instruction": instruction[:500],
+            "status": "RUNNING",
+            "cached": False,
+            "duration": None,
+            "bytes": None,
+            "_started": time.monotonic(),
+        }
+        self.steps.append(step)
+        return step
+
+    # --- buildx ---
+    def feed_buildx_line(self, line: str, scope: str = ""):
+        """scope 为单平台构建的平台名，同时作为输出中未标注平台的步骤的平台"""
+        line = line.strip()
+        if not line.startswith("#"):
+            return
+        with self._lock:
+            self._feed_buildx_line(line, scope)
+
+    def _feed_buildx_line(self, line: str, scope: str):
+        match = _BX_DONE.match(line)
+        if match:
+            step = self._vertices.get(f"{scope}#{match.group(1)}")
+            if step:
+                step["status"] = "DONE"
+                step["duration"] = float(match.group("secs"))
+            return
+
+        match = _BX_STATE.match(line)
+        if match:
+            step = self._vertices.get(f"{scope}#{match.group(1)}")
+            if step:
+                state = match.group("state")
+                if state == "CACHED":
+                    step.update(status="CACHED", cached=True, duration=0.0)
+                else:
+                    step["status"] = "ERROR" if state.startswith("ERROR") else "CANCELED"
+                    step["duration"] = round(time.monotonic() - step["_started"], 3)
+            return
+
+        match = _BX_PUSH_LAYER.match(line)
+        if match:
+            vertex_id, layer = f"{scope}#{match.group(1)}", match.group("layer")
+            key = (vertex_id, layer)
+            step = self._layers.get(key)
+            if step is None:
+                parent = self._vertices.get(vertex_id)
+                step = self._new_step("push", f"push layer {layer}", platform=parent["platform"] if parent else scope or None)
+                self._layers[key] = step
+            if match.group("total"):
+                step["bytes"] = parse_size(match.group("total"))
+            if match.group("secs"):
+                step["duration"] = float(match.group("secs"))
+            if match.group("done"):
+                step["status"] = "PUSHED"
+            return
+
+        if _BX_PROGRESS.match(line):
+            return
+
+        match = _BX_HEADER.match(line)
+        if match and f"{scope}#{match.group(1)}" not in self._vertices:
+            label, name = match.group("label"), match.group("name")
+            platform, step_no, phase = None, None, "export"
+            if label:
+                for token in label.split():
+                    if _STEP.match(token):
+                        step_no = int(_STEP.match(token).group(1))
+                    elif _PLATFORM.match(token):
+                        platform = token
+                # [internal]、[auth] 等没有步骤序号的是 BuildKit 内部步骤
+                phase = "build" if step_no is not None else "internal"
+            # 不是以已知动作开头的行多半是进度文本，不当作新步骤
+            elif not re.match(r"^(exporting|pushing|writing|naming|resolving|importing|preparing|sending|loading|merging)\b", name):
+                return
+            self._vertices[f"{scope}#{match.group(1)}"] = self._new_step(phase, name, platform=platform or scope or None, step_no=step_no)
+
+    # --- 经典构建器 ---
+    def feed_classic_chunk(self, chunk: dict):
+        if "error" in chunk or "errorDetail" in chunk:
+            if self._classic_current:
+                self._close_classic("ERROR")
+            return
+        text = chunk.get("stream", "").strip()
+        if not text:
+            return
+        match = _CLASSIC_STEP.match(text)
+        if match:
+            self._close_classic("DONE")
+            self._classic_current = self._new_step("build", match.group(3), step_no=int(match.group(1)))
+        elif text.startswith("---> Using cache") and self._classic_current:
+            self._classic_current["cached"] = True
+
+    def _close_classic(self, status: str):
+        step = self._classic_current
+        if not step:
+            return
+        step["duration"] = round(time.monotonic() - step["_started"], 3)
+        step["status"] = "CACHED" if step["cached"] and status == "DONE" else status
+        self._classic_current = None
+
+    def finish_classic_build(self):
+        self._close_classic("DONE")
+
+    # --- SDK 推送 ---
+    def feed_push_chunk(self, tag: str, chunk: dict):
+        layer = chunk.get("id")
+        status = chunk.get("status", "")
+        if not layer or not status:
+            return
+        key = (tag, layer)
+        step = self._layers.get(key)
+        if step is None:
+            step = self._new_step("push", f"push {tag} layer {layer}")
+            self._layers[key] = step
+        if status == "Pushing":
+            if not step.get("_pushing"):
+                # 从真正开始上传时计时，不含 Preparing/Waiting 的排队时间
+                step["_started"] = time.monotonic()
+                step["_pushing"] = True
+            total = (chunk.get("progressDetail") or {}).get("total")
+            if total:
+                step["bytes"] = max(step["bytes"] or 0, int(total))
+        elif status == "Pushed":
+            step["status"] = "PUSHED"
+            step["duration"] = round(time.monotonic() - step["_started"], 3)
+        elif status == "Layer already exists":
+            step.update(status="EXISTS", duration=0.0)
+        elif status.startswith("Mounted from"):
+            step.update(status="MOUNTED", duration=0.0)
+
+    def cache_summary(self) -> tuple[int, int]:
+        """
+        返回 (命中缓存的步骤数, 参与统计的步骤数)。
+        只统计 Dockerfile 指令步骤；FROM 只是拉取基础镜像，无论缓存与否都不执行，不计入。
+        """
+        cached = total = 0
+        for step in self.steps:
+            if step["phase"] != "build" or step["instruction"].upper().startswith("FROM "):
+                continue
+            if step["status"] not in ("DONE", "CACHED"):
+                continue
+            total += 1
+            cached += step["cached"]
+        return cached, total
+
+    def results(self) -> list[dict]:
+        """返回可持久化的步骤列表；未收到结束事件的步骤记为 INCOMPLETE"""
+        rows = []
+        for step in self.steps:
+            row = {k: v for k, v in step.items() if not k.startswith("_")}
+            if row["status"] == "RUNNING":
+                row["status"] = "INCOMPLETE"
+            rows.append(row)
+        return rows
+
+def compare_steps(base: list, target: list) -> list[dict]:
+    """
+    按 (阶段, 平台, 指令) 对齐两次构建的步骤，同一指令重复出现时按出现顺序配对。
+    返回按耗时增量降序排列的对比结果。
+    """
+    def keyed(steps):
+        seen: dict[tuple, int] = {}
+        result = {}
+        for s in steps:
+            if s.phase == "push":
+                continue
+            key = (s.phase, s.platform, s.instruction)
+            idx = seen.get(key, 0)
+            seen[key] = idx + 1
+            result[key + (idx,)] = s
+        return result
+
+    base_map, target_map = keyed(base), keyed(target)
+    rows = []
+    for key in list(dict.fromkeys([*target_map.keys(), *base_map.keys()])):
+        b, t = base_map.get(key), target_map.get(key)
+        b_dur = b.duration if b else None
+        t_dur = t.duration if t else None
+        rows.append({
+            "phase": key[0],
+            "platform": key[1],
+            "instruction": key[2],
+            "base_duration": b_dur,
+            "target_duration": t_dur,
+            "delta": (t_dur - b_dur) if b_dur is not None and t_dur is not None else None,
+            "base_cached": b.cached if b else None,
+            "target_cached": t.cached if t else None,
+        })
+    rows.sort(key=lambda r: (r["delta"] is None, -(r["delta"] or 0)))
+    return rows
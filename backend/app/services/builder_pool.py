@@ -0,0 +1,235 @@
+import fcntl
+import hashlib
+import json
+import re
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+from urllib.parse import urlparse
+
+from ..core.config import BUILDER_DIR, BUILDER_HEALTH_INTERVAL
+from ..database.database import SessionLocal
+from ..database import crud
+
+DOCKER_HUB_HOSTS = ("docker.io", "index.docker.io", "registry-1.docker.io", "")
+DEFAULT_BUILDER = "web-pusher-builder"
+PRIVATE_BUILDER_PREFIX = "builder-priv-"
+
+class BuilderSpec:
+    """某个私有仓库专用的 docker-container builder：信任该仓库的 HTTP/自签名证书"""
+
+    def __init__(self, registry_url: str):
+        if not (registry_url.startswith("http://") or registry_url.startswith("https://")):
+            registry_url = "https://" + registry_url
+        self.host = urlparse(registry_url).netloc
+        # 显式 http:// 开头，或者看起来像私有IP/带端口时启用 http
+        is_private_ip = any(self.host.startswith(prefix) for prefix in ["192.168.", "10.", "172."])
+        self.is_http = registry_url.startswith("http://") or is_private_ip or ":" in self.host
+        # 基于仓库地址生成唯一且稳定的名称
+        host_hash = hashlib.md5(self.host.encode()).hexdigest()[:6]
+        safe_host_name = re.sub(r'[^a-zA-Z0-9]', '-', self.host)
+        self.name = f"{PRIVATE_BUILDER_PREFIX}{safe_host_name}-{host_hash}"
+
+    @classmethod
+    def for_registry(cls, registry_url: str) -> "BuilderSpec | None":
+        """Docker Hub 使用默认 builder，返回 None"""
+        spec = cls(registry_url)
+        return None if spec.host in DOCKER_HUB_HOSTS else spec
+
+    def config(self) -> str:
+        return f"""[registry."{self.host}"]
+  http = {str(self.is_http).lower()}
+  insecure = true
+"""
+
+@contextmanager
+def _builder_lock(name: str):
+    """调度器进程和任务进程可能同时创建同一个 builder，用文件锁串行化"""
+    with open(BUILDER_DIR / f"{name}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def parse_builder_status(inspect_output: str) -> str:
+    """从 docker buildx inspect 的输出中取出节点状态 (running / inactive / stopped / error ...)"""
+    statuses = [line.split(":", 1)[1].strip() for line in inspect_output.splitlines() if line.strip().startswith("Status:")]
+    if not statuses:
+        return "unknown"
+    return "running" if all(s == "running" for s in statuses) else next(s for s in statuses if s != "running")
+
+def inspect_builder(name: str) -> str | None:
+    """返回 builder 节点状态，不存在时返回 None"""
+    result = subprocess.run(["docker", "buildx", "inspect", name], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return parse_builder_status(result.stdout)
+
+def list_builders() -> list[str]:
+    result = subprocess.run(["docker", "buildx", "ls", "--format", "json"], capture_output=True, text=True, check=True)
+    names = []
+    for line in result.stdout.splitlines():
+        if line.strip():
+            try:
+                names.append(json.loads(line)["Name"])
+            except (ValueError, KeyError):
+                pass
+    return names
+
+def bootstrap_builder(name: str) -> bool:
+    return subprocess.run(["docker", "buildx", "inspect", "--bootstrap", name], capture_output=True, text=True).returncode == 0
+
+def remove_builder(name: str):
+    subprocess.run(["docker", "buildx", "rm", "-f", name], capture_output=True, text=True)
+
+def create_builder(spec: BuilderSpec):
+    config_path = BUILDER_DIR / f"{spec.name}.toml"
+    config_path.write_text(spec.config(), encoding="utf-8")
+    create_cmd = [
+        "docker", "buildx", "create",
+        "--name", spec.name,
+        "--driver", "docker-container",
+        "--driver-opt", "network=host",
+        "--config", str(config_path),
+        "--bootstrap"
+    ]
+    try:
+        subprocess.run(create_cmd, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"无法创建支持 HTTP/Insecure 的构建环境 (Exit {e.returncode}): {e.stderr}")
+
+def ensure_builder(spec: BuilderSpec, log=print) -> str:
+    """
+    保证 builder 存在且在运行：不存在则创建，停止则启动，启动失败则删除重建。
+    返回本次执行的动作 (reused / bootstrapped / created / recreated)。
+    """
+    with _builder_lock(spec.name):
+        status = inspect_builder(spec.name)
+        if status == "running":
+            return "reused"
+        if status is None:
+            log(f"--- 🛠️ 初始化专用构建环境 {spec.name} (信任: {spec.host}, HTTP: {spec.is_http}) ---")
+            create_builder(spec)
+            return "created"
+        log(f"--- 🔧 构建环境 {spec.name} 状态为 {status}，尝试启动 ---")
+        if bootstrap_builder(spec.name):
+            return "bootstrapped"
+        log(f"--- ♻️ 构建环境 {spec.name} 无法启动，删除后重建 ---")
+        remove_builder(spec.name)
+        create_builder(spec)
+        return "recreated"
+
+class BuilderPool:
+    """
+    后台线程：为所有已配置的私有仓库预先创建并启动专用 builder。
+    - 定期检查健康状态，停止的自动启动，无法启动的删除重建；
+    - 仓库已删除的专用 builder 会被回收，但仍有任务在使用时推迟到之后的检查周期；
+    - 默认 builder (web-pusher-builder) 只检查和启动，创建仍由 /system/initialize 负责。
+    """
+
+    def __init__(self, interval: int = BUILDER_HEALTH_INTERVAL):
+        self.interval = interval
+        self.last_run: float | None = None
+        self._state: dict[str, dict] = {}
+        self._in_use: Callable[[], set[str]] | None = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, in_use: Callable[[], set[str]] | None = None):
+        """in_use() 返回正在被任务使用的 builder 名称，这些 builder 即使已无对应仓库也暂不回收"""
+        self._in_use = in_use
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="builder-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def request_sync(self):
+        """仓库新增/修改/删除后立即同步一次，无需等待下一个检查周期"""
+        self._wakeup.set()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "last_run": self.last_run,
+                "builders": [dict(v, name=k) for k, v in self._state.items()],
+            }
+
+    def _record(self, name: str, **fields):
+        with self._lock:
+            self._state.setdefault(name, {}).update(fields, checked_at=time.time())
+
+    def run_once(self):
+        db = SessionLocal()
+        try:
+            registries = crud.get_registries(db)
+        finally:
+            db.close()
+
+        desired: dict[str, tuple[BuilderSpec, str]] = {}
+        for registry in registries:
+            protocol = "https" if registry.is_https else "http"
+            clean_url = registry.url.replace("https://", "").replace("http://", "")
+            spec = BuilderSpec.for_registry(f"{protocol}://{clean_url}")
+            if spec:
+                desired[spec.name] = (spec, registry.name)
+
+        for name, (spec, registry_name) in desired.items():
+            if self._stop.is_set():
+                return
+            try:
+                action = ensure_builder(spec)
+                self._record(name, registry=registry_name, host=spec.host, status="running", action=action, error=None)
+            except Exception as e:
+                self._record(name, registry=registry_name, host=spec.host, status="error", action="failed", error=str(e))
+
+        status = inspect_builder(DEFAULT_BUILDER)
+        if status not in (None, "running") and bootstrap_builder(DEFAULT_BUILDER):
+            self._record(DEFAULT_BUILDER, registry=None, host=None, status="running", action="bootstrapped", error=None)
+        else:
+            self._record(DEFAULT_BUILDER, registry=None, host=None, status=status or "missing", action="checked", error=None)
+
+        # 回收仓库已被删除的专用 builder
+        try:
+            existing = list_builders()
+        except Exception as e:
+            print(f"列出 buildx builder 失败: {e}")
+            existing = []
+        in_use = self._in_use() if self._in_use else set()
+        for name in existing:
+            if name.startswith(PRIVATE_BUILDER_PREFIX) and name not in desired:
+                if name in in_use:
+                    # 仓库刚被删除但任务仍在用它构建，等任务结束后的检查周期再回收
+                    continue
+                with _builder_lock(name):
+                    remove_builder(name)
+                # 锁文件保留：其它进程可能正打开着它，删除后再创建会得到不同的 inode，文件锁失效
+                (BUILDER_DIR / f"{name}.toml").unlink(missing_ok=True)
+                print(f"已回收无对应仓库的 builder: {name}")
+        with self._lock:
+            for name in [n for n in self._state if n != DEFAULT_BUILDER and n not in desired]:
+                del self._state[name]
+            self.last_run = time.time()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"builder 池同步失败: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+builder_pool = BuilderPool()
@@ -0,0 +1,187 @@
+import os
+import stat
+import tarfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ..core.config import CONTEXT_PACK_WORKERS
+from .build_context import DockerIgnore, iter_context_entries
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+CHUNK_SIZE = 1024 * 1024
+
+_MAX_OCTAL_11 = 8 ** 11
+
+def _octal(value: int, width: int) -> bytes:
+    return b"%0*o\0" % (width - 1, value)
+
+def _fast_header(name: str, mode: int, size: int, mtime: int, typeflag: bytes, linkname: str = "") -> bytes | None:
+    """
+    常见情况 (ASCII 路径不超过 100 字节、大小/时间在八进制字段范围内) 直接拼出 ustar 头，
+    与 tarfile.TarInfo.tobuf(PAX_FORMAT) 的输出逐字节一致，但快得多；其它情况返回 None 交给 tarfile。
+    """
+    if not (name.isascii() and linkname.isascii() and len(name) <= 100 and len(linkname) <= 100
+            and 0 <= size < _MAX_OCTAL_11 and 0 <= mtime < _MAX_OCTAL_11):
+        return None
+    header = bytearray(BLOCK_SIZE)
+    header[0:len(name)] = name.encode()
+    header[100:108] = _octal(mode, 8)
+    header[108:116] = _octal(0, 8)
+    header[116:124] = _octal(0, 8)
+    header[124:136] = _octal(size, 12)
+    header[136:148] = _octal(mtime, 12)
+    header[148:156] = b"        "
+    header[156:157] = typeflag
+    header[157:157 + len(linkname)] = linkname.encode()
+    header[257:265] = tarfile.POSIX_MAGIC
+    header[148:156] = b"%06o\0 " % sum(header)
+    return bytes(header)
+
+def _padding(size: int) -> bytes:
+    remainder = size % BLOCK_SIZE
+    return b"\0" * (BLOCK_SIZE - remainder) if remainder else b""
+
+def _fit(data: bytes, size: int) -> bytes:
+    """文件在 stat 之后被修改时，按 tar 头中声明的大小截断或补零，保证归档结构正确"""
+    if len(data) == size:
+        return data
+    return data[:size] if len(data) > size else data + b"\0" * (size - len(data))
+
+def _read_small(path: str, size: int) -> bytes:
+    with open(path, "rb") as f:
+        return _fit(f.read(size), size)
+
+class ContextPacker:
+    """
+    标准模式的构建上下文打包器，替代 docker-py 在 Python 中先完整打 tar 再上传的做法：
+    - 遵循 .dockerignore，Dockerfile 和 .dockerignore 本身始终发送；
+    - 边打包边以生成器形式流式发送给 Docker，不落地临时 tar；
+    - 小文件由线程池并行预读 (受在途字节数限制)，大文件在发送线程中分块读取。
+    打包时不计算文件哈希：内容总要完整发送给 Docker，哈希只有未变化检测 (构建输入指纹) 需要，由指纹计算自行负责。
+    """
+
+    def __init__(self, context_dir: str, dockerfile: str,
+                 workers: int = CONTEXT_PACK_WORKERS, small_file_limit: int = 4 * 1024 * 1024,
+                 max_inflight_bytes: int = 64 * 1024 * 1024):
+        self.context_dir = context_dir
+        self.dockerfile = os.path.normpath(dockerfile).replace(os.sep, "/")
+        self.workers = max(1, workers)
+        self.small_file_limit = small_file_limit
+        self.max_inflight_bytes = max_inflight_bytes
+        self.stats = {"files": 0, "dirs": 0, "bytes": 0, "content_bytes": 0, "seconds": 0.0}
+
+    def _entries(self):
+        ignore = DockerIgnore.from_context(self.context_dir)
+        for rel_path, abs_path, is_dir in iter_context_entries(self.context_dir, ignore, (self.dockerfile, ".dockerignore")):
+            try:
+                st = os.lstat(abs_path)
+            except OSError:
+                continue
+            # 套接字、管道等特殊文件不进入构建上下文
+            if is_dir or stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode):
+                yield rel_path, abs_path, st
+
+    @staticmethod
+    def _header(rel_path: str, abs_path: str, st: os.stat_result) -> bytes:
+        mode, mtime = stat.S_IMODE(st.st_mode), int(st.st_mtime)
+        if stat.S_ISDIR(st.st_mode):
+            fast = _fast_header(rel_path + "/", mode, 0, mtime, tarfile.DIRTYPE)
+        elif stat.S_ISLNK(st.st_mode):
+            fast = _fast_header(rel_path, mode, 0, mtime, tarfile.SYMTYPE, os.readlink(abs_path))
+        else:
+            fast = _fast_header(rel_path, mode, st.st_size, mtime, tarfile.REGTYPE)
+        if fast is not None:
+            return fast
+
+        info = tarfile.TarInfo(rel_path)
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.mtime = int(st.st_mtime)
+        # 与 docker CLI 一致，属主统一为 root
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        if stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(st.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(abs_path)
+        else:
+            info.size = st.st_size
+        return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+    def stream(self):
+        """
+        生成 tar 数据块，可直接作为 client.api.build(fileobj=..., custom_context=True) 的请求体。
+        小块合并成约 CHUNK_SIZE 再发送：既减少分块传输的开销，也避免产出空块 (会被当作请求体结束)。
+        """
+        buffer = bytearray()
+        for piece in self._generate():
+            buffer += piece
+            if len(buffer) >= CHUNK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    def _generate(self):
+        started = time.monotonic()
+        stats = self.stats
+        entries = self._entries()
+        pending: deque = deque()
+        inflight = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ctx-read") as pool:
+            def fill():
+                nonlocal inflight
+                while inflight < self.max_inflight_bytes and len(pending) < self.workers * 64:
+                    item = next(entries, None)
+                    if item is None:
+                        return
+                    rel_path, abs_path, st = item
+                    future = None
+                    if stat.S_ISREG(st.st_mode) and st.st_size <= self.small_file_limit:
+                        future = pool.submit(_read_small, abs_path, st.st_size)
+                        inflight += st.st_size
+                    pending.append((rel_path, abs_path, st, future))
+
+            fill()
+            while pending:
+                rel_path, abs_path, st, future = pending.popleft()
+                header = self._header(rel_path, abs_path, st)
+                stats["bytes"] += len(header)
+                yield header
+                if not stat.S_ISREG(st.st_mode):
+                    stats["dirs" if stat.S_ISDIR(st.st_mode) else "files"] += 1
+                    fill()
+                    continue
+
+                if future is not None:
+                    data = future.result()
+                    inflight -= st.st_size
+                    yield data
+                else:
+                    yield from self._stream_large(abs_path, st.st_size)
+                pad = _padding(st.st_size)
+                if pad:
+                    yield pad
+                stats["files"] += 1
+                stats["content_bytes"] += st.st_size
+                stats["bytes"] += st.st_size + len(pad)
+                fill()
+
+        # tar 结束标记：两个全零块
+        yield b"\0" * (BLOCK_SIZE * 2)
+        stats["bytes"] += BLOCK_SIZE * 2
+        stats["seconds"] = round(time.monotonic() - started, 3)
+
+    def _stream_large(self, path: str, size: int):
+        """大文件在发送线程中分块读取并逐块产出"""
+        remaining = size
+        with open(path, "rb") as f:
+            while remaining > 0:
+                block = f.read(min(CHUNK_SIZE, remaining))
+                if not block:
+                    # 文件在 stat 之后变短，补零到声明的大小
+                    block = b"\0" * min(CHUNK_SIZE, remaining)
+                remaining -= len(block)
+                yield block
@@ -1,26 +1,41 @@
-import docker
 import subprocess
 import os
 import re
-import tempfile
-from ..core.config import LOG_DIR, TASK_LOG_SENTINEL
-from ..database.database import SessionLocal
+from ..core.config import LOG_DIR, CONTEXT_CACHE_DIR
+from ..database.database import SessionLocal, engine
 from ..database import crud
+from .log_sink import TaskLogSink
+from .log_search import LogSearchIndexer
+from .build_steps import BuildStepRecorder
+from .registry_client import RegistryClient
+from .build_context import compute_build_fingerprint, ContextStatCache
+from .context_packer import ContextPacker
+from .build_cache import BuildCachePlan
+from .docker_session import get_docker_client, ensure_login, forget_login
+from .builder_pool import BuilderSpec, ensure_builder, DEFAULT_BUILDER
+from .platform_builds import PlatformBuild, parse_platform_builders, run_platform_builds, merge_manifests
 
 def decrypt(token: str) -> str:
     return token # Encryption removed
 
-import hashlib
+def log_cache_hits(log, step_recorder: BuildStepRecorder):
+    cached, total = step_recorder.cache_summary()
+    if total:
+        log(f"--- 📊 缓存命中率: {cached}/{total} 个构建步骤 ({cached * 100 / total:.0f}%) ---")
 
-def run_docker_task(task_id: str, project_data: dict, tag_input: str, cred_data: dict | None, proxy_data: dict | None):
+def run_docker_task(task_id: str, project_data: dict, tag_input: str, cred_data: dict | None, proxy_data: dict | None, force: bool = False):
+    # 任务进程由调度器 fork 而来，丢弃继承自父进程的数据库连接池，避免与父进程共用 SQLite 连接
+    engine.dispose(close=False)
     # temp_builder_name 不再代表临时的，而是代表针对特定仓库的专用 Builder
     target_builder_name = None
-    temp_config_path = None
+    login_reused, c_reg_host = False, None
+    cache_plans = []
     log_file_path = LOG_DIR / f"{task_id}.log"
-    
-    def log(message: str):
-        with open(log_file_path, "a", encoding="utf-8") as f:
-            f.write(message.strip() + "\n")
+    # 整个任务复用同一个缓冲写入器，避免每行日志都 open/append/close 一次
+    log_sink = TaskLogSink(log_file_path, indexer=LogSearchIndexer.for_log_file(task_id, log_file_path))
+    log = log_sink.write
+    # 从构建/推送输出中解析每个步骤的耗时，任务结束时写入 task_build_steps
+    step_recorder = BuildStepRecorder()
 
     tags = [t.strip() for t in re.split(r'[,，|]', tag_input) if t.strip()]
     if not tags: tags = ["latest"]
@@ -32,11 +47,56 @@ def run_docker_task(task_id: str, project_data: dict, tag_input: str, cred_data:
     use_buildx = len(platforms) > 1
 
     final_status = "FAILED"
+    fingerprint, image_digest = None, None
+    # 构建上下文的 stat/哈希缓存，只用于计算构建输入指纹 (skip_unchanged)
+    stat_cache = ContextStatCache(CONTEXT_CACHE_DIR / f"{p['id']}.json")
+    # 与专用 builder 一致：HTTP 或私有地址的仓库按不安全仓库处理，不校验证书；Docker Hub 和其它仓库始终校验
+    builder_spec = BuilderSpec.for_registry(p['registry_url'])
+    registry_client = RegistryClient(
+        p['registry_url'],
+        username=cred_data['username'] if cred_data else None,
+        password=decrypt(cred_data['encrypted_password']) if cred_data else None,
+        verify=not (builder_spec and builder_spec.is_http),
+    )
     try:
         log(f"✅ 任务进程已启动... (模式: {'Buildx' if use_buildx else '标准'})")
         log(f"目标平台: {', '.join(platforms)}")
-        
-        client = docker.from_env()
+
+        # 0. 未变化检测 (项目可选)：构建输入与上次成功构建完全相同，且仓库中的标签仍指向当时的镜像时直接跳过
+        if p.get('skip_unchanged'):
+            try:
+                fingerprint = compute_build_fingerprint(p, platforms, proxy_data, stat_cache)
+                log(f"--- 🔍 构建输入指纹: {fingerprint} ---")
+            except Exception as e:
+                log(f"⚠️ 计算构建输入指纹失败，将正常构建: {e}")
+
+        if fingerprint and force:
+            log("--- ⚡ 已指定强制构建，忽略未变化检测 ---")
+        elif fingerprint:
+            db = SessionLocal()
+            try:
+                previous = crud.get_last_build_with_fingerprint(db, p['id'], fingerprint, exclude_task_id=task_id)
+            finally:
+                db.close()
+            if previous:
+                try:
+                    remote = {tag: registry_client.head_digest(p['repo_image_name'], tag) for tag in tags}
+                except Exception as e:
+                    remote = {}
+                    log(f"⚠️ 查询仓库中的镜像 digest 失败，将正常构建: {e}")
+                if remote and all(d == previous.image_digest for d in remote.values()):
+                    final_status = "SKIPPED"
+                    image_digest = previous.image_digest
+                    log(f"--- ⏭️ 构建输入未变化 (与任务 {previous.id} 相同)，仓库中的标签仍指向 {image_digest}，跳过构建 ---")
+                    return
+                if remote:
+                    changed = [tag for tag, d in remote.items() if d != previous.image_digest]
+                    log(f"--- 🔄 构建输入未变化，但仓库中的标签 {', '.join(changed)} 已不是上次推送的镜像，重新构建 ---")
+            else:
+                log("--- 🔄 未找到相同构建输入的成功记录，开始构建 ---")
+
+        # 进程内共用的客户端，API 版本沿用调度器进程探测的结果
+        client = get_docker_client()
         
         # --- 核心改进：更健壮地解析 Registry Host ---
         from urllib.parse import urlparse
@@ -63,17 +123,10 @@ def run_docker_task(task_id: str, project_data: dict, tag_input: str, cred_data:
             c_reg_host = urlparse(c_reg_raw).netloc
             if c_reg_host in ["docker.io", "index.docker.io", "registry-1.docker.io", ""]:
                 c_reg_host = "" # Docker CLI 登录 Docker Hub 最好传空或不传地址
-            
-            log(f"--- 正在登录到 {c_reg_host if c_reg_host else 'Docker Hub'} ---")
+
+            # 同一凭据在有效期内登录过时直接复用 docker 配置中的凭据
             pwd = decrypt(cred_data['encrypted_password'])
-            # 同时执行 SDK 登录和命令行登录
-            client.login(username=cred_data['username'], password=pwd, registry=cred_data['registry_url'])
-            
-            login_cmd = ["docker", "login", "-u", cred_data['username'], "--password-stdin"]
-            if c_reg_host: login_cmd.append(c_reg_host)
-            
-            subprocess.run(login_cmd, input=pwd, text=True, capture_output=True, check=True)
-            log("--- 登录成功 ---")
+            login_reused = not ensure_login(client, cred_data, pwd, c_reg_host, log)
 
         # 2. 准备 Dockerfile 和 代理
         effective_dockerfile = p['dockerfile_path']
@@ -117,127 +170,147 @@ RUN if [ -d /etc/apt/apt.conf.d ]; then echo "Acquire::http::Proxy \\"$HTTP_PROX
         if use_buildx:
             log("\n--- 开始 Buildx 多架构构建与推送 ---")
             
-            # 智能配置 Builder (支持持久化复用)
-            try:
-                # 仅针对非 Docker Hub 且需要特殊配置的仓库
-                if not is_dockerhub:
-                    # 智能判断: 如果显式 http:// 开头，或者看起来像私有IP/带端口，则启用 http
-                    is_private_ip = any(reg_host.startswith(prefix) for prefix in ["192.168.", "10.", "172."])
-                    has_port = ":" in reg_host
-                    is_http = reg_url_raw.startswith("http://") or is_private_ip or has_port
-                    
-                    # 生成唯一且稳定的 Builder 名称 (基于仓库地址)
-                    host_hash = hashlib.md5(reg_host.encode()).hexdigest()[:6]
-                    safe_host_name = re.sub(r'[^a-zA-Z0-9]', '-', reg_host)
-                    target_builder_name = f"builder-priv-{safe_host_name}-{host_hash}"
-
-                    # 检查该 Builder 是否已存在
-                    check_cmd = ["docker", "buildx", "inspect", target_builder_name]
-                    builder_exists = subprocess.run(check_cmd, capture_output=True).returncode == 0
-                    
-                    if builder_exists:
-                        log(f"--- ♻️ 复用已有专用构建环境: {target_builder_name} ---")
-                    else:
-                        # 不存在则创建
-                        fd, temp_config_path = tempfile.mkstemp(suffix=".toml")
-                        config_content = f"""[registry."{reg_host}"]
-  http = {str(is_http).lower()}
-  insecure = true
-"""
-                        with os.fdopen(fd, 'w') as f:
-                            f.write(config_content)
-                        
-                        log(f"--- 🛠️ 初始化专用构建环境 (信任: {reg_host}, HTTP: {is_http}) ---")
-                        
-                        create_cmd = [
-                            "docker", "buildx", "create",
-                            "--name", target_builder_name,
-                            "--driver", "docker-container",
-                            "--driver-opt", "network=host",
-                            "--config", temp_config_path,
-                            "--bootstrap"
-                        ]
-                        
-                        try:
-                            subprocess.run(create_cmd, check=True, capture_output=True, text=True)
-                            log(f"--- ✅ 专用环境创建成功: {target_builder_name} ---")
-                        except subprocess.CalledProcessError as e:
-                            log(f"⚠️ 创建专用 Builder 失败 (Exit {e.returncode}):\\nSTDOUT: {e.stdout}\\nSTDERR: {e.stderr}")
-                            raise Exception(f"无法创建支持 HTTP/Insecure 的构建环境: {e.stderr}")
-                        
+            # 私有仓库使用专用 Builder (通常已由 builder 池预先创建并启动)
+            builder_spec = None if is_dockerhub else BuilderSpec.for_registry(reg_url_raw)
+            if builder_spec:
+                target_builder_name = builder_spec.name
+                try:
+                    action = ensure_builder(builder_spec, log)
+                except Exception as e:
+                    log(f"⚠️ 环境配置严重错误: {e}")
+                    raise e
+                if action == "reused":
+                    log(f"--- ♻️ 复用已有专用构建环境: {target_builder_name} ---")
                 else:
-                    target_builder_name = None
-                
-            except Exception as e:
-                log(f"⚠️ 环境配置严重错误: {e}")
-                raise e
+                    log(f"--- ✅ 专用环境已就绪: {target_builder_name} ---")
 
-            builder_to_use = target_builder_name if target_builder_name else "web-pusher-builder"
+            builder_to_use = target_builder_name if target_builder_name else DEFAULT_BUILDER
             
-            # 构造完整的镜像标签引用，用于缓存源
-            primary_tag = tags[0]
-            cache_from_image = f"{repo_base}:{primary_tag}"
+            # 缓存后端与缓存来源 (上次成功构建的标签作为额外的缓存来源)
+            db = SessionLocal()
+            try:
+                current_task = crud.get_task_log(db, task_id)
+                previous = crud.get_previous_successful_task(db, current_task) if current_task else None
+            finally:
+                db.close()
+            previous_tag = None
+            if previous:
+                previous_tags = [t.strip() for t in re.split(r'[,，|]', previous.tag) if t.strip()]
+                previous_tag = previous_tags[0] if previous_tags else None
 
-            buildx_cmd = [
-                "docker", "buildx", "build",
-                "--builder", builder_to_use,
-                "--platform", ",".join(platforms),
-                "--file", os.path.join(p['build_context'], effective_dockerfile),
-                p['build_context'],
-                "--push"
-            ]
-            
-            # --- 缓存策略优化 ---
-            buildx_cmd.append("--cache-to=type=inline")
-            
-            if p.get('no_cache'):
-                buildx_cmd.append("--no-cache")
-                log("--- ⚡ 强制无缓存构建 (已禁用读取旧缓存) ---")
-            else:
-                buildx_cmd.append(f"--cache-from=type=registry,ref={cache_from_image}")
-                log(f"--- ♻️ 尝试复用远程缓存: {cache_from_image} ---")
+            def make_buildx_cmd(platform_list: list[str], builder: str, cache_plan: BuildCachePlan) -> list[str]:
+                cmd = [
+                    "docker", "buildx", "build",
+                    "--builder", builder,
+                    "--platform", ",".join(platform_list),
+                    "--file", os.path.join(p['build_context'], effective_dockerfile),
+                    p['build_context'],
+                    # 固定为 plain 输出，便于解析每个步骤的耗时
+                    "--progress=plain"
+                ]
+                # --- 缓存策略 ---
+                cmd.extend(cache_plan.args())
+                if p.get('no_cache'):
+                    cmd.append("--no-cache")
+                # 添加 Build Args
+                for k, v in build_args.items():
+                    cmd.extend(["--build-arg", f"{k}={v}"])
+                return cmd
 
-            # 添加所有 Tag
-            for tag in tags:
-                buildx_cmd.extend(["-t", f"{repo_base}:{tag}"])
-            # 添加 Build Args
-            for k, v in build_args.items():
-                buildx_cmd.extend(["--build-arg", f"{k}={v}"])
+            if p.get('split_platforms'):
+                # 每个平台单独、并发地构建并按 digest 推送，最后用 imagetools 合并为多架构清单
+                platform_builders = parse_platform_builders(p.get('platform_builders'))
+                builds = []
+                for plat in platforms:
+                    cache_plan = BuildCachePlan(p, repo_base, tags, previous_tag, platform=plat, task_id=task_id)
+                    cache_plans.append(cache_plan)
+                    builder = platform_builders.get(plat, builder_to_use)
+                    log(f"--- 🧩 [{plat}] 使用构建器: {builder} ---")
+                    for line in cache_plan.describe():
+                        log(f"--- ♻️ [{plat}] {line} ---")
+                    cmd = make_buildx_cmd([plat], builder, cache_plan)
+                    cmd += ["--output", f"type=image,name={repo_base},push-by-digest=true,name-canonical=true,push=true"]
+                    builds.append(PlatformBuild(plat, cmd))
+                try:
+                    digests = run_platform_builds(builds, log, step_recorder)
+                finally:
+                    log_cache_hits(log, step_recorder)
+                merge_manifests(builder_to_use, repo_base, tags, digests, log)
+            else:
+                cache_plan = BuildCachePlan(p, repo_base, tags, previous_tag, task_id=task_id)
+                cache_plans.append(cache_plan)
+                for line in cache_plan.describe():
+                    log(f"--- ♻️ {line} ---")
+                buildx_cmd = make_buildx_cmd(platforms, builder_to_use, cache_plan) + ["--push"]
+                # 添加所有 Tag
+                for tag in tags:
+                    buildx_cmd.extend(["-t", f"{repo_base}:{tag}"])
 
-            # 执行并实时抓取日志
-            process = subprocess.Popen(buildx_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=os.environ)
-            for line in process.stdout:
-                log(line)
-            process.wait()
-            if process.returncode != 0:
-                raise Exception(f"Buildx 构建失败，退出码: {process.returncode}")
+                # 执行并实时抓取日志
+                process = subprocess.Popen(buildx_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=os.environ)
+                for line in process.stdout:
+                    log(line)
+                    step_recorder.feed_buildx_line(line)
+                process.wait()
+                log_cache_hits(log, step_recorder)
+                if process.returncode != 0:
+                    raise Exception(f"Buildx 构建失败，退出码: {process.returncode}")
 
         else:
             # 标准模式 (用于单平台构建，最稳定)
             primary_full_image = f"{repo_base}:{tags[0]}"
             log(f"\n--- 开始标准构建: {primary_full_image} ---")
+            # 自行流式打包构建上下文 (并行读文件)，代替 docker-py 先在内存/临时文件中打完整 tar
+            packer = ContextPacker(p['build_context'], effective_dockerfile)
             streamer = client.api.build(
-                path=p['build_context'], dockerfile=effective_dockerfile, 
+                fileobj=packer.stream(), custom_context=True, dockerfile=effective_dockerfile,
                 tag=primary_full_image, nocache=p.get('no_cache', False), 
                 rm=True, decode=True, buildargs=build_args
             )
+            stats = packer.stats
+            log(f"--- 📦 构建上下文: {stats['files']} 个文件, {stats['bytes'] / 1024 / 1024:.1f} MB, "
+                f"打包发送耗时 {stats['seconds']:.2f}s ---")
             for chunk in streamer:
                 if 'stream' in chunk: log(chunk['stream'])
+                step_recorder.feed_classic_chunk(chunk)
+            step_recorder.finish_classic_build()
+            log_cache_hits(log, step_recorder)
             
             image = client.images.get(primary_full_image)
-            # 打其余标签并推送
-            for i, tag in enumerate(tags):
-                full_name = f"{repo_base}:{tag}"
-                if i > 0: image.tag(repository=repo_base, tag=tag)
-                log(f"--- 正在推送: {full_name} ---")
+
+            def push_tag(tag: str):
+                log(f"--- 正在推送: {repo_base}:{tag} ---")
                 # SDK 推送自带鉴权，对 Docker Hub 最友好
                 for chunk in client.images.push(repository=repo_base, tag=tag, stream=True, decode=True):
                     if 'error' in chunk: raise Exception(chunk['error'])
+                    step_recorder.feed_push_chunk(tag, chunk)
                     if 'status' in chunk: log(f"{chunk['status']} {chunk.get('progress', '')}")
 
+            # 只完整推送第一个标签，其余标签通过 Registry API 直接复用同一份清单
+            push_tag(tags[0])
+            extra_tags = tags[1:]
+            if extra_tags:
+                try:
+                    for tag, digest in registry_client.retag(p['repo_image_name'], tags[0], extra_tags):
+                        log(f"--- 🏷️ 远程打标签: {repo_base}:{tag} -> {digest} ---")
+                        extra_tags = extra_tags[1:]
+                except Exception as e:
+                    log(f"⚠️ 远程打标签失败，改为逐个推送: {e}")
+                # 远程打标签失败的标签退回到本地打标签 + 推送
+                for tag in extra_tags:
+                    image.tag(repository=repo_base, tag=tag)
+                    push_tag(tag)
+
         final_status = "SUCCESS"
         log("\n--- ✅ 任务成功完成! ---")
 
+        # 记录推送后的镜像 digest，供下次未变化检测比对
+        if fingerprint:
+            try:
+                image_digest = registry_client.head_digest(p['repo_image_name'], tags[0])
+            except Exception as e:
+                log(f"⚠️ 查询已推送镜像的 digest 失败，下次将无法跳过构建: {e}")
+
         # 4. 清理
         if p.get('auto_cleanup', True) and not use_buildx:
             log("\n--- 🧹 正在清理本地镜像... ---")
@@ -247,6 +320,9 @@ RUN if [ -d /etc/apt/apt.conf.d ]; then echo "Acquire::http::Proxy \\"$HTTP_PROX
         
     except Exception as e:
         log(f"\n--- ❌ 发生严重错误 ---\n{e}")
+        # 复用缓存登录的任务失败时不确定凭据是否仍有效，下次重新登录
+        if login_reused:
+            forget_login(c_reg_host, cred_data['username'])
     finally:
         # 清理临时 Dockerfile
         try:
@@ -257,15 +333,30 @@ RUN if [ -d /etc/apt/apt.conf.d ]; then echo "Acquire::http::Proxy \\"$HTTP_PROX
                 # log("--- 🗑️ 已清理临时 Dockerfile ---")
         except: pass
 
-        # 注意：不再清理 target_builder_name，实现持久化复用
-        # 仅清理配置文件（因为它已经被 buildx 加载到内部容器了，本地文件可以删）
-        if temp_config_path and os.path.exists(temp_config_path):
-             try: os.remove(temp_config_path)
-             except: pass
+        for cache_plan in cache_plans:
+            try:
+                cache_plan.finish(final_status == "SUCCESS")
+            except Exception as e:
+                log(f"⚠️ 更新本地构建缓存目录失败: {e}")
+
+        try:
+            # 未计算指纹时缓存没有被使用，保存会清空上次的记录
+            if fingerprint:
+                stat_cache.save()
+        except Exception as e:
+            print(f"保存构建上下文缓存失败 ({task_id}): {e}")
 
-        log(TASK_LOG_SENTINEL)
+        # 先落盘全部缓冲日志再写结束标记，读取端看到标记时日志一定是完整的
+        log_sink.finish()
         db = SessionLocal()
         try:
+            try:
+                crud.create_build_steps(db, task_id, step_recorder.results())
+            except Exception as e:
+                db.rollback()
+                print(f"保存构建步骤耗时失败 ({task_id}): {e}")
+            if fingerprint and final_status in ("SUCCESS", "SKIPPED"):
+                crud.set_task_build_result(db, task_id, fingerprint, image_digest)
             crud.update_task_status(db, task_id=task_id, new_status=final_status)
         finally:
             db.close()
\ No newline at end of file
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+import docker
+
+from ..core.config import LOGIN_CACHE_PATH, LOGIN_CACHE_TTL
+
+# 每个进程一个 Docker 客户端 (自带连接池)。构建任务在 fork 出的子进程中执行，
+# 子进程不能复用父进程的连接，按 pid 区分；但父进程探测到的 API 版本会随 fork 继承，
+# 子进程创建客户端时直接指定版本，省去一次 /version 请求。
+_client: docker.DockerClient | None = None
+_client_pid: int | None = None
+_api_version: str | None = None
+_lock = threading.Lock()
+
+def get_docker_client() -> docker.DockerClient:
+    global _client, _client_pid, _api_version
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = docker.from_env(version=_api_version) if _api_version else docker.from_env()
+            _client_pid = os.getpid()
+            _api_version = _client.api.api_version
+        return _client
+
+def warm_up():
+    """在调度器进程中预先创建客户端并确定 API 版本，失败时忽略 (任务中会再次尝试)"""
+    try:
+        get_docker_client()
+    except Exception as e:
+        print(f"预热 Docker 客户端失败: {e}")
+
+# --- 登录缓存 ---
+# 记录 (仓库地址, 用户名) 最近一次成功登录的时间。命中缓存时 docker CLI 的配置文件中已有凭据，
+# 任务直接复用，不再执行 SDK 登录和 docker login 子进程。
+# 缓存文件由多个任务进程共享，写入时整体替换；偶发的并发覆盖只会导致多登录一次。
+
+def _password_hash(password: str) -> str:
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def _load_cache() -> dict:
+    try:
+        with open(LOGIN_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_cache(entries: dict):
+    tmp_path = LOGIN_CACHE_PATH.with_name(f"{LOGIN_CACHE_PATH.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f)
+    os.replace(tmp_path, LOGIN_CACHE_PATH)
+
+def _cache_key(host: str, username: str) -> str:
+    return f"{host or 'docker.io'}|{username}"
+
+def _has_stored_auth(host: str) -> bool:
+    """docker CLI 配置中是否仍保存着该仓库的凭据 (可能已被手动 docker logout)"""
+    try:
+        config = docker.auth.load_config()
+        return docker.auth.resolve_authconfig(config, host or None) is not None
+    except Exception:
+        return False
+
+def forget_login(host: str, username: str):
+    entries = _load_cache()
+    if entries.pop(_cache_key(host, username), None) is not None:
+        _save_cache(entries)
+
+def invalidate_logins(credential_id: str):
+    """凭据被修改或删除时清除它的登录缓存"""
+    entries = _load_cache()
+    remaining = {k: v for k, v in entries.items() if v.get("credential_id") != credential_id}
+    if len(remaining) != len(entries):
+        try:
+            _save_cache(remaining)
+        except OSError as e:
+            print(f"清除登录缓存失败 ({credential_id}): {e}")
+
+def ensure_login(client: docker.DockerClient, cred_data: dict, password: str, host: str, log) -> bool:
+    """
+    登录到仓库 (host 为空表示 Docker Hub)。缓存有效时跳过登录，返回是否实际执行了登录。
+    """
+    key = _cache_key(host, cred_data['username'])
+    entry = _load_cache().get(key)
+    if (entry and entry.get("expires", 0) > time.time()
+            and entry.get("password_hash") == _password_hash(password)
+            and _has_stored_auth(host)):
+        # 客户端可能在凭据写入配置文件之前创建，重新读取一次
+        client.api.reload_config()
+        log(f"--- ♻️ 复用 {int(entry['expires'] - time.time())}s 内有效的登录: {host or 'Docker Hub'} ---")
+        return False
+
+    log(f"--- 正在登录到 {host if host else 'Docker Hub'} ---")
+    # 同时执行 SDK 登录和命令行登录
+    client.login(username=cred_data['username'], password=password, registry=cred_data['registry_url'])
+    login_cmd = ["docker", "login", "-u", cred_data['username'], "--password-stdin"]
+    if host: login_cmd.append(host)
+    subprocess.run(login_cmd, input=password, text=True, capture_output=True, check=True)
+    log("--- 登录成功 ---")
+
+    entries = _load_cache()
+    entries[key] = {
+        "credential_id": cred_data.get('id'),
+        "password_hash": _password_hash(password),
+        "expires": time.time() + LOGIN_CACHE_TTL,
+    }
+    try:
+        _save_cache(entries)
+    except OSError as e:
+        log(f"⚠️ 保存登录缓存失败: {e}")
+    return True
@@ -0,0 +1,115 @@
+import os
+import re
+from typing import Iterable, Iterator
+
+from .build_context import translate_glob
+
+# 备份等功能使用的 .gitignore 语义的路径匹配：
+# - 不含 / 的规则匹配任意层级的文件名，含 / (或以 / 开头) 的规则相对根目录锚定；
+# - 以 / 结尾的规则只匹配目录，** 可以跨越多层目录；
+# - 以 ! 开头的规则重新包含之前被排除的路径，最后一条命中的规则生效；
+#   与 git 一样，父目录被排除后其中的文件无法再被重新包含 (遍历时整个目录被跳过)。
+# 规则只在构造时编译一次：按顺序把同为排除或同为例外的相邻规则合并成一组，
+# 组内的纯文件名 (node_modules) 和纯扩展名 (*.pyc) 规则用集合/后缀查找，其余规则合并成一个正则。
+
+_GLOB_CHARS = re.compile(r"[*?\[\\]")
+
+class _Matchers:
+    """一组规则编译后的匹配结构"""
+
+    def __init__(self):
+        self.names: set[str] = set()
+        self.suffixes: list[str] = []
+        self.regexes: list[str] = []
+        self.regex: re.Pattern | None = None
+
+    def add(self, body: str, anchored: bool):
+        if not anchored and not _GLOB_CHARS.search(body):
+            self.names.add(body)
+        elif not anchored and body.startswith("*") and not _GLOB_CHARS.search(body[1:]):
+            self.suffixes.append(body[1:])
+        elif anchored:
+            self.regexes.append(translate_glob(body))
+        else:
+            self.regexes.append("(?:.*/)?" + translate_glob(body))
+
+    def compile(self):
+        self.suffixes = tuple(self.suffixes)
+        if self.regexes:
+            self.regex = re.compile("(?:" + "|".join(self.regexes) + ")$")
+
+    def hit(self, rel_path: str, name: str) -> bool:
+        return (name in self.names
+                or name.endswith(self.suffixes)
+                or (self.regex is not None and self.regex.match(rel_path) is not None))
+
+class _RuleGroup:
+    def __init__(self, negate: bool):
+        self.negate = negate
+        self.files = _Matchers()
+        # 目录额外匹配以 / 结尾的规则
+        self.dirs = _Matchers()
+
+class IgnoreMatcher:
+    def __init__(self, patterns: Iterable[str]):
+        self.groups: list[_RuleGroup] = []
+        for raw in patterns:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            line = line.lstrip("/")
+            if not line:
+                continue
+            if not self.groups or self.groups[-1].negate != negate:
+                self.groups.append(_RuleGroup(negate))
+            group = self.groups[-1]
+            group.dirs.add(line, anchored)
+            if not dir_only:
+                group.files.add(line, anchored)
+        for group in self.groups:
+            group.files.compile()
+            group.dirs.compile()
+
+    def is_ignored(self, rel_path: str, is_dir: bool = False) -> bool:
+        """rel_path 为相对根目录、以 / 分隔的路径；只判断路径本身，不检查父目录"""
+        name = rel_path.rsplit("/", 1)[-1]
+        for group in reversed(self.groups):
+            if (group.dirs if is_dir else group.files).hit(rel_path, name):
+                return not group.negate
+        return False
+
+def walk_entries(root: str, matcher: IgnoreMatcher) -> Iterator[tuple[str, os.DirEntry]]:
+    """
+    用 os.scandir 遍历 root，产出未被忽略的文件 (相对路径, DirEntry)，相对路径以 / 分隔。
+    被忽略的目录整体跳过；与 os.walk 一样不进入指向目录的符号链接，无法读取的目录直接跳过。
+    """
+    stack = [("", root)]
+    while stack:
+        prefix, path = stack.pop()
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            rel_path = prefix + entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink() and not matcher.is_ignored(rel_path, is_dir=True):
+                    stack.append((rel_path + "/", entry.path))
+            elif not matcher.is_ignored(rel_path):
+                yield rel_path, entry
+
+def walk_files(root: str, matcher: IgnoreMatcher) -> Iterator[str]:
+    """只产出未被忽略的文件的相对路径"""
+    for rel_path, _ in walk_entries(root, matcher):
+        yield rel_path
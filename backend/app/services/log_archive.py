@@ -0,0 +1,202 @@
+import json
+import os
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from pathlib import Path
+from typing import Callable, Iterator
+
+from ..core.config import LOG_DIR, TASK_LOG_SENTINEL, LOG_ARCHIVE_DELAY, LOG_ARCHIVE_INTERVAL, LOG_ARCHIVE_BLOCK_SIZE
+
+# 归档格式：
+#   {task_id}.log.gz  由多个独立的 gzip member 拼接而成 (整体仍可用 gzip -dc 解压)，每个 member 是一段完整的行
+#   {task_id}.log.idx 块索引 (JSON)，每块记录 [压缩偏移, 压缩长度, 首行行号, 行数, 原始偏移, 原始长度]
+ARCHIVE_SUFFIX = ".log.gz"
+INDEX_SUFFIX = ".log.idx"
+INDEX_VERSION = 1
+
+def archive_paths(task_id: str) -> tuple[Path, Path]:
+    return LOG_DIR / f"{task_id}{ARCHIVE_SUFFIX}", LOG_DIR / f"{task_id}{INDEX_SUFFIX}"
+
+def has_sentinel(log_path: Path) -> bool:
+    """只读取文件末尾判断任务日志是否已写完"""
+    with open(log_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 256))
+        return TASK_LOG_SENTINEL.encode() in f.read()
+
+def _iter_line_chunks(f, block_size: int) -> Iterator[bytes]:
+    """按行边界切分，每块约 block_size 字节"""
+    pending = b""
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        data = pending + data
+        cut = data.rfind(b"\n") + 1
+        if not cut:
+            pending = data
+            continue
+        pending = data[cut:]
+        yield data[:cut]
+    if pending:
+        yield pending
+
+def archive_task_log(log_path: Path, block_size: int = LOG_ARCHIVE_BLOCK_SIZE) -> bool:
+    """把已完成的纯文本日志压缩为可随机访问的块归档，成功后删除原文件"""
+    if not log_path.exists() or not has_sentinel(log_path):
+        return False
+
+    task_id = log_path.name[:-len(".log")]
+    data_path, index_path = archive_paths(task_id)
+    tmp_data = data_path.with_name(data_path.name + ".tmp")
+    tmp_index = index_path.with_name(index_path.name + ".tmp")
+
+    blocks = []
+    comp_offset = raw_offset = line_no = 0
+    try:
+        with open(log_path, "rb") as src, open(tmp_data, "wb") as dst:
+            for chunk in _iter_line_chunks(src, block_size):
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                member = compressor.compress(chunk) + compressor.flush()
+                dst.write(member)
+                line_count = chunk.count(b"\n") + (0 if chunk.endswith(b"\n") else 1)
+                blocks.append([comp_offset, len(member), line_no, line_count, raw_offset, len(chunk)])
+                comp_offset += len(member)
+                raw_offset += len(chunk)
+                line_no += line_count
+
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "size": raw_offset, "lines": line_no, "blocks": blocks}, f, separators=(",", ":"))
+
+        # 先让归档完整可用，再删除原文件；读取端总是优先使用纯文本文件
+        os.replace(tmp_data, data_path)
+        os.replace(tmp_index, index_path)
+        log_path.unlink()
+        return True
+    finally:
+        for tmp in (tmp_data, tmp_index):
+            if tmp.exists():
+                tmp.unlink()
+
+def _split_lines(data: bytes) -> list[bytes]:
+    """只按 \n 切分并保留行尾；与块索引和纯文本日志的行号一致 (bytes.splitlines 还会在 \r 等字符处切分)"""
+    lines = data.split(b"\n")
+    last = lines.pop()
+    lines = [line + b"\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+class ArchivedLog:
+    """已归档日志的只读视图，按需解压覆盖请求区间的块"""
+
+    def __init__(self, data_path: Path, index_path: Path):
+        self.path = data_path
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        self.size: int = index["size"]
+        self.lines: int = index["lines"]
+        self.blocks: list[list[int]] = index["blocks"]
+        self._first_lines = [b[2] for b in self.blocks]
+        self._raw_offsets = [b[4] for b in self.blocks]
+
+    def _iter_blocks(self, start_block: int) -> Iterator[tuple[list[int], bytes]]:
+        with open(self.path, "rb") as f:
+            for block in self.blocks[start_block:]:
+                f.seek(block[0])
+                yield block, zlib.decompress(f.read(block[1]), 16 + zlib.MAX_WBITS)
+
+    def iter_bytes(self, start: int = 0, end: int | None = None) -> Iterator[bytes]:
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        first = max(0, bisect_right(self._raw_offsets, start) - 1)
+        for block, data in self._iter_blocks(first):
+            raw_offset = block[4]
+            if raw_offset >= end:
+                break
+            yield data[max(0, start - raw_offset):end - raw_offset]
+
+    def iter_lines(self, offset: int = 0, limit: int | None = None) -> Iterator[bytes]:
+        if offset >= self.lines or limit == 0:
+            return
+        first = max(0, bisect_right(self._first_lines, offset) - 1)
+        remaining = limit
+        for block, data in self._iter_blocks(first):
+            lines = _split_lines(data)[max(0, offset - block[2]):]
+            if remaining is not None:
+                lines = lines[:remaining]
+                remaining -= len(lines)
+            yield from lines
+            if remaining is not None and remaining <= 0:
+                break
+
+    def iter_tail(self, lines: int) -> Iterator[bytes]:
+        return self.iter_lines(max(0, self.lines - lines))
+
+    def iter_line_blocks(self) -> Iterator[list[str]]:
+        """逐块产出解码后的行，用于实时日志接口回放已归档任务"""
+        for _, data in self._iter_blocks(0):
+            yield [line.decode("utf-8", errors="replace").rstrip("\n") for line in _split_lines(data)]
+
+def open_archived_log(task_id: str) -> ArchivedLog | None:
+    data_path, index_path = archive_paths(task_id)
+    if data_path.exists() and index_path.exists():
+        return ArchivedLog(data_path, index_path)
+    return None
+
+def delete_archived_log(task_id: str):
+    for path in archive_paths(task_id):
+        if path.exists():
+            path.unlink()
+
+class LogArchiver:
+    """后台线程：定期把已结束一段时间的任务日志压缩归档"""
+
+    def __init__(self, delay: int = LOG_ARCHIVE_DELAY, interval: int = LOG_ARCHIVE_INTERVAL):
+        self.delay = delay
+        self.interval = interval
+        self._in_use: Callable[[str], bool] | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, in_use: Callable[[str], bool] | None = None):
+        """in_use(task_id) 返回 True 时跳过该日志 (例如仍有客户端在实时查看)"""
+        self._in_use = in_use
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="log-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def run_once(self) -> int:
+        archived = 0
+        cutoff = time.time() - self.delay
+        for log_path in LOG_DIR.glob("*.log"):
+            if self._stop.is_set():
+                break
+            task_id = log_path.name[:-len(".log")]
+            try:
+                if log_path.stat().st_mtime > cutoff:
+                    continue
+                if self._in_use and self._in_use(task_id):
+                    continue
+                if archive_task_log(log_path):
+                    archived += 1
+            except Exception as e:
+                print(f"归档日志 {log_path.name} 失败: {e}")
+        return archived
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+log_archiver = LogArchiver()
@@ -0,0 +1,193 @@
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator
+
+from ..core.config import LOG_DIR, TASK_LOG_SENTINEL, LOG_STREAM_QUEUE_SIZE
+from .log_archive import open_archived_log
+from ..core import metrics
+
+try:
+    # uvicorn[standard] 自带 watchfiles (基于 inotify)，没有时退化为轮询
+    from watchfiles import awatch
+except ImportError:
+    awatch = None
+
+READ_CHUNK_SIZE = 64 * 1024
+POLL_INTERVAL = 0.1
+
+def read_lines_range(path: Path, start: int, end: int) -> list[str]:
+    """读取日志文件 [start, end) 字节区间内的完整行"""
+    if end <= start:
+        return []
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return data.decode("utf-8", errors="replace").splitlines()
+
+class LogSubscriber:
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        # 已交付给该订阅者的字节偏移
+        self.offset = 0
+        # 为 True 时表示队列里缺了数据，需要从文件补读到广播器当前偏移。新订阅者从 0 开始补读历史
+        self.lagged = True
+
+class TaskLogBroadcaster:
+    """
+    单个任务的日志广播器：只有它一个读取者在追踪日志文件，新内容推送给所有订阅者。
+    没有订阅者或读到结束标记后自动退出，空闲任务不占用任何资源。
+    """
+
+    def __init__(self, hub: "LogBroadcastHub", task_id: str):
+        self.hub = hub
+        self.task_id = task_id
+        self.path = LOG_DIR / f"{task_id}.log"
+        self.offset = 0
+        self.done = False
+        self.subscribers: set[LogSubscriber] = set()
+        self._stop = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def add_subscriber(self) -> LogSubscriber:
+        sub = LogSubscriber(LOG_STREAM_QUEUE_SIZE)
+        self.subscribers.add(sub)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return sub
+
+    def remove_subscriber(self, sub: LogSubscriber):
+        self.subscribers.discard(sub)
+        if not self.subscribers:
+            self._stop.set()
+            self.hub._forget(self)
+
+    def _publish(self, lines: list[str]):
+        for sub in self.subscribers:
+            if sub.lagged:
+                continue
+            try:
+                sub.queue.put_nowait((lines, self.offset))
+            except asyncio.QueueFull:
+                # 慢消费者：不再为它积压，等它自己从文件补读
+                sub.lagged = True
+
+    def _wake_subscribers(self):
+        for sub in self.subscribers:
+            try:
+                sub.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    async def _run(self):
+        watcher = None
+        if awatch is not None:
+            watcher = awatch(self.path, watch_filter=None, debounce=50, step=10,
+                             stop_event=self._stop, rust_timeout=1000, yield_on_timeout=True)
+        pending = b""
+        try:
+            with open(self.path, "rb") as f:
+                while not self._stop.is_set():
+                    chunk = f.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        if watcher is not None:
+                            try:
+                                await watcher.__anext__()
+                            except StopAsyncIteration:
+                                break
+                        else:
+                            await asyncio.sleep(POLL_INTERVAL)
+                        continue
+
+                    data = pending + chunk
+                    cut = data.rfind(b"\n") + 1
+                    pending = data[cut:]
+                    if not cut:
+                        continue
+                    self.offset += cut
+                    lines = data[:cut].decode("utf-8", errors="replace").splitlines()
+                    self._publish(lines)
+                    if any(TASK_LOG_SENTINEL in line for line in lines):
+                        break
+        except Exception as e:
+            print(f"日志广播器 {self.task_id} 出错: {e}")
+        finally:
+            self.done = True
+            self._wake_subscribers()
+            if watcher is not None:
+                self._stop.set()
+                await watcher.aclose()
+            self.hub._forget(self)
+
+class LogBroadcastHub:
+    """按 task_id 维护广播器，多个客户端查看同一任务时共享同一个文件读取者"""
+
+    def __init__(self):
+        self._broadcasters: dict[str, TaskLogBroadcaster] = {}
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(b.subscribers) for b in self._broadcasters.values())
+
+    def is_streaming(self, task_id: str) -> bool:
+        return task_id in self._broadcasters
+
+    def _forget(self, broadcaster: TaskLogBroadcaster):
+        if self._broadcasters.get(broadcaster.task_id) is broadcaster:
+            del self._broadcasters[broadcaster.task_id]
+
+    async def stream(self, task_id: str) -> AsyncIterator[str]:
+        """逐行产出任务日志 (先历史后实时)，遇到 TASK_LOG_SENTINEL 时结束"""
+        if not (LOG_DIR / f"{task_id}.log").exists():
+            # 已归档的日志不会再增长，直接逐块解压回放
+            archive = open_archived_log(task_id)
+            if archive is not None:
+                blocks = archive.iter_line_blocks()
+                while (lines := await asyncio.to_thread(next, blocks, None)) is not None:
+                    for line in lines:
+                        if TASK_LOG_SENTINEL in line:
+                            return
+                        yield line
+                return
+
+        broadcaster = self._broadcasters.get(task_id)
+        if broadcaster is None or broadcaster.done:
+            broadcaster = TaskLogBroadcaster(self, task_id)
+            self._broadcasters[task_id] = broadcaster
+        sub = broadcaster.add_subscriber()
+        try:
+            while True:
+                if sub.lagged:
+                    # 在事件循环内同步地确定补读终点并恢复接收，之后的新数据都会进入队列
+                    end = broadcaster.offset
+                    sub.lagged = False
+                    lines = await asyncio.to_thread(read_lines_range, broadcaster.path, sub.offset, end)
+                    sub.offset = end
+                    for line in lines:
+                        if TASK_LOG_SENTINEL in line:
+                            return
+                        yield line
+                    continue
+
+                if broadcaster.done and sub.queue.empty():
+                    if sub.offset >= broadcaster.offset:
+                        return
+                    sub.lagged = True
+                    continue
+
+                item = await sub.queue.get()
+                if item is None:
+                    continue
+                lines, end = item
+                if end <= sub.offset:
+                    # 这部分已经在补读时交付过了
+                    continue
+                sub.offset = end
+                for line in lines:
+                    if TASK_LOG_SENTINEL in line:
+                        return
+                    yield line
+        finally:
+            broadcaster.remove_subscriber(sub)
+
+log_hub = LogBroadcastHub()
+metrics.LOG_WEBSOCKETS_OPEN.set_function(lambda: log_hub.subscriber_count)
@@ -0,0 +1,125 @@
+import os
+import re
+import zlib
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from ..core.config import LOG_DIR
+from .log_archive import ArchivedLog, open_archived_log
+
+READ_BLOCK_SIZE = 64 * 1024
+
+def iter_byte_range(path: Path, start: int = 0, end: int | None = None) -> Iterator[bytes]:
+    """按块读取 [start, end) 字节区间，end 为 None 时读到文件末尾"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            size = READ_BLOCK_SIZE if remaining is None else min(READ_BLOCK_SIZE, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+def iter_line_range(path: Path, offset: int = 0, limit: int | None = None) -> Iterator[bytes]:
+    """跳过前 offset 行后最多产出 limit 行 (按块读取，不会把整个文件载入内存)"""
+    skipped = 0
+    emitted = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if skipped < offset:
+                skipped += 1
+                continue
+            if limit is not None and emitted >= limit:
+                break
+            emitted += 1
+            yield line
+
+def tail_offset(path: Path, lines: int) -> int:
+    """从文件末尾向前按块查找，返回最后 `lines` 行的起始字节偏移"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        if pos == 0 or lines <= 0:
+            return pos
+        # 末尾换行符属于最后一行，不计入
+        f.seek(pos - 1)
+        if f.read(1) == b"\n":
+            pos -= 1
+        found = 0
+        while pos > 0:
+            step = min(READ_BLOCK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            block = f.read(step)
+            idx = len(block)
+            while True:
+                idx = block.rfind(b"\n", 0, idx)
+                if idx < 0:
+                    break
+                found += 1
+                if found == lines:
+                    return pos + idx + 1
+        return 0
+
+class PlainLog:
+    """尚未归档的纯文本日志，与 ArchivedLog 提供相同的读取接口"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.size = path.stat().st_size
+
+    def iter_bytes(self, start: int = 0, end: int | None = None) -> Iterator[bytes]:
+        return iter_byte_range(self.path, start, end)
+
+    def iter_lines(self, offset: int = 0, limit: int | None = None) -> Iterator[bytes]:
+        return iter_line_range(self.path, offset, limit)
+
+    def iter_tail(self, lines: int) -> Iterator[bytes]:
+        return iter_byte_range(self.path, tail_offset(self.path, lines))
+
+def open_task_log(task_id: str) -> PlainLog | ArchivedLog | None:
+    """优先返回纯文本日志 (任务可能仍在写入)，否则返回压缩归档，都不存在时返回 None"""
+    log_file = LOG_DIR / f"{task_id}.log"
+    if log_file.exists():
+        return PlainLog(log_file)
+    return open_archived_log(task_id)
+
+def task_log_exists(task_id: str) -> bool:
+    return open_task_log(task_id) is not None
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """边读边压缩，输出标准 gzip 流"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def parse_range_header(header: str, size: int) -> tuple[int, int] | None:
+    """
+    解析单段 HTTP Range 头，返回 [start, end) 区间。
+    不支持的格式 (如多段) 返回 None 表示忽略 Range；区间不可满足时抛出 ValueError。
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N 表示最后 N 个字节
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError("unsatisfiable range")
+        return max(0, size - suffix), size
+    start = int(first)
+    end = size if not last else min(int(last) + 1, size)
+    if start >= size or start >= end:
+        raise ValueError("unsatisfiable range")
+    return start, end
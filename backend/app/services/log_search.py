@@ -0,0 +1,214 @@
+import time
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..database.database import SessionLocal
+from ..database import models
+
+# FTS 行的 rowid 高位是任务序号，低 24 位是行号：按任务删除时只需一次 rowid 区间删除
+LINE_BITS = 24
+MAX_LINE_NO = (1 << LINE_BITS) - 1
+
+def _rowid_range(seq: int) -> tuple[int, int]:
+    return seq << LINE_BITS, (seq << LINE_BITS) | MAX_LINE_NO
+
+def _get_or_create_doc(db: Session, task_id: str) -> models.TaskLogSearchDoc:
+    doc = db.query(models.TaskLogSearchDoc).filter(models.TaskLogSearchDoc.task_id == task_id).first()
+    if not doc:
+        doc = models.TaskLogSearchDoc(task_id=task_id, indexed_lines=0)
+        db.add(doc)
+        db.commit()
+        db.refresh(doc)
+    return doc
+
+def _insert_lines(db: Session, doc: models.TaskLogSearchDoc, start_line: int, lines: list[str]):
+    base = doc.seq << LINE_BITS
+    rows = [
+        {"rowid": base | line_no, "line": line}
+        for line_no, line in enumerate(lines, start=start_line)
+        if line.strip() and line_no <= MAX_LINE_NO
+    ]
+    if rows:
+        db.execute(text("INSERT OR REPLACE INTO task_log_fts(rowid, line) VALUES (:rowid, :line)"), rows)
+    doc.indexed_lines = start_line + len(lines)
+    db.commit()
+
+class LogSearchIndexer:
+    """
+    在任务进程中随日志写入增量更新全文索引。
+    按行数或时间攒批提交，减少与其它进程争用 SQLite 写锁；索引失败不影响构建本身。
+    """
+
+    def __init__(self, task_id: str, start_line: int = 0, batch_lines: int = 1000, batch_interval: float = 1.0):
+        self.task_id = task_id
+        self.next_line = start_line
+        self.batch_lines = batch_lines
+        self.batch_interval = batch_interval
+        self._pending: list[str] = []
+        self._last_commit = time.monotonic()
+        self._enabled = True
+
+    @classmethod
+    def for_log_file(cls, task_id: str, log_path: Path, **kwargs) -> "LogSearchIndexer":
+        """日志文件里可能已有调度器写入的排队信息，行号从现有行数之后开始"""
+        start_line = 0
+        if log_path.exists():
+            with open(log_path, "rb") as f:
+                start_line = sum(1 for _ in f)
+        return cls(task_id, start_line=start_line, **kwargs)
+
+    def add(self, lines: list[str]):
+        if not self._enabled:
+            return
+        self._pending.extend(lines)
+        if len(self._pending) >= self.batch_lines or time.monotonic() - self._last_commit >= self.batch_interval:
+            self.flush()
+
+    def flush(self):
+        if not self._enabled or not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        db = SessionLocal()
+        try:
+            doc = _get_or_create_doc(db, self.task_id)
+            _insert_lines(db, doc, self.next_line, lines)
+            self.next_line += len(lines)
+        except Exception as e:
+            # 索引只是辅助功能，出错后停止索引该任务，但不能影响构建
+            print(f"写入日志全文索引失败 ({self.task_id}): {e}")
+            self._enabled = False
+        finally:
+            db.close()
+        self._last_commit = time.monotonic()
+
+def index_task_log(db: Session, task_id: str, batch_lines: int = 5000) -> int:
+    """为已有的日志文件 (纯文本或归档) 建立索引，用于补建历史任务的索引"""
+    from .log_reader import open_task_log
+
+    log = open_task_log(task_id)
+    if log is None:
+        return 0
+    delete_task_index(db, task_id)
+    doc = _get_or_create_doc(db, task_id)
+    line_no = 0
+    batch: list[str] = []
+    for raw in log.iter_lines():
+        batch.append(raw.decode("utf-8", errors="replace").rstrip("\n"))
+        if len(batch) >= batch_lines:
+            _insert_lines(db, doc, line_no, batch)
+            line_no += len(batch)
+            batch = []
+    _insert_lines(db, doc, line_no, batch)
+    return line_no + len(batch)
+
+def backfill_search_index():
+    """为已结束但尚未建立索引的任务补建索引 (启动时在后台线程执行)"""
+    db = SessionLocal()
+    try:
+        pending = db.query(models.TaskLog.id).filter(
+            models.TaskLog.status.notin_(["QUEUED", "PENDING"]),
+            ~models.TaskLog.id.in_(db.query(models.TaskLogSearchDoc.task_id)),
+        ).all()
+        for (task_id,) in pending:
+            try:
+                index_task_log(db, task_id)
+            except Exception as e:
+                db.rollback()
+                print(f"补建日志索引失败 ({task_id}): {e}")
+    finally:
+        db.close()
+
+def delete_task_index(db: Session, task_id: str):
+    doc = db.query(models.TaskLogSearchDoc).filter(models.TaskLogSearchDoc.task_id == task_id).first()
+    if not doc:
+        return
+    low, high = _rowid_range(doc.seq)
+    db.execute(text("DELETE FROM task_log_fts WHERE rowid BETWEEN :low AND :high"), {"low": low, "high": high})
+    db.delete(doc)
+    db.commit()
+
+def delete_all_task_indexes(db: Session):
+    db.execute(text("DELETE FROM task_log_fts"))
+    db.query(models.TaskLogSearchDoc).delete()
+    db.commit()
+
+def _phrase_query(query: str) -> str:
+    """把用户输入当作短语检索，避免 FTS5 语法字符导致查询报错"""
+    return '"' + query.replace('"', '""') + '"'
+
+def search_task_logs(
+    db: Session,
+    query: str,
+    project_id: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = 20,
+    matches_per_task: int = 3,
+    scan_limit: int = 20000,
+) -> list[dict]:
+    """
+    全文检索任务日志，按任务聚合后以 bm25 相关度排序 (同分时新任务在前)。
+    极其常见的词可能命中几十万行，此时只在最新的 scan_limit 条命中行里计算相关度，保证查询耗时有上限。
+    """
+    filters = []
+    params: dict = {"query": _phrase_query(query), "limit": limit, "scan_limit": scan_limit}
+    if project_id:
+        filters.append("t.project_id = :project_id")
+        params["project_id"] = project_id
+    if since:
+        filters.append("t.created_at >= :since")
+        params["since"] = since.strftime("%Y-%m-%d %H:%M:%S")
+    if until:
+        filters.append("t.created_at < :until")
+        params["until"] = until.strftime("%Y-%m-%d %H:%M:%S")
+
+    scope = ""
+    if filters:
+        scope = f"""AND (rowid >> {LINE_BITS}) IN (
+                SELECT d.seq FROM task_log_search_docs d JOIN task_logs t ON t.id = d.task_id
+                WHERE {" AND ".join(filters)})"""
+
+    # 1. 找出最相关的任务
+    ranked = db.execute(text(f"""
+        SELECT h.seq, MIN(h.score) AS score, COUNT(*) AS hits,
+               d.task_id, t.project_id, p.name AS project_name, t.tag, t.status, t.created_at
+        FROM (
+            SELECT rowid >> {LINE_BITS} AS seq, bm25(task_log_fts) AS score
+            FROM task_log_fts
+            WHERE task_log_fts MATCH :query {scope}
+            ORDER BY rowid DESC LIMIT :scan_limit
+        ) h
+        JOIN task_log_search_docs d ON d.seq = h.seq
+        JOIN task_logs t ON t.id = d.task_id
+        JOIN projects p ON p.id = t.project_id
+        GROUP BY h.seq
+        ORDER BY score, h.seq DESC
+        LIMIT :limit
+    """), params).mappings().all()
+
+    # 2. 每个任务取前几条命中行的片段 (rowid 区间查询，只扫描该任务自己的命中行)
+    snippet_sql = text(f"""
+        SELECT rowid & {MAX_LINE_NO} AS line_no, snippet(task_log_fts, 0, '«', '»', '…', 24) AS snippet
+        FROM task_log_fts
+        WHERE task_log_fts MATCH :query AND rowid BETWEEN :low AND :high
+        ORDER BY rowid LIMIT :n
+    """)
+    results = []
+    for row in ranked:
+        low, high = _rowid_range(row["seq"])
+        matches = db.execute(snippet_sql, {"query": params["query"], "low": low, "high": high, "n": matches_per_task}).mappings().all()
+        results.append({
+            "task_id": row["task_id"],
+            "project_id": row["project_id"],
+            "project_name": row["project_name"],
+            "tag": row["tag"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            # bm25 越小越相关，这里取反便于理解 (越大越相关)
+            "score": -row["score"],
+            "hits": row["hits"],
+            "matches": [dict(m) for m in matches],
+        })
+    return results
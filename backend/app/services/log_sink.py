@@ -0,0 +1,87 @@
+import threading
+from pathlib import Path
+
+from ..core.config import LOG_FLUSH_INTERVAL, LOG_FLUSH_BYTES, TASK_LOG_SENTINEL
+from .log_search import LogSearchIndexer
+
+class TaskLogSink:
+    """
+    任务日志写入器：整个任务期间只保持一个文件句柄，按行缓冲后批量写入。
+    - 缓冲超过 flush_bytes 时立即落盘；
+    - 后台线程每 flush_interval 秒落盘一次，保证读取端看到新行的延迟有上限；
+    - finish() 会先落盘所有内容再写入 TASK_LOG_SENTINEL；
+    - 传入 indexer 时，落盘的行同时写入全文索引。
+    """
+
+    def __init__(self, path: Path, flush_interval: float = LOG_FLUSH_INTERVAL, flush_bytes: int = LOG_FLUSH_BYTES,
+                 indexer: LogSearchIndexer | None = None):
+        self.path = path
+        self.indexer = indexer
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self._file = open(path, "a", encoding="utf-8")
+        self._buffer: list[str] = []
+        self._buffered_bytes = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name=f"log-sink-{path.stem}", daemon=True)
+        self._flusher.start()
+
+    def write(self, message: str):
+        line = message.strip() + "\n"
+        with self._lock:
+            if self._closed:
+                return
+            self._buffer.append(line)
+            self._buffered_bytes += len(line)
+            if self._buffered_bytes >= self.flush_bytes:
+                self._flush_locked()
+
+    __call__ = write
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def finish(self):
+        """落盘全部缓冲内容后写入结束标记并关闭文件"""
+        self.flush()
+        self.write(TASK_LOG_SENTINEL)
+        self.close()
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=self.flush_interval * 2 + 1)
+        with self._lock:
+            if self._closed:
+                return
+            self._flush_locked()
+            self._file.close()
+            self._closed = True
+            if self.indexer:
+                self.indexer.flush()
+
+    def _flush_locked(self):
+        if not self._buffer or self._file.closed:
+            return
+        chunk = "".join(self._buffer)
+        self._file.write(chunk)
+        self._file.flush()
+        if self.indexer:
+            # 单条消息内部可能含换行，按文件中的实际行切分以保证行号一致
+            self.indexer.add(chunk.split("\n")[:-1])
+        self._buffer.clear()
+        self._buffered_bytes = 0
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            with self._lock:
+                self._flush_locked()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
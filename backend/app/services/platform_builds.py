@@ -0,0 +1,98 @@
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from typing import Callable
+
+from .build_steps import BuildStepRecorder
+
+def parse_platform_builders(text: str | None) -> dict[str, str]:
+    """解析 "linux/arm64=arm-builder, linux/amd64=amd-builder" 形式的平台 -> builder 映射"""
+    result = {}
+    for entry in re.split(r"[,，\n]", text or ""):
+        platform, sep, builder = entry.partition("=")
+        if sep and platform.strip() and builder.strip():
+            result[platform.strip()] = builder.strip()
+    return result
+
+class PlatformBuild:
+    """单个平台的一次 buildx 构建：按 digest 推送，不打标签"""
+
+    def __init__(self, platform: str, cmd: list[str]):
+        self.platform = platform
+        self.cmd = cmd
+        fd, self.metadata_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.cmd += ["--metadata-file", self.metadata_path]
+        self.process: subprocess.Popen | None = None
+        self.returncode: int | None = None
+        self.digest: str | None = None
+
+    def run(self, log: Callable[[str], None], step_recorder: BuildStepRecorder, abort: threading.Event):
+        prefix = f"[{self.platform}] "
+        try:
+            self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=os.environ)
+            # 启动前其他平台已失败时不再构建
+            if abort.is_set():
+                self.process.terminate()
+            for line in self.process.stdout:
+                log(prefix + line)
+                step_recorder.feed_buildx_line(line, scope=self.platform)
+            self.returncode = self.process.wait()
+            if self.returncode == 0:
+                with open(self.metadata_path, "r", encoding="utf-8") as f:
+                    self.digest = json.load(f).get("containerimage.digest")
+        except Exception as e:
+            log(f"{prefix}⚠️ 构建进程出错: {e}")
+            self.returncode = self.returncode or -1
+        finally:
+            if self.returncode != 0 or not self.digest:
+                abort.set()
+            try:
+                os.remove(self.metadata_path)
+            except OSError:
+                pass
+
+    def terminate(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+
+def run_platform_builds(builds: list[PlatformBuild], log: Callable[[str], None], step_recorder: BuildStepRecorder) -> dict[str, str]:
+    """
+    并发执行各平台的构建，日志按平台加前缀区分。
+    任一平台失败时终止其余平台 (最终镜像已无法合并)，返回 平台 -> 镜像 digest。
+    """
+    abort = threading.Event()
+    threads = [threading.Thread(target=b.run, args=(log, step_recorder, abort), name=f"buildx-{b.platform}", daemon=True) for b in builds]
+    for t in threads:
+        t.start()
+    abort_handled = False
+    while any(t.is_alive() for t in threads):
+        if abort.wait(0.5) and not abort_handled:
+            abort_handled = True
+            if any(b.process and b.process.poll() is None for b in builds):
+                log("--- ⛔ 有平台构建失败，终止其余平台的构建 ---")
+            for b in builds:
+                b.terminate()
+    for t in threads:
+        t.join()
+
+    failed = [b.platform for b in builds if b.returncode != 0 or not b.digest]
+    if failed:
+        raise Exception(f"按平台构建失败: {', '.join(failed)}")
+    return {b.platform: b.digest for b in builds}
+
+def merge_manifests(builder: str, repo_base: str, tags: list[str], digests: dict[str, str], log: Callable[[str], None]):
+    """用 imagetools create 把各平台的镜像合并为多架构清单，并一次打上全部标签"""
+    cmd = ["docker", "buildx", "imagetools", "create", "--builder", builder]
+    for tag in tags:
+        cmd.extend(["-t", f"{repo_base}:{tag}"])
+    cmd.extend(f"{repo_base}@{digest}" for digest in digests.values())
+    log(f"--- 🔗 合并多架构清单: {', '.join(f'{p}={d[:19]}' for p, d in digests.items())} ---")
+    result = subprocess.run(cmd, capture_output=True, text=True, env=os.environ)
+    for line in (result.stdout + result.stderr).splitlines():
+        log(line)
+    if result.returncode != 0:
+        raise Exception(f"imagetools create 失败，退出码: {result.returncode}")
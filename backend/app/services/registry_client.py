@@ -0,0 +1,131 @@
+import hashlib
+import re
+import requests
+from urllib.parse import urlparse
+
+DOCKER_HUB_HOSTS = ["docker.io", "index.docker.io", "registry-1.docker.io", ""]
+DOCKER_HUB_API = "https://registry-1.docker.io"
+
+# 同时接受单平台清单和多平台索引，保证取回的就是推送时的原始清单
+MANIFEST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+
+class RegistryError(Exception):
+    pass
+
+def parse_challenge(header: str) -> tuple[str, dict]:
+    """解析 WWW-Authenticate: Bearer realm="...",service="...",scope="..." """
+    scheme, _, params = header.partition(" ")
+    return scheme.lower(), dict(re.findall(r'(\w+)="([^"]*)"', params))
+
+class RegistryClient:
+    """
+    极简的 Registry HTTP API v2 客户端，只实现远程打标签和未变化检测需要的清单查询与读写。
+    鉴权按服务端的 401 质询处理：Bearer 时用凭据换取 token (按 scope 缓存)，Basic 时直接带凭据。
+    默认校验 TLS 证书；只有已按不安全仓库处理的 HTTP/私有地址仓库才传 verify=False。
+    """
+
+    def __init__(self, registry_url: str, username: str | None = None, password: str | None = None,
+                 verify: bool = True, timeout: float = 30):
+        if not (registry_url.startswith("http://") or registry_url.startswith("https://")):
+            registry_url = "https://" + registry_url
+        parsed = urlparse(registry_url)
+        self.is_dockerhub = parsed.netloc in DOCKER_HUB_HOSTS
+        self.base_url = DOCKER_HUB_API if self.is_dockerhub else f"{parsed.scheme}://{parsed.netloc}"
+        self.auth = (username, password) if username else None
+        self.verify = verify
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._tokens: dict[str, str] = {}
+        self._basic = False
+
+    def repository(self, image_name: str) -> str:
+        """Docker Hub 官方镜像省略了 library/ 前缀"""
+        if self.is_dockerhub and "/" not in image_name:
+            return f"library/{image_name}"
+        return image_name
+
+    def _authorize(self, challenge: str, scope: str):
+        scheme, params = parse_challenge(challenge)
+        if scheme == "basic":
+            if not self.auth:
+                raise RegistryError("仓库要求登录，但未配置凭据")
+            self._basic = True
+            return
+        if scheme != "bearer" or "realm" not in params:
+            raise RegistryError(f"不支持的鉴权方式: {challenge}")
+        query = {"scope": scope}
+        if params.get("service"):
+            query["service"] = params["service"]
+        resp = self.session.get(params["realm"], params=query, auth=self.auth, verify=self.verify, timeout=self.timeout)
+        if resp.status_code != 200:
+            raise RegistryError(f"获取访问令牌失败: HTTP {resp.status_code}")
+        data = resp.json()
+        token = data.get("token") or data.get("access_token")
+        if not token:
+            raise RegistryError("令牌服务未返回 token")
+        self._tokens[scope] = token
+
+    def _request(self, method: str, repo: str, path: str, **kwargs) -> requests.Response:
+        scope = f"repository:{repo}:pull,push"
+        url = f"{self.base_url}/v2/{repo}/{path}"
+        headers = kwargs.pop("headers", {})
+        for attempt in range(2):
+            auth = None
+            if scope in self._tokens:
+                headers["Authorization"] = f"Bearer {self._tokens[scope]}"
+            elif self._basic:
+                auth = self.auth
+            resp = self.session.request(method, url, headers=headers, auth=auth, verify=self.verify, timeout=self.timeout, **kwargs)
+            if resp.status_code != 401 or attempt == 1:
+                return resp
+            # token 过期或首次访问：按质询重新鉴权后重试一次
+            self._tokens.pop(scope, None)
+            self._authorize(resp.headers.get("WWW-Authenticate", ""), scope)
+        return resp
+
+    def get_manifest(self, repo: str, reference: str) -> tuple[bytes, str, str]:
+        """返回 (清单原始字节, Content-Type, digest)"""
+        resp = self._request("GET", repo, f"manifests/{reference}", headers={"Accept": ", ".join(MANIFEST_MEDIA_TYPES)})
+        if resp.status_code != 200:
+            raise RegistryError(f"读取清单 {repo}:{reference} 失败: HTTP {resp.status_code} {resp.text[:200]}")
+        body = resp.content
+        digest = resp.headers.get("Docker-Content-Digest") or "sha256:" + hashlib.sha256(body).hexdigest()
+        return body, resp.headers.get("Content-Type", MANIFEST_MEDIA_TYPES[0]), digest
+
+    def head_digest(self, image_name: str, reference: str) -> str | None:
+        """查询标签当前指向的清单 digest，标签不存在时返回 None"""
+        repo = self.repository(image_name)
+        resp = self._request("HEAD", repo, f"manifests/{reference}", headers={"Accept": ", ".join(MANIFEST_MEDIA_TYPES)})
+        if resp.status_code == 404:
+            return None
+        if resp.status_code != 200:
+            raise RegistryError(f"查询清单 {repo}:{reference} 失败: HTTP {resp.status_code}")
+        digest = resp.headers.get("Docker-Content-Digest")
+        if not digest:
+            # 个别仓库的 HEAD 不返回 digest，退回到 GET 自行计算
+            digest = self.get_manifest(repo, reference)[2]
+        return digest
+
+    def put_manifest(self, repo: str, reference: str, body: bytes, media_type: str) -> str:
+        resp = self._request("PUT", repo, f"manifests/{reference}", data=body, headers={"Content-Type": media_type})
+        if resp.status_code not in (200, 201):
+            raise RegistryError(f"写入清单 {repo}:{reference} 失败: HTTP {resp.status_code} {resp.text[:200]}")
+        return resp.headers.get("Docker-Content-Digest") or "sha256:" + hashlib.sha256(body).hexdigest()
+
+    def retag(self, image_name: str, source_tag: str, target_tags: list[str]):
+        """
+        把 source_tag 指向的清单原样 PUT 到其它标签，层数据已在仓库中，无需再次上传。
+        逐个生成 (标签, digest)，便于调用方记录日志。
+        """
+        repo = self.repository(image_name)
+        body, media_type, digest = self.get_manifest(repo, source_tag)
+        for tag in target_tags:
+            new_digest = self.put_manifest(repo, tag, body, media_type)
+            if new_digest != digest:
+                raise RegistryError(f"标签 {tag} 的 digest 不一致: {new_digest} != {digest}")
+            yield tag, digest
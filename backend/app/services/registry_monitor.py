@@ -0,0 +1,181 @@
+import asyncio
+import math
+import threading
+import time
+
+from ..core import metrics
+from ..core.config import (
+    REGISTRY_MONITOR_INTERVAL, REGISTRY_FAILURE_THRESHOLD, REGISTRY_HEALTH_RETENTION,
+)
+from ..database.database import SessionLocal
+from ..database import crud
+from .registry_probe import test_registry
+
+# 单个仓库一次探测的总时限 (秒)，包含协议回退探测和凭据验证
+PROBE_DEADLINE = 20
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """最近秩法计算分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize_samples(samples: list) -> dict:
+    """把一段时间内的探测记录汇总为可用率和延迟分位数"""
+    latencies = [s.latency_ms for s in samples if s.available and s.latency_ms is not None]
+    auth_latencies = [s.auth_latency_ms for s in samples if s.available and s.auth_latency_ms is not None]
+    ok = sum(1 for s in samples if s.available)
+    return {
+        "samples": len(samples),
+        "availability": round(ok / len(samples), 4) if samples else None,
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p95_ms": percentile(latencies, 95),
+        "auth_latency_p50_ms": percentile(auth_latencies, 50),
+        "auth_latency_p95_ms": percentile(auth_latencies, 95),
+    }
+
+class RegistryMonitor:
+    """
+    后台 asyncio 任务：每 interval 秒并发探测所有已配置的仓库，记录往返延迟、凭据验证延迟和可用性。
+    - 探测记录写入 registry_health_samples 表，超过保留期的记录在每轮结束时清理；
+    - 最新状态保存在内存中，连续失败达到 failure_threshold 次的仓库视为不可用，
+      调度线程通过 is_failing() 查询并推迟推送到该仓库的任务；一次探测成功即恢复。
+    """
+
+    def __init__(self, interval: int = REGISTRY_MONITOR_INTERVAL, failure_threshold: int = REGISTRY_FAILURE_THRESHOLD):
+        self.interval = interval
+        self.failure_threshold = max(1, failure_threshold)
+        self.last_run: float | None = None
+        # registry_id -> {"name", "available", "consecutive_failures", "latency_ms", "auth_latency_ms", "error", "checked_at"}
+        self._state: dict[str, dict] = {}
+        # 调度线程和请求处理线程都会读取状态
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="registry-monitor")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def request_probe(self):
+        """仓库新增/修改/删除后立即探测一次；可以在请求处理线程中调用"""
+        if self._loop and self._wakeup and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def is_failing(self, registry_id: str) -> bool:
+        with self._lock:
+            state = self._state.get(registry_id)
+            return bool(state) and state["consecutive_failures"] >= self.failure_threshold
+
+    def get_state(self, registry_id: str) -> dict | None:
+        with self._lock:
+            state = self._state.get(registry_id)
+            return dict(state, failing=state["consecutive_failures"] >= self.failure_threshold) if state else None
+
+    async def _probe(self, registry: dict) -> dict:
+        checked_at = time.time()
+        username, password = registry["credential"] or (None, None)
+        try:
+            result = await asyncio.wait_for(
+                test_registry(registry["url"], registry["is_https"], username, password),
+                timeout=PROBE_DEADLINE,
+            )
+        except asyncio.TimeoutError:
+            result = {"available": False, "latency_ms": None, "auth_latency_ms": None, "message": f"探测超时 ({PROBE_DEADLINE}s)"}
+        except Exception as e:
+            result = {"available": False, "latency_ms": None, "auth_latency_ms": None, "message": str(e)}
+        if registry["credential_id"] and not registry["credential"]:
+            result = {**result, "available": False, "message": "关联的凭据不存在"}
+        return {
+            "registry_id": registry["id"],
+            "checked_at": checked_at,
+            "available": result["available"],
+            "latency_ms": result["latency_ms"],
+            "auth_latency_ms": result["auth_latency_ms"],
+            "error": None if result["available"] else result["message"][:500],
+        }
+
+    def _load(self) -> list[dict]:
+        """读取所有仓库及其凭据，返回普通字典 (在线程中执行，不阻塞事件循环)"""
+        db = SessionLocal()
+        try:
+            registries = []
+            for r in crud.get_registries(db):
+                cred = crud.get_credential(db, r.credential_id) if r.credential_id else None
+                registries.append({"id": r.id, "name": r.name, "url": r.url, "is_https": r.is_https,
+                                   "credential_id": r.credential_id,
+                                   "credential": (cred.username, cred.encrypted_password) if cred else None})
+            return registries
+        finally:
+            db.close()
+
+    async def run_once(self):
+        registries = await asyncio.to_thread(self._load)
+        samples = await asyncio.gather(*(self._probe(r) for r in registries))
+        names = {r["id"]: r["name"] for r in registries}
+        with self._lock:
+            for sample in samples:
+                previous = self._state.get(sample["registry_id"], {})
+                if previous and previous["name"] != names[sample["registry_id"]]:
+                    metrics.REGISTRY_UP.remove(registry=previous["name"])
+                failures = 0 if sample["available"] else previous.get("consecutive_failures", 0) + 1
+                self._state[sample["registry_id"]] = {
+                    "name": names[sample["registry_id"]],
+                    "available": sample["available"],
+                    "consecutive_failures": failures,
+                    "latency_ms": sample["latency_ms"],
+                    "auth_latency_ms": sample["auth_latency_ms"],
+                    "error": sample["error"],
+                    "checked_at": sample["checked_at"],
+                }
+                if failures == self.failure_threshold:
+                    print(f"仓库 {names[sample['registry_id']]} 连续 {failures} 次探测失败，暂停向其调度任务: {sample['error']}")
+                elif sample["available"] and previous.get("consecutive_failures", 0) >= self.failure_threshold:
+                    print(f"仓库 {names[sample['registry_id']]} 已恢复")
+            for registry_id in [rid for rid in self._state if rid not in names]:
+                metrics.REGISTRY_UP.remove(registry=self._state.pop(registry_id)["name"])
+            self.last_run = time.time()
+
+        for sample in samples:
+            name = names[sample["registry_id"]]
+            metrics.REGISTRY_UP.set(1 if sample["available"] else 0, registry=name)
+            if sample["latency_ms"] is not None:
+                metrics.REGISTRY_PROBE_SECONDS.observe(sample["latency_ms"] / 1000, registry=name)
+        await asyncio.to_thread(self._save, samples, list(names))
+
+    def _save(self, samples: list[dict], registry_ids: list[str]):
+        db = SessionLocal()
+        try:
+            if samples:
+                crud.add_registry_health_samples(db, samples)
+            crud.prune_registry_health_samples(db, time.time() - REGISTRY_HEALTH_RETENTION, registry_ids)
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"仓库健康探测失败: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+registry_monitor = RegistryMonitor()
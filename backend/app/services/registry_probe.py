@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import httpx
+
+from .registry_client import DOCKER_HUB_HOSTS, DOCKER_HUB_API, parse_challenge
+
+# 所有连通性测试共用一个异步 HTTP 客户端 (连接池)，避免每次测试都重新建立 TCP/TLS 连接。
+# 私有仓库多为自签名证书，与原来的 requests 探测一样不校验证书。
+PROBE_TIMEOUT = httpx.Timeout(5.0, connect=3.0)
+_client: httpx.AsyncClient | None = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            verify=False, timeout=PROBE_TIMEOUT, follow_redirects=True,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _client
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _host(url: str) -> str:
+    return url.replace("https://", "").replace("http://", "").split("/")[0].strip()
+
+async def _probe(base_url: str) -> tuple[httpx.Response | None, float, str | None]:
+    """GET {base_url}/v2/，返回 (响应, 耗时毫秒, 错误)"""
+    started = time.monotonic()
+    try:
+        resp = await get_http_client().get(f"{base_url}/v2/")
+        return resp, (time.monotonic() - started) * 1000, None
+    except httpx.HTTPError as e:
+        return None, (time.monotonic() - started) * 1000, str(e) or type(e).__name__
+
+def _reachable(resp: httpx.Response | None) -> bool:
+    # 200 或 401 都说明协议是通的
+    return resp is not None and resp.status_code in (200, 401)
+
+async def _verify_credentials(base_url: str, challenge: httpx.Response, username: str, password: str) -> tuple[bool, str]:
+    """
+    按 /v2/ 返回的鉴权质询验证凭据，代替完整的 docker login：
+    Bearer 时向令牌服务申请 token，Basic 时带凭据重新请求 /v2/。
+    """
+    client = get_http_client()
+    scheme, params = parse_challenge(challenge.headers.get("WWW-Authenticate", ""))
+    if scheme == "bearer" and params.get("realm"):
+        query = {"service": params["service"]} if params.get("service") else {}
+        resp = await client.get(params["realm"], params=query, auth=(username, password))
+        if resp.status_code == 200:
+            return True, "✅ 登录成功: 协议和凭据均已验证"
+        if resp.status_code in (401, 403):
+            return False, "认证失败: 用户名或密码错误"
+        return False, f"令牌服务返回异常状态码: {resp.status_code}"
+    if scheme == "basic":
+        resp = await client.get(f"{base_url}/v2/", auth=(username, password))
+        if resp.status_code == 200:
+            return True, "✅ 登录成功: 协议和凭据均已验证"
+        if resp.status_code in (401, 403):
+            return False, "认证失败: 用户名或密码错误"
+        return False, f"服务器返回异常状态码: {resp.status_code}"
+    return False, f"不支持的鉴权方式: {challenge.headers.get('WWW-Authenticate', '无')}"
+
+async def test_registry(url: str, is_https: bool, username: str | None = None, password: str | None = None) -> dict:
+    """
+    测试仓库连通性与凭据，返回 {"status", "message", "latency_ms", "auth_latency_ms", "protocol", "available"}。
+    status: success / info / warning / error；用户选择的协议和另一种协议并发探测。
+    available 表示按当前配置能否推送 (所选协议可达且凭据有效)，auth_latency_ms 仅在实际验证了凭据时有值。
+    """
+    host = _host(url)
+    protocol = "https" if is_https else "http"
+    other = "http" if is_https else "https"
+    is_dockerhub = host in DOCKER_HUB_HOSTS
+    base_url = DOCKER_HUB_API if is_dockerhub else f"{protocol}://{host}"
+
+    # 另一种协议的探测同时发出，只有所选协议不通时才需要等待它的结果
+    fallback = None if is_dockerhub else asyncio.create_task(_probe(f"{other}://{host}"))
+    try:
+        resp, latency, error = await _probe(base_url)
+        fallback_ok = False
+        if fallback and not _reachable(resp):
+            fallback_ok = _reachable((await fallback)[0])
+    finally:
+        if fallback and not fallback.done():
+            fallback.cancel()
+    result = {"protocol": protocol, "latency_ms": round(latency, 1), "auth_latency_ms": None, "available": True}
+
+    if not _reachable(resp):
+        result["available"] = False
+        if fallback_ok:
+            only = "HTTP" if other == "http" else "HTTPS"
+            return {**result, "status": "warning", "message": f"❌ 协议不匹配: 该仓库似乎只支持 {only}，请切换设置"}
+        detail = error or f"HTTP {resp.status_code}"
+        return {**result, "status": "error", "message": f"连接失败: 无法通过 {protocol.upper()} 访问该地址 ({detail})"}
+
+    # 登录验证
+    if username:
+        if resp.status_code == 200:
+            return {**result, "status": "success", "message": "✅ 连接成功: 该仓库允许匿名访问，无需验证凭据"}
+        started = time.monotonic()
+        try:
+            ok, message = await _verify_credentials(base_url, resp, username, password or "")
+        except httpx.HTTPError as e:
+            ok, message = False, f"令牌服务请求失败: {e}"
+        result["auth_latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        return {**result, "status": "success" if ok else "error", "message": message, "available": ok}
+
+    # 匿名访问
+    if is_dockerhub:
+        return {**result, "status": "warning", "message": "⚠️ Docker Hub 必须绑定凭据才能执行推送"}
+    if resp.status_code == 200:
+        return {**result, "status": "success", "message": "✅ 连接成功: 该仓库允许匿名访问"}
+    return {**result, "status": "info", "message": "💡 地址有效: 但该仓库需要登录凭据"}
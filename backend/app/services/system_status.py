@@ -0,0 +1,104 @@
+import asyncio
+import json
+import time
+
+from ..core.config import SYSTEM_STATUS_TTL
+from .async_command import run_command
+from .builder_pool import DEFAULT_BUILDER
+
+STATUS_COMMAND_TIMEOUT = 30
+
+async def collect_status() -> dict:
+    try:
+        version_result, ls_result = await asyncio.gather(
+            run_command(["docker", "buildx", "version"], timeout=STATUS_COMMAND_TIMEOUT),
+            run_command(["docker", "buildx", "ls", "--format", "json"], timeout=STATUS_COMMAND_TIMEOUT),
+        )
+        buildx_version, builders_raw = version_result.stdout.strip(), ls_result.stdout.strip()
+        builders = []
+        for line in builders_raw.splitlines():
+            if line.strip():
+                try: builders.append(json.loads(line))
+                except: pass
+        has_multiarch_builder = any(b.get("Name") == DEFAULT_BUILDER for b in builders)
+        platforms = []
+        for b in builders:
+            for node in b.get("Nodes", []):
+                platforms.extend(node.get("Platforms", []))
+        platforms = sorted(list(set(platforms)))
+        return {
+            "buildx_available": True,
+            "buildx_version": buildx_version,
+            "has_multiarch_builder": has_multiarch_builder,
+            "supported_platforms": platforms,
+            "is_ready": has_multiarch_builder and "linux/arm64" in platforms,
+        }
+    except Exception as e:
+        return {"buildx_available": False, "error": str(e), "is_ready": False}
+
+class SystemStatusCache:
+    """
+    系统状态 (buildx 版本、builder 与支持的平台) 保存在内存中，由后台 asyncio 任务每 ttl 秒刷新一次，
+    请求直接返回缓存。并发的刷新请求合并为一次命令调用。
+    """
+
+    def __init__(self, ttl: int = SYSTEM_STATUS_TTL):
+        self.ttl = ttl
+        self._status: dict | None = None
+        self._updated_at: float | None = None
+        self._stale = True
+        self._refreshing: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop(), name="system-status-refresh")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def invalidate(self):
+        """标记缓存过期 (例如 /system/initialize 完成后)，后台任务立即刷新"""
+        self._stale = True
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def refresh(self) -> dict:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._collect())
+        return await asyncio.shield(self._refreshing)
+
+    async def _collect(self) -> dict:
+        self._stale = False
+        status = await collect_status()
+        self._status, self._updated_at = status, time.time()
+        return status
+
+    async def get(self, refresh: bool = False) -> dict:
+        if refresh or self._stale or self._status is None:
+            status = await self.refresh()
+        else:
+            status = self._status
+        return {**status, "updated_at": self._updated_at}
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"刷新系统状态失败: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.ttl)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+system_status = SystemStatusCache()
@@ -0,0 +1,287 @@
+import multiprocessing
+import threading
+import time
+import uuid
+from sqlalchemy.orm import Session
+
+from ..core.config import LOG_DIR, TASK_LOG_SENTINEL, MAX_CONCURRENT_TASKS, MAX_TASKS_PER_REGISTRY, REGISTRY_POSTPONE_ON_FAILURE
+from ..database.database import SessionLocal
+from ..database import crud, models
+from ..core import metrics
+from .docker_runner import run_docker_task
+from .builder_pool import BuilderSpec
+from .docker_session import warm_up
+from .registry_monitor import registry_monitor
+
+# 未绑定仓库的项目默认推送到 Docker Hub，共用同一个并发配额
+DEFAULT_REGISTRY_KEY = "docker.io"
+
+def build_task_args(db: Session, project: models.Project):
+    """把 ORM 对象转换为可跨进程传递的 dict (project, cred, proxy)"""
+    registry, cred, proxy = None, None, None
+    if project.registry_id:
+        registry = crud.get_registry(db, project.registry_id)
+        if registry and registry.credential_id:
+            cred = crud.get_credential(db, registry.credential_id)
+
+    if project.proxy_id:
+        proxy = crud.get_proxy(db, project.proxy_id)
+
+    project_dict = {c.name: getattr(project, c.name) for c in project.__table__.columns}
+    # 构造带协议头的完整 URL
+    if registry:
+        protocol = "https" if registry.is_https else "http"
+        # 清洗可能存在的重复协议头
+        clean_url = registry.url.replace("https://", "").replace("http://", "")
+        full_reg_url = f"{protocol}://{clean_url}"
+    else:
+        full_reg_url = "https://docker.io"
+
+    project_dict['registry_url'] = full_reg_url
+
+    cred_dict = {c.name: getattr(cred, c.name) for c in cred.__table__.columns} if cred else None
+    if cred_dict:
+        cred_dict['registry_url'] = full_reg_url
+
+    proxy_dict = {c.name: getattr(proxy, c.name) for c in proxy.__table__.columns} if proxy else None
+    return project_dict, cred_dict, proxy_dict
+
+def append_task_log(task_id: str, message: str):
+    with open(LOG_DIR / f"{task_id}.log", "a", encoding="utf-8") as f:
+        f.write(message.strip() + "\n")
+
+class TaskScheduler:
+    """
+    基于 task_logs 表的持久化构建队列。
+    - 入队的任务状态为 QUEUED，调度线程按 (优先级, 入队顺序) 取出并启动独立进程执行。
+    - 同时受全局并发上限和单仓库并发上限约束，有空位时自动启动下一个任务。
+    - 队列完全保存在数据库中，服务重启后 QUEUED 任务会继续被调度。
+    - 批量构建中有上游依赖的任务先处于 WAITING，上游全部成功后转为 QUEUED；
+      任一上游失败或取消时，只取消依赖它的下游任务。
+    - 目标仓库被健康监控判定为不可用时，任务留在队列中推迟启动，不占用构建槽位，仓库恢复后自动继续。
+    """
+
+    def __init__(self, max_concurrent: int, max_per_registry: int, poll_interval: float = 1.0,
+                 postpone_on_failure: bool = REGISTRY_POSTPONE_ON_FAILURE):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_registry = max(1, max_per_registry)
+        self.poll_interval = poll_interval
+        self.postpone_on_failure = postpone_on_failure
+        # task_id -> {"process", "registry", "builder", "labels", "started"}
+        self._running: dict[str, dict] = {}
+        # 因仓库不可用而推迟的任务 (只在首次推迟时写一次日志)
+        self._postponed: set[str] = set()
+        self.queued_count = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._recover_orphaned_tasks()
+        # 预先确定 Docker API 版本，fork 出的任务进程直接继承
+        threading.Thread(target=warm_up, name="docker-warm-up", daemon=True).start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="task-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def notify(self):
+        """有新任务入队时唤醒调度线程，无需等待下一个轮询周期"""
+        self._wakeup.set()
+
+    def enqueue(self, db: Session, project_id: str, task_id: str, tag: str, priority: int = 0, force: bool = False):
+        crud.create_task_log(db=db, project_id=project_id, task_id=task_id, tag=tag, status="QUEUED", priority=priority, force=force)
+        append_task_log(task_id, f"⏳ 任务已进入队列 (优先级: {priority})，等待空闲构建槽位...")
+        self.notify()
+
+    def enqueue_batch(self, db: Session, nodes: list[dict], priority: int = 0, force: bool = False) -> str:
+        """按拓扑顺序为 plan_batch 生成的节点创建任务，节点的 task_id 会被就地填入"""
+        batch_id = str(uuid.uuid4())
+        for node in nodes:
+            node["task_id"] = str(uuid.uuid4())
+            parent_ids = [nodes[i]["task_id"] for i in node["parents"]]
+            crud.create_task_log(db=db, project_id=node["project"].id, task_id=node["task_id"], tag=node["tag"],
+                                 status="WAITING" if parent_ids else "QUEUED", priority=priority, force=force, batch_id=batch_id)
+            if parent_ids:
+                crud.add_task_dependencies(db, node["task_id"], parent_ids)
+                parents = ", ".join(f"{nodes[i]['project'].name}:{nodes[i]['tag']}" for i in node["parents"])
+                append_task_log(node["task_id"], f"⏳ 批量构建 {batch_id}：等待上游任务完成 ({parents})...")
+            else:
+                append_task_log(node["task_id"], f"⏳ 批量构建 {batch_id}：任务已进入队列 (优先级: {priority})，等待空闲构建槽位...")
+        self.notify()
+        return batch_id
+
+    def builders_in_use(self) -> set[str]:
+        """正在运行的任务所使用的专用 builder"""
+        with self._lock:
+            return {info["builder"] for info in self._running.values() if info["builder"]}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            per_registry: dict[str, int] = {}
+            for info in self._running.values():
+                key = info["registry"]
+                per_registry[key] = per_registry.get(key, 0) + 1
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_per_registry": self.max_per_registry,
+                "running": list(self._running.keys()),
+                "running_per_registry": per_registry,
+                "postponed": sorted(self._postponed),
+            }
+
+    def _recover_orphaned_tasks(self):
+        # 上次退出时仍处于运行中的任务已随进程一起消失，标记为失败以免永远停留在 PENDING
+        db = SessionLocal()
+        try:
+            for task in crud.get_task_logs_by_status(db, ["PENDING"]):
+                append_task_log(task.id, "\n--- ❌ 服务重启，运行中的任务已中断 ---")
+                append_task_log(task.id, TASK_LOG_SENTINEL)
+                crud.update_task_status(db, task_id=task.id, new_status="FAILED")
+        finally:
+            db.close()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._reap()
+                self._release_waiting()
+                self._dispatch()
+            except Exception as e:
+                print(f"任务调度出错: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _reap(self):
+        with self._lock:
+            finished = [(tid, info) for tid, info in self._running.items() if not info["process"].is_alive()]
+            for tid, _ in finished:
+                del self._running[tid]
+        if not finished:
+            return
+
+        db = SessionLocal()
+        try:
+            for tid, info in finished:
+                proc = info["process"]
+                proc.join()
+                # 正常退出时 run_docker_task 已自行写入最终状态；进程异常崩溃时由这里兜底
+                task = crud.get_task_log(db, tid)
+                final_status = task.status if task else "DELETED"
+                if task and task.status == "PENDING":
+                    append_task_log(tid, f"\n--- ❌ 任务进程异常退出 (exit code: {proc.exitcode}) ---")
+                    append_task_log(tid, TASK_LOG_SENTINEL)
+                    crud.update_task_status(db, task_id=tid, new_status="FAILED")
+                    final_status = "FAILED"
+                metrics.TASK_DURATION_SECONDS.observe(time.monotonic() - info["started"], **info["labels"])
+                metrics.TASKS_TOTAL.inc(status=final_status, **info["labels"])
+        finally:
+            db.close()
+
+    def _release_waiting(self):
+        """上游全部成功的 WAITING 任务转为 QUEUED；上游失败、取消或已被删除时取消该任务 (逐层传递到整个下游子图)"""
+        db = SessionLocal()
+        try:
+            changed = True
+            while changed:
+                changed = False
+                waiting = crud.get_waiting_task_logs(db)
+                if not waiting:
+                    return
+                dependencies = crud.get_task_dependencies(db, [task.id for task in waiting])
+                parent_ids = {pid for pids in dependencies.values() for pid in pids}
+                statuses = {t.id: t.status for t in db.query(models.TaskLog).filter(models.TaskLog.id.in_(parent_ids)).all()}
+                for task in waiting:
+                    parents = dependencies[task.id]
+                    blocked = [pid for pid in parents if statuses.get(pid, "DELETED") in ("FAILED", "CANCELED", "DELETED")]
+                    if blocked:
+                        append_task_log(task.id, f"\n--- ❌ 上游任务 {', '.join(blocked)} 未成功，任务已取消 ---")
+                        append_task_log(task.id, TASK_LOG_SENTINEL)
+                        crud.update_task_status(db, task_id=task.id, new_status="CANCELED")
+                        changed = True
+                    elif all(statuses.get(pid) in ("SUCCESS", "SKIPPED") for pid in parents):
+                        append_task_log(task.id, f"--- ✅ 上游任务已全部完成，任务进入队列 (优先级: {task.priority}) ---")
+                        crud.update_task_status(db, task_id=task.id, new_status="QUEUED")
+        finally:
+            db.close()
+
+    def _dispatch(self):
+        db = SessionLocal()
+        try:
+            queued = crud.get_queued_task_logs(db)
+            self.queued_count = len(queued)
+            with self._lock:
+                self._postponed &= {task.id for task in queued}
+            for task in queued:
+                with self._lock:
+                    if len(self._running) >= self.max_concurrent:
+                        break
+                    running_keys = [info["registry"] for info in self._running.values()]
+
+                project = crud.get_project(db, task.project_id)
+                if not project:
+                    append_task_log(task.id, "\n--- ❌ 项目已不存在，任务取消 ---")
+                    append_task_log(task.id, TASK_LOG_SENTINEL)
+                    crud.update_task_status(db, task_id=task.id, new_status="FAILED")
+                    continue
+
+                registry_key = project.registry_id or DEFAULT_REGISTRY_KEY
+                if running_keys.count(registry_key) >= self.max_per_registry:
+                    continue
+                if self.postpone_on_failure and project.registry_id and registry_monitor.is_failing(project.registry_id):
+                    if task.id not in self._postponed:
+                        state = registry_monitor.get_state(project.registry_id) or {}
+                        append_task_log(task.id, f"--- ⏸️ 目标仓库当前不可用 ({state.get('error') or '探测失败'})，任务推迟启动，仓库恢复后自动继续 ---")
+                        with self._lock:
+                            self._postponed.add(task.id)
+                    continue
+                if task.id in self._postponed:
+                    append_task_log(task.id, "--- ▶️ 目标仓库已恢复，任务开始执行 ---")
+                    with self._lock:
+                        self._postponed.discard(task.id)
+
+                project_dict, cred_dict, proxy_dict = build_task_args(db, project)
+                crud.mark_task_started(db, task.id)
+
+                self.queued_count -= 1
+                platforms = [plat for plat in project_dict.get('platforms', '').split(',') if plat.strip()]
+                labels = {
+                    "project": project.name,
+                    "registry": project_dict['registry_url'].split("://", 1)[-1],
+                    "mode": "buildx" if len(platforms) > 1 else "standard",
+                }
+
+                process = multiprocessing.Process(
+                    target=run_docker_task,
+                    args=(task.id, project_dict, task.tag, cred_dict, proxy_dict, task.force)
+                )
+                process.daemon = True
+                try:
+                    process.start()
+                except Exception as e:
+                    # 任务已标记为 PENDING，进程没能启动时不会进入 _running，由这里直接标记失败
+                    append_task_log(task.id, f"\n--- ❌ 无法启动任务进程: {e} ---")
+                    append_task_log(task.id, TASK_LOG_SENTINEL)
+                    crud.update_task_status(db, task_id=task.id, new_status="FAILED")
+                    metrics.TASKS_TOTAL.inc(status="FAILED", **labels)
+                    continue
+                # 任务进程使用的专用 builder，builder 池不会回收仍在使用中的 builder
+                builder_spec = BuilderSpec.for_registry(project_dict['registry_url'])
+                with self._lock:
+                    self._running[task.id] = {"process": process, "registry": registry_key,
+                                              "builder": builder_spec.name if builder_spec else None,
+                                              "labels": labels, "started": time.monotonic()}
+        finally:
+            db.close()
+
+task_scheduler = TaskScheduler(MAX_CONCURRENT_TASKS, MAX_TASKS_PER_REGISTRY)
+metrics.TASKS_RUNNING.set_function(lambda: len(task_scheduler._running))
+metrics.TASKS_QUEUED.set_function(lambda: task_scheduler.queued_count)
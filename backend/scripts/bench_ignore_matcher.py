@@ -0,0 +1,81 @@
+import sys
+import os
+import fnmatch
+import random
+import tempfile
+import time
+
+# Add the parent directory to sys.path to import app modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.services.ignore_patterns import IgnoreMatcher, walk_files
+
+PATTERNS = [
+    "__pycache__", "*.pyc", ".git", ".svn", ".hg", "node_modules", "venv", ".venv", "env", ".env",
+    "target", ".vscode", ".idea", "dist", "build", "*.log", "*.tmp", "coverage", ".pytest_cache", "*.swp",
+]
+DIR_NAMES = ["src", "lib", "pkg", "core", "utils", "api", "models", "views", "tests", "node_modules", "build", "__pycache__"]
+FILE_NAMES = ["main.py", "util.py", "index.js", "app.log", "cache.pyc", "README.md", "data.json", "style.css", "notes.tmp"]
+
+def make_tree(root: str, n_files: int):
+    random.seed(0)
+    for i in range(n_files):
+        depth = random.randint(0, 6)
+        rel_dir = os.path.join(*(random.choice(DIR_NAMES) for _ in range(depth))) if depth else ""
+        path = os.path.join(root, rel_dir)
+        os.makedirs(path, exist_ok=True)
+        open(os.path.join(path, f"{i}_{random.choice(FILE_NAMES)}"), "w").close()
+
+def legacy_walk(build_path: str, ignore_patterns: list[str]) -> list[str]:
+    # 旧实现：os.walk + 每个路径对每条规则重新 strip 后调用 fnmatch
+    include_files = []
+    for root, dirs, files in os.walk(build_path):
+        rel_root = os.path.relpath(root, build_path)
+        if rel_root == ".":
+            rel_root = ""
+        dirs_to_keep = []
+        for d in dirs:
+            rel_dir = os.path.join(rel_root, d).replace(os.sep, '/')
+            is_ignored = False
+            for pattern in ignore_patterns:
+                p = pattern.strip()
+                if not p: continue
+                clean_pattern = p.lstrip('/')
+                if fnmatch.fnmatch(rel_dir if '/' in clean_pattern else d, clean_pattern):
+                    is_ignored = True
+                    break
+            if not is_ignored:
+                dirs_to_keep.append(d)
+        dirs[:] = dirs_to_keep
+        for f in files:
+            rel_file = os.path.join(rel_root, f).replace(os.sep, '/')
+            is_ignored = False
+            for pattern in ignore_patterns:
+                p = pattern.strip()
+                if not p: continue
+                clean_pattern = p.lstrip('/')
+                if fnmatch.fnmatch(rel_file if '/' in clean_pattern else f, clean_pattern):
+                    is_ignored = True
+                    break
+            if not is_ignored:
+                include_files.append(rel_file)
+    return include_files
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with tempfile.TemporaryDirectory() as tmp:
+        make_tree(tmp, n)
+        results = {}
+        for name, fn in [
+            ("os.walk + fnmatch", lambda: legacy_walk(tmp, PATTERNS)),
+            ("scandir + matcher", lambda: list(walk_files(tmp, IgnoreMatcher(PATTERNS)))),
+        ]:
+            fn()  # 预热目录缓存
+            start = time.perf_counter()
+            files = fn()
+            elapsed = time.perf_counter() - start
+            results[name] = sorted(files)
+            print(f"{name:>18}: {n} files, {len(files)} kept in {elapsed:.3f}s")
+        print("results identical:", len(set(map(tuple, results.values()))) == 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import sys
+import os
+import tempfile
+import time
+from pathlib import Path
+
+# Add the parent directory to sys.path to import app modules
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.services.log_sink import TaskLogSink
+
+LINE = "#12 [linux/arm64 builder 4/9] RUN apt-get update && apt-get install -y build-essential curl git"
+
+def bench_open_append_close(path: Path, n: int) -> float:
+    # 旧实现：每行都 open/append/close
+    start = time.perf_counter()
+    for _ in range(n):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(LINE.strip() + "\n")
+    return time.perf_counter() - start
+
+def bench_sink(path: Path, n: int) -> float:
+    start = time.perf_counter()
+    sink = TaskLogSink(path)
+    for _ in range(n):
+        sink.write(LINE)
+    sink.finish()
+    return time.perf_counter() - start
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, fn in [("open-append-close", bench_open_append_close), ("TaskLogSink", bench_sink)]:
+            path = Path(tmp) / f"{name}.log"
+            elapsed = fn(path, n)
+            print(f"{name:>18}: {n} lines in {elapsed:.3f}s -> {n / elapsed:,.0f} lines/s")
+
+if __name__ == "__main__":
+    main()
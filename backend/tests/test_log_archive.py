@@ -0,0 +1,27 @@
+from app.core.config import TASK_LOG_SENTINEL
+from app.services import log_archive
+from app.services.log_archive import archive_task_log, open_archived_log
+from app.services.log_reader import PlainLog
+
+# 含 \r 进度输出 (apt/curl/pip) 的日志，归档前后按行号读取的结果必须一致
+LOG = (b"step 1\n" + b"progress 10%\rprogress 50%\rprogress 100%\n" + b"a\x0bb\x0cc\n" * 3
+       + b"done\n" + TASK_LOG_SENTINEL.encode() + b"\n")
+
+def test_archive_round_trip_keeps_line_numbers(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_archive, "LOG_DIR", tmp_path)
+    log_path = tmp_path / "task.log"
+    log_path.write_bytes(LOG)
+    plain = PlainLog(log_path)
+    expected = {(offset, limit): list(plain.iter_lines(offset, limit))
+                for offset in range(8) for limit in (None, 1, 2, 3)}
+    expected_tail = b"".join(plain.iter_tail(3))
+
+    # 小块确保行跨越多个 gzip member
+    assert archive_task_log(log_path, block_size=16)
+    archive = open_archived_log("task")
+    assert archive.lines == LOG.count(b"\n")
+    for (offset, limit), lines in expected.items():
+        assert list(archive.iter_lines(offset, limit)) == lines
+    assert b"".join(archive.iter_tail(3)) == expected_tail
+    assert [line for block in archive.iter_line_blocks() for line in block] == LOG.decode().split("\n")[:-1]
+    assert b"".join(archive.iter_bytes()) == LOG
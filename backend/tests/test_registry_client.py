@@ -0,0 +1,154 @@
+import base64
+import hashlib
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+pytest.importorskip("requests")
+
+from app.services.registry_client import RegistryClient, RegistryError
+
+# 最小的 Registry v2 替身：令牌服务 (Bearer) 或 Basic 鉴权，清单 GET/HEAD/PUT
+USER, PASSWORD = "ci", "secret"
+MEDIA_TYPE = "application/vnd.oci.image.manifest.v1+json"
+MANIFEST = json.dumps({"schemaVersion": 2, "mediaType": MEDIA_TYPE, "layers": []}).encode()
+
+class FakeRegistry:
+    def __init__(self, auth: str = "bearer", head_digest: bool = True, put_digest: str | None = None):
+        self.auth = auth
+        self.head_digest = head_digest
+        self.put_digest = put_digest
+        self.manifests: dict[tuple[str, str], tuple[bytes, str]] = {}
+        # (方法, 类别) -> 次数；类别为 token / unauthorized / manifest
+        self.calls: Counter = Counter()
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code: int, body: bytes = b"", headers: dict | None = None):
+                self.send_response(code)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def _basic_ok(self) -> bool:
+                expected = "Basic " + base64.b64encode(f"{USER}:{PASSWORD}".encode()).decode()
+                return self.headers.get("Authorization") == expected
+
+            def _handle(self):
+                path, _, query = self.path.partition("?")
+                if path == "/token":
+                    registry.calls[(self.command, "token")] += 1
+                    params = parse_qs(query)
+                    if not self._basic_ok() or params.get("service") != ["fake"]:
+                        return self._send(401)
+                    token = "tok-" + params["scope"][0]
+                    return self._send(200, json.dumps({"token": token}).encode())
+
+                # /v2/<repo>/manifests/<reference>
+                repo, _, reference = path[len("/v2/"):].rpartition("/manifests/")
+                if registry.auth == "bearer":
+                    scope = f"repository:{repo}:pull,push"
+                    if self.headers.get("Authorization") != f"Bearer tok-{scope}":
+                        registry.calls[(self.command, "unauthorized")] += 1
+                        realm = f"http://127.0.0.1:{registry.port}/token"
+                        return self._send(401, headers={
+                            "WWW-Authenticate": f'Bearer realm="{realm}",service="fake",scope="{scope}"'})
+                elif not self._basic_ok():
+                    registry.calls[(self.command, "unauthorized")] += 1
+                    return self._send(401, headers={"WWW-Authenticate": 'Basic realm="fake"'})
+
+                registry.calls[(self.command, "manifest")] += 1
+                if self.command == "PUT":
+                    body = self.rfile.read(int(self.headers["Content-Length"]))
+                    registry.manifests[(repo, reference)] = (body, self.headers["Content-Type"])
+                    digest = registry.put_digest or "sha256:" + hashlib.sha256(body).hexdigest()
+                    return self._send(201, headers={"Docker-Content-Digest": digest})
+                if (repo, reference) not in registry.manifests:
+                    return self._send(404)
+                body, media_type = registry.manifests[(repo, reference)]
+                headers = {"Content-Type": media_type}
+                if self.command == "GET" or registry.head_digest:
+                    headers["Docker-Content-Digest"] = "sha256:" + hashlib.sha256(body).hexdigest()
+                return self._send(200, body, headers)
+
+            do_GET = do_HEAD = do_PUT = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def make_registry():
+    registries = []
+
+    def make(**kwargs) -> FakeRegistry:
+        registry = FakeRegistry(**kwargs)
+        registry.manifests[("team/app", "v1")] = (MANIFEST, MEDIA_TYPE)
+        registries.append(registry)
+        return registry
+
+    yield make
+    for registry in registries:
+        registry.close()
+
+def test_retag_with_bearer_token_fetches_token_once(make_registry):
+    registry = make_registry()
+    client = RegistryClient(registry.url, USER, PASSWORD)
+    digest = "sha256:" + hashlib.sha256(MANIFEST).hexdigest()
+
+    assert list(client.retag("team/app", "v1", ["v1.0", "latest"])) == [("v1.0", digest), ("latest", digest)]
+    # 首次访问被质询一次，换取一次令牌，之后一次 GET 加上每个标签一次 PUT
+    assert registry.calls == Counter({("GET", "unauthorized"): 1, ("GET", "token"): 1,
+                                      ("GET", "manifest"): 1, ("PUT", "manifest"): 2})
+    assert registry.manifests[("team/app", "latest")] == (MANIFEST, MEDIA_TYPE)
+
+def test_basic_auth_registry(make_registry):
+    registry = make_registry(auth="basic")
+    client = RegistryClient(registry.url, USER, PASSWORD)
+
+    assert [tag for tag, _ in client.retag("team/app", "v1", ["v2"])] == ["v2"]
+    assert registry.calls[("GET", "token")] == 0
+    assert registry.calls[("GET", "unauthorized")] == 1
+    assert registry.calls[("PUT", "manifest")] == 1
+
+def test_basic_auth_without_credentials_fails(make_registry):
+    registry = make_registry(auth="basic")
+    with pytest.raises(RegistryError):
+        RegistryClient(registry.url).head_digest("team/app", "v1")
+
+def test_digest_mismatch_after_put_raises(make_registry):
+    registry = make_registry(put_digest="sha256:" + "0" * 64)
+    client = RegistryClient(registry.url, USER, PASSWORD)
+    with pytest.raises(RegistryError):
+        list(client.retag("team/app", "v1", ["latest"]))
+
+def test_head_digest_falls_back_to_get(make_registry):
+    registry = make_registry(head_digest=False)
+    client = RegistryClient(registry.url, USER, PASSWORD)
+
+    assert client.head_digest("team/app", "v1") == "sha256:" + hashlib.sha256(MANIFEST).hexdigest()
+    assert registry.calls[("HEAD", "manifest")] == 1
+    assert registry.calls[("GET", "manifest")] == 1
+    assert client.head_digest("team/app", "missing") is None
+
+def test_docker_hub_official_images_get_library_prefix():
+    client = RegistryClient("docker.io")
+    assert client.base_url == "https://registry-1.docker.io"
+    assert client.repository("nginx") == "library/nginx"
+    assert client.repository("team/app") == "team/app"
+    assert RegistryClient("https://registry.example.com").repository("nginx") == "nginx"